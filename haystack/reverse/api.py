@@ -2,13 +2,18 @@
 
 from __future__ import print_function
 import logging
+import os
 
 from haystack.abc import interfaces
 from haystack.reverse import config
 from haystack.reverse import context
+from haystack.reverse import incremental
+from haystack.reverse import recordtable
+from haystack.reverse import typelibrary
 from haystack.reverse.heuristics import reversers
 from haystack.reverse.heuristics import dsa
 from haystack.reverse.heuristics import pointertypes
+from haystack.reverse.heuristics import signature
 
 log = logging.getLogger('reverse.api')
 
@@ -86,19 +91,41 @@ def reverse_heap(memory_handler, heap_addr):
     return heap_context
 
 
-def reverse_instances(memory_handler):
+def get_type_library(type_library=None):
+    """
+    Returns the type signatures library to use, or None.
+
+    :param type_library: the library folder. Defaults to $HAYSTACK_TYPE_LIBRARY, if set.
+    """
+    if type_library is None:
+        type_library = os.environ.get(config.TYPE_LIBRARY_ENV)
+    if type_library is None:
+        return None
+    return typelibrary.TypeLibrary(type_library)
+
+
+def reverse_instances(memory_handler, previous_dumpname=None, type_library=None, processes=1):
     """
     Reverse all heaps in process from memory_handler
 
+    0. incremental.IncrementalReverser, if previous_dumpname is set
     1. dsa.FieldReverser
     2. dsa.TextFieldCorrection
     3. reversers.DoubleLinkedListReverser
     4. pointertypes.PointerFieldReverser
-    5. save
-    6. reversers.PointerGraphReverser
-    7. reversers.StringsReverser
+    5. signature.TypeReverser, if there is a type library
+    6. save
+    7. reversers.PointerGraphReverser
+    8. reversers.StringsReverser
 
     :param memory_handler:
+    :param previous_dumpname: a previously reversed dump of the same process.
+        The records of unchanged allocations are reused from that dump.
+    :param type_library: the type signatures library folder. Defaults to
+        $HAYSTACK_TYPE_LIBRARY. Records of known types are named from it, and
+        the new types are added to it.
+    :param processes: the number of worker processes comparing the signatures
+        of each size in signature.TypeReverser
     :return:
     """
     assert isinstance(memory_handler, interfaces.IMemoryHandler)
@@ -107,6 +134,15 @@ def reverse_instances(memory_handler):
     #    # reverse all fields in all records from that heap
     #    ## reverse_heap(memory_handler, heap_addr)
 
+    if previous_dumpname is not None:
+        log.info('Reusing records from %s', previous_dumpname)
+        ir = incremental.IncrementalReverser(memory_handler, previous_dumpname)
+        ir.reverse()
+        stats = ir.get_statistics()
+        log.info('Incremental: %(unchanged)d/%(allocations)d allocations unchanged, %(reused)d records reused, '
+                 '%(changed)d changed and %(new)d new allocations to reverse, '
+                 '%(stale)d reused records pointing to them', stats)
+
     log.info('Reversing Fields')
     fr = dsa.FieldReverser(memory_handler)
     fr.reverse()
@@ -128,12 +164,21 @@ def reverse_instances(memory_handler):
     pfr = pointertypes.PointerFieldReverser(memory_handler)
     pfr.reverse()
 
+    # name the types, known types from the library first
+    library = get_type_library(type_library)
+    if library is not None:
+        log.info('Reversing types, with the type library of %d types', len(library))
+        tr = signature.TypeReverser(memory_handler, processes=processes, library=library)
+        tr.reverse()
+
     # save that
     log.info('Saving reversed records instances')
     for heap_context in process_context.list_contextes():
         heap_context.save_structures()
         # save to file
         save_headers(heap_context)
+        # the record table of all records, for the growth analysis
+        recordtable.update_dirty_rows(heap_context)
 
     log.info('Saving reversed records types')
     process_context.save_reversed_types()
@@ -175,3 +220,27 @@ def get_record_predecessors(memory_handler, record):
     process_context = memory_handler.get_reverse_context()
     _records = process_context.get_predecessors(record)
     return _records
+
+
+def get_memory_differences(memory_handler1, memory_handler2):
+    """
+    Compares the memory mappings contents of two memory dumps of the same process.
+    Mappings are paired by start address.
+
+    :param memory_handler1: the reference memory handler
+    :param memory_handler2: the other memory handler
+    :return: list of (mapping, starts, ends) for the mappings of memory_handler1 with changes,
+        starts and ends being int64 arrays of addresses of the changed bytes ranges.
+    """
+    from haystack.reverse import diff
+    mappings2 = dict((m.start, m) for m in memory_handler2.get_mappings())
+    res = []
+    for mapping in memory_handler1.get_mappings():
+        if mapping.start not in mappings2:
+            log.debug('No mapping at 0x%x in %s', mapping.start, memory_handler2.get_name())
+            continue
+        starts, ends = diff.diff_mappings(mapping, mappings2[mapping.start])
+        if len(starts) > 0:
+            log.debug('%s: %d changed ranges, %d bytes', mapping, len(starts), (ends - starts).sum())
+            res.append((mapping, starts, ends))
+    return res
@@ -5,12 +5,20 @@ from __future__ import print_function
 
 """Entry points related to reverse. """
 
+import argparse
+import binascii
+import json
+import logging
+import multiprocessing
 import os
 import sys
 
 from haystack import argparse_utils
 from haystack import cli
 from haystack.reverse import api
+from haystack.reverse import query
+
+log = logging.getLogger('cli')
 
 # the description of the function
 REVERSE_DESC = 'Reverse the data structure from the process memory'
@@ -19,16 +27,172 @@ REVERSE_PARENT_DESC = 'List the predecessors pointing to the record at this addr
 REVERSE_HEX_DESC = 'Show the Hex values for the record at that address.'
 
 
-def show_hex(args):
-    """ Show the Hex values for the record at that address. """
-    memory_handler = cli.make_memory_handler(args)
+# number of addresses resolved at once in batch mode
+BATCH_SIZE = 10000
+
+
+def _make_memory_handler(args):
+    """Returns the memory handler of the dump. Folder dumps are loaded with query.load_folder_dump."""
+    if args.target.scheme.lower() == 'dir':
+        return query.load_folder_dump(args.target.path, bits=args.bits, os_name=args.osname)
+    return cli.make_memory_handler(args)
+
+
+def _get_record_query(memory_handler):
+    """Returns the light query path on an already reversed dump, or None"""
+    try:
+        return query.RecordQuery(memory_handler)
+    except IOError as e:
+        log.debug('%s, using the reverse context', e)
+        return None
+
+
+def _iter_addresses(args, batch_size=BATCH_SIZE):
+    """
+    Yields lists of addresses, from the command line, then from the --file.
+    Addresses are read from stdin if there are none on the command line.
+    """
+    if len(args.addresses) > 0:
+        yield args.addresses
+    fin = args.file
+    if fin is None and len(args.addresses) == 0:
+        fin = sys.stdin
+    if fin is None:
+        return
+    addresses = []
+    for line in fin:
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        addresses.append(argparse_utils.int16(line))
+        if len(addresses) == batch_size:
+            yield addresses
+            addresses = []
+    if len(addresses) > 0:
+        yield addresses
+    return
+
+
+def _is_batch(args):
+    return args.file is not None or len(args.addresses) != 1
+
+
+def _output(args, address, text, values):
+    """Print the result for an address, as text or as a JSON line"""
+    if args.json:
+        res = {'address': '0x%x' % address}
+        res.update(values)
+        print(json.dumps(res, sort_keys=True))
+        return
+    if _is_batch(args):
+        print('# 0x%x' % address)
+    print(text)
+    return
+
+
+def _get_record_from_context(memory_handler, address):
+    """Returns the record at that address from the reverse context, or None"""
     process_context = memory_handler.get_reverse_context()
-    ctx = process_context.get_context_for_address(args.address)
     try:
-        st = ctx.get_record_at_address(args.address)
-        print(repr(st.bytes))
-    except ValueError as e:
-        print(None)
+        ctx = process_context.get_context_for_address(address)
+        return ctx.get_record_at_address(address)
+    except (ValueError, IndexError) as e:
+        return None
+
+
+def _iter_records(memory_handler, record_query, addresses):
+    """
+    Yields the address and the record at that address, or None, for each address.
+    Records are read from the records cache if possible.
+    """
+    if record_query is None:
+        for address in addresses:
+            yield address, _get_record_from_context(memory_handler, address)
+        return
+    record_addresses, _ = record_query.get_records_addresses_at_addresses(addresses)
+    for address, record_address in zip(addresses, record_addresses.tolist()):
+        _record = None
+        if record_address != query.NO_RECORD:
+            try:
+                _record = record_query.get_record(record_address)
+            except IOError as e:
+                log.debug('%s, using the reverse context', e)
+                _record = _get_record_from_context(memory_handler, address)
+        yield address, _record
+    return
+
+
+def _get_record_predecessors(memory_handler, record_query, record):
+    """Returns the predecessors of that record, from the records cache if possible"""
+    if record_query is not None:
+        try:
+            return record_query.get_predecessors(record)
+        except IOError as e:
+            log.debug('%s, using the reverse context', e)
+    return api.get_record_predecessors(memory_handler, record)
+
+
+def _iter_records_bytes(memory_handler, record_query, addresses):
+    """Yields the address, the record address and the record bytes, or None, for each address"""
+    if record_query is not None:
+        for address, (record_address, _bytes) in zip(addresses, record_query.iter_records_bytes(addresses)):
+            yield address, record_address, _bytes
+        return
+    for address, _record in _iter_records(memory_handler, None, addresses):
+        if _record is None:
+            yield address, query.NO_RECORD, None
+        else:
+            yield address, _record.address, _record.bytes
+    return
+
+
+def _get_client_text(client, command, values):
+    """Returns the text output of a daemon response"""
+    if values['record'] is None:
+        return None
+    if command == 'hex':
+        return repr(binascii.unhexlify(values['bytes']))
+    if command == 'parents':
+        if len(values['parents']) == 0:
+            return None
+        return '\n'.join('#%s\n%s\n' % (parent, client.query('show', int(parent, 16))['text'])
+                         for parent in values['parents'])
+    return values['text']
+
+
+def _query_daemon(args, command):
+    """Send the queries to the daemon listening on --socket"""
+    from haystack.reverse import daemon
+    client = daemon.QueryClient(args.socket)
+    try:
+        for addresses in _iter_addresses(args):
+            for address in addresses:
+                try:
+                    values = client.query(command, address)
+                    text = _get_client_text(client, command, values)
+                except ValueError as e:
+                    log.error('0x%x: %s', address, e)
+                    continue
+                del values['address']
+                _output(args, address, text, values)
+    finally:
+        client.close()
+    return
+
+
+def show_hex(args):
+    """ Show the Hex values for the record at that address. """
+    if args.socket is not None:
+        return _query_daemon(args, 'hex')
+    memory_handler = _make_memory_handler(args)
+    record_query = _get_record_query(memory_handler)
+    for addresses in _iter_addresses(args):
+        for address, record_address, _bytes in _iter_records_bytes(memory_handler, record_query, addresses):
+            if _bytes is None:
+                _output(args, address, None, {'record': None, 'bytes': None})
+                continue
+            _output(args, address, repr(_bytes),
+                    {'record': '0x%x' % record_address, 'bytes': binascii.hexlify(_bytes).decode('ascii')})
     return
 
 
@@ -38,34 +202,39 @@ def show_predecessors_cmdline(args):
     :param args: cmdline args
     :return:
     """
-    memory_handler = cli.make_memory_handler(args)
-    process_context = memory_handler.get_reverse_context()
-    ctx = process_context.get_context_for_address(args.address)
-    try:
-        child_record = ctx.get_record_at_address(args.address)
-    except ValueError as e:
-        print(None)
-        return
-
-    records = api.get_record_predecessors(memory_handler, child_record)
-    if len(records) == 0:
-        print(None)
-    else:
-        for p_record in records:
-            print('#0x%x\n%s\n' % (p_record.address, p_record.to_string()))
+    if args.socket is not None:
+        return _query_daemon(args, 'parents')
+    memory_handler = _make_memory_handler(args)
+    record_query = _get_record_query(memory_handler)
+    for addresses in _iter_addresses(args):
+        for address, child_record in _iter_records(memory_handler, record_query, addresses):
+            if child_record is None:
+                _output(args, address, None, {'record': None, 'parents': None})
+                continue
+            records = _get_record_predecessors(memory_handler, record_query, child_record)
+            if len(records) == 0:
+                text = None
+            else:
+                text = '\n'.join('#0x%x\n%s\n' % (p_record.address, p_record.to_string()) for p_record in records)
+            _output(args, address, text, {'record': '0x%x' % child_record.address,
+                                          'parents': ['0x%x' % p_record.address for p_record in records]})
     return
 
 
 def reverse_show_cmdline(args):
     """ Show the record at a specific address. """
-    memory_handler = cli.make_memory_handler(args)
-    process_context = memory_handler.get_reverse_context()
-    ctx = process_context.get_context_for_address(args.address)
-    try:
-        st = ctx.get_record_at_address(args.address)
-        print(st.to_string())
-    except ValueError:
-        print(None)
+    if args.socket is not None:
+        return _query_daemon(args, 'show')
+    memory_handler = _make_memory_handler(args)
+    record_query = _get_record_query(memory_handler)
+    for addresses in _iter_addresses(args):
+        for address, st in _iter_records(memory_handler, record_query, addresses):
+            if st is None:
+                _output(args, address, None, {'record': None, 'type': None, 'text': None})
+                continue
+            _output(args, address, st.to_string(), {'record': '0x%x' % st.address,
+                                                    'type': st.record_type.type_name,
+                                                    'text': st.to_string()})
     return
 
 
@@ -75,7 +244,21 @@ def reverse_cmdline(args):
     # get the memory handler adequate for the type requested
     memory_handler = cli.make_memory_handler(args)
     # do the search
-    rapi.reverse_instances(memory_handler)
+    rapi.reverse_instances(memory_handler, previous_dumpname=args.previous, type_library=args.type_library,
+                           processes=args.processes)
+    return
+
+
+def _add_addresses_arguments(rootparser, addresses_help):
+    """Addresses arguments of the query commands"""
+    rootparser.add_argument('addresses', type=argparse_utils.int16, nargs='*', metavar='address',
+                            help='%s. Read from stdin if none is given.' % addresses_help)
+    rootparser.add_argument('--file', type=argparse.FileType('r'), default=None,
+                            help='A file of hex addresses, one per line.')
+    rootparser.add_argument('--json', action='store_true', help='Output one JSON object per line.')
+    rootparser.add_argument('--socket', default=None,
+                            help='Query the haystack-reverse-daemon listening on this Unix socket, '
+                                 'instead of loading the dump.')
     return
 
 
@@ -83,6 +266,15 @@ def reverse():
     argv = sys.argv[1:]
     desc = REVERSE_DESC
     rootparser = cli.base_argparser(program_name=os.path.basename(sys.argv[0]), description=desc)
+    rootparser.add_argument('--previous', type=argparse_utils.readable, action='store', default=None,
+                            help='A previously reversed dump of the same process. '
+                                 'Unchanged allocations reuse its records.')
+    rootparser.add_argument('--type-library', default=None,
+                            help='A type signatures library folder, shared between dumps. Records of known types '
+                                 'are named from it, new types are added to it. Defaults to $HAYSTACK_TYPE_LIBRARY.')
+    rootparser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='The number of worker processes comparing the records types signatures. '
+                                 'Defaults to the number of CPUs.')
     rootparser.set_defaults(func=reverse_cmdline)
     opts = rootparser.parse_args(argv)
     # apply verbosity
@@ -96,7 +288,7 @@ def reverse_show():
     argv = sys.argv[1:]
     desc = REVERSE_SHOW_DESC
     rootparser = cli.base_argparser(program_name=os.path.basename(sys.argv[0]), description=desc)
-    rootparser.add_argument('address', type=argparse_utils.int16, help='Record memory address in hex')
+    _add_addresses_arguments(rootparser, 'Record memory addresses in hex')
     rootparser.set_defaults(func=reverse_show_cmdline)
     opts = rootparser.parse_args(argv)
     # apply verbosity
@@ -110,8 +302,7 @@ def reverse_parents():
     argv = sys.argv[1:]
     desc = REVERSE_PARENT_DESC
     rootparser = cli.base_argparser(program_name=os.path.basename(sys.argv[0]), description=desc)
-    rootparser.add_argument('address', type=argparse_utils.int16, action='store', default=None,
-                            help='Hex address of the child structure')
+    _add_addresses_arguments(rootparser, 'Hex addresses of the child structures')
     rootparser.set_defaults(func=show_predecessors_cmdline)
     opts = rootparser.parse_args(argv)
     # apply verbosity
@@ -125,8 +316,7 @@ def reverse_hex():
     argv = sys.argv[1:]
     desc = REVERSE_HEX_DESC
     rootparser = cli.base_argparser(program_name=os.path.basename(sys.argv[0]), description=desc)
-    rootparser.add_argument('address', type=argparse_utils.int16, action='store', default=None,
-                            help='Specify the address of the record, or encompassed by the record')
+    _add_addresses_arguments(rootparser, 'Specify the addresses of the records, or encompassed by the records')
     rootparser.set_defaults(func=show_hex)
     opts = rootparser.parse_args(argv)
     # apply verbosity
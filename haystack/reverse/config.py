@@ -29,17 +29,31 @@ CACHE_FUNCTION_NAMES = 'names.pointers.functions'
 CACHE_STRUCTURES = 'allocators'
 CACHE_MALLOC_CHUNKS_ADDRS = 'mchunks.addrs'
 CACHE_MALLOC_CHUNKS_SIZES = 'mchunks.sizes'
+CACHE_MALLOC_CHUNKS_HASHES = 'mchunks.hashes'
+CACHE_RECORD_TABLE = 'records.table'
+CACHE_RECORD_TABLE_LAYOUTS = 'records.table.layouts'
+CACHE_RECORD_TABLE_TYPES = 'records.table.types'
 CACHE_CONTEXT = 'ctx'
 CACHE_GRAPH = 'graph.gexf'
 CACHE_GRAPH_HEAP = 'graph.heaps.gexf'
+CACHE_GRAPH_PREDECESSORS_TARGETS = 'graph.predecessors.targets'
+CACHE_GRAPH_PREDECESSORS_SOURCES = 'graph.predecessors.sources'
 DIFF_PY_HEADERS = 'diff_headers'
-CACHE_SIGNATURE_SIZES_DIR = 'structs.sizes.d'
-CACHE_SIGNATURE_SIZES_DIR_TAG = 'done'
+CACHE_SIGNATURE_SIZES_INDEX = 'structs.sizes.index'
 CACHE_SIGNATURE_GROUPS_DIR = 'structs.groups.d'
 CACHE_STRINGS = 'strings'
+CACHE_STRINGS_TABLE = 'strings.table'
+CACHE_STRINGS_VALUES = 'strings.values'
+CACHE_STRINGS_VALUES_OFFSETS = 'strings.values.offsets'
 REVERSED_TYPES_FILENAME = 'reversed_types.py'
 SIGNATURES_FILENAME = 'signatures'
 WORDS_FOR_REVERSE_TYPES_FILE = 'data/words.100'
+# persistent type signatures library, shared by all dumps
+TYPE_LIBRARY_ENV = 'HAYSTACK_TYPE_LIBRARY'
+TYPE_LIBRARY_DEFAULT_FOLDER = os.path.sep.join(['~', '.haystack', 'types'])
+TYPE_LIBRARY_ENTRIES = 'types.entries'
+TYPE_LIBRARY_HASH_INDEX = 'types.hashes'
+TYPE_LIBRARY_SIZE_INDEX = 'types.sizes'
 
 
 def create_cache_folder(dumpname):
@@ -81,6 +95,16 @@ def get_cache_filename(typ, dumpname, address=None):
     return os.path.sep.join([get_cache_folder_name(dumpname), fname])
 
 
+def get_type_library_folder(folder=None):
+    """
+    Returns the folder of the type signatures library.
+    Defaults to the HAYSTACK_TYPE_LIBRARY environment variable, or ~/.haystack/types
+    """
+    if folder is None:
+        folder = os.environ.get(TYPE_LIBRARY_ENV, TYPE_LIBRARY_DEFAULT_FOLDER)
+    return os.path.abspath(os.path.expanduser(folder))
+
+
 def get_record_cache_folder_name(dumpname):
     """
     Returns a dirname for caching the allocators based on the dump filename.
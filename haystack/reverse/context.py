@@ -5,6 +5,7 @@ from __future__ import print_function
 from past.builtins import long
 from builtins import map
 
+import bisect
 import logging
 import pickle
 # import dill as pickle
@@ -19,10 +20,58 @@ from haystack.reverse import structure
 from haystack.reverse import searchers
 from haystack.reverse import matchers
 from haystack.reverse import enumerators
+from haystack.reverse import graphindex
+from haystack.reverse import recordtable
 
 
 log = logging.getLogger('context')
 
+# context id of an address out of any heap
+NO_CONTEXT = -1
+
+
+class HeapRangeIndex(object):
+    """
+    Sorted address ranges of the heaps, to resolve addresses to a heap id.
+
+    :param starts: start addresses of the heaps
+    :param ends: end addresses of the heaps, exclusive
+    """
+
+    def __init__(self, starts, ends):
+        starts = numpy.asarray(starts, dtype=numpy.uint64)
+        ends = numpy.asarray(ends, dtype=numpy.uint64)
+        order = numpy.argsort(starts, kind='mergesort')
+        self.starts = starts[order]
+        self.ends = ends[order]
+        # ids are the positions of the ranges in the arguments
+        self.ids = order.astype(numpy.int64)
+        self._starts_list = self.starts.tolist()
+        self._ends_list = self.ends.tolist()
+        self._ids_list = self.ids.tolist()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_id(self, address):
+        """Returns the id of the heap hosting this address, or NO_CONTEXT"""
+        i = bisect.bisect_right(self._starts_list, address) - 1
+        if i < 0 or address >= self._ends_list[i]:
+            return NO_CONTEXT
+        return self._ids_list[i]
+
+    def get_ids(self, addresses):
+        """Returns an int64 array of the ids of the heaps hosting these addresses, NO_CONTEXT when none"""
+        addresses = numpy.asarray(addresses, dtype=numpy.uint64)
+        res = numpy.full(len(addresses), NO_CONTEXT, dtype=numpy.int64)
+        if len(self.starts) == 0:
+            return res
+        index = numpy.searchsorted(self.starts, addresses, side='right').astype(numpy.int64) - 1
+        inside = index >= 0
+        inside[inside] = addresses[inside] < self.ends[index[inside]]
+        res[inside] = self.ids[index[inside]]
+        return res
+
 
 class ProcessContext(object):
     """
@@ -30,13 +79,14 @@ class ProcessContext(object):
     """
     def __init__(self, memory_handler):
         self.memory_handler = memory_handler
-        # init heaps
+        # heaps contexts are made on first access
         self.__contextes = {}
-        for walker in self.memory_handler.get_heap_finder().list_heap_walkers():
-            self.get_context_for_heap_walker(walker)
+        self.__heaps_index = None
+        self.__heaps_walkers = None
         # init reversed types
         self.__reversed_types = {}
         self.__record_graph = None
+        self.__predecessors_index = None
         # see bug #17 self.__model = model.Model(self.memory_handler)
         # no need for that
         # create the cache folder then
@@ -101,21 +151,55 @@ class ProcessContext(object):
             return heap_context
         return self.__contextes[heap_address]
 
+    def _get_heaps_walkers(self):
+        """Returns the heap walkers of the process, sorted by heap address"""
+        if self.__heaps_walkers is None:
+            self.__heaps_walkers = list(self.memory_handler.get_heap_finder().list_heap_walkers())
+        return self.__heaps_walkers
+
+    def _get_heaps_index(self):
+        """Builds the address ranges index of the heaps, without making their HeapContext"""
+        if self.__heaps_index is None:
+            starts = []
+            ends = []
+            for walker in self._get_heaps_walkers():
+                heap_mapping = self.memory_handler.get_mapping_for_address(walker.get_heap_address())
+                starts.append(heap_mapping.start)
+                ends.append(heap_mapping.end)
+            self.__heaps_index = HeapRangeIndex(starts, ends)
+        return self.__heaps_index
+
+    def get_context_id_for_address(self, address):
+        """
+        Returns the id of the HeapContext for the HEAP that hosts this address,
+        or NO_CONTEXT
+        """
+        return self._get_heaps_index().get_id(address)
+
+    def get_context_ids_for_addresses(self, addresses):
+        """
+        Returns an int64 array of the ids of the HeapContext for the HEAP that hosts
+        each address, NO_CONTEXT for addresses out of any heap.
+        Ids are resolved with get_context_for_id.
+
+        :param addresses: list or numpy array of addresses
+        """
+        return self._get_heaps_index().get_ids(addresses)
+
+    def get_context_for_id(self, context_id):
+        """Returns the HeapContext for an id given by get_context_ids_for_addresses"""
+        return self.get_context_for_heap_walker(self._get_heaps_walkers()[context_id])
+
     def get_context_for_address(self, address):
         """
         Returns the haystack.reverse.context.HeapContext of the process
         for the HEAP that hosts this address
         """
         assert isinstance(address, long) or isinstance(address, int)
-        heap_mapping = self.memory_handler.get_mapping_for_address(address)
-        if not heap_mapping:
-            raise ValueError("Invalid address: 0x%x", address)
-        finder = self.memory_handler.get_heap_finder()
-        walker = finder.get_heap_walker(heap_mapping)
-        if not walker:
-            raise ValueError("Address is not in heap: 0x%x", address)
-        heap_context = self.get_context_for_heap_walker(walker)
-        return heap_context
+        context_id = self.get_context_id_for_address(address)
+        if context_id == NO_CONTEXT:
+            raise ValueError("Address is not in heap: 0x%x" % address)
+        return self.get_context_for_id(context_id)
 
     def make_context_for_heap_walker(self, walker):
         """
@@ -127,15 +211,12 @@ class ProcessContext(object):
             ctx = HeapContext.cacheLoad(self.memory_handler, heap_addr)
             log.debug("Cache avoided HeapContext initialisation")
         except IOError as e:
-            # heaps are already generated at initialisation of self
-            mapping = self.memory_handler.get_mapping_for_address(heap_addr)
-            walker = self.memory_handler.get_heap_finder().get_heap_walker(mapping)
             ctx = HeapContext(self.memory_handler, walker)
         return ctx
 
     def list_contextes(self):
-        """Returns all known HeapContext"""
-        return self.__contextes.values()
+        """Returns the HeapContext of all heaps, making the missing ones"""
+        return [self.get_context_for_heap_walker(walker) for walker in self._get_heaps_walkers()]
 
     def get_reversed_type(self, typename):
         """Returns the list of address of records for that typename"""
@@ -198,22 +279,48 @@ class ProcessContext(object):
         graph_rev = reversers.PointerGraphReverser(self.memory_handler)
         self.__record_graph = graph_rev.load_process_graph()
 
-    def get_predecessors(self, record):
+    def _load_predecessors_index(self):
+        dumpname = self.memory_handler.get_name()
+        self.__predecessors_index = graphindex.PredecessorIndex(dumpname)
+
+    def get_predecessors_addresses(self, address):
         """
-        Returns the list of record pointing to this record.
+        Returns the list of record addresses pointing to this address.
+        Uses the predecessors index saved by PointerGraphReverser.
 
-        :param: record
+        :param: address
         :return list
         """
+        if self.__predecessors_index is None:
+            try:
+                self._load_predecessors_index()
+            except IOError as e:
+                # cache made before the predecessors index existed
+                log.warning('%s, falling back to the graph file', e)
+                return self._get_predecessors_addresses_from_graph(address)
+        return list(map(long, self.__predecessors_index.get_predecessors(address)))
+
+    def _get_predecessors_addresses_from_graph(self, address):
         if self.__record_graph is None:
             self._load_graph_cache()
-        predecessors_label = self.__record_graph.predecessors(hex(record.address))
-        records = []
+        predecessors_label = self.__record_graph.predecessors(hex(address))
+        addresses = []
         for label in predecessors_label:
             # FIXME, eradicate all L for PY3 migration
             if label[-1] == 'L':
                 label = label[:-1]
-            record_addr = int(label, 16)
+            addresses.append(int(label, 16))
+        return addresses
+
+    def get_predecessors(self, record):
+        """
+        Returns the list of record pointing to this record.
+
+        :param: record
+        :return list
+        """
+        records = []
+        for record_addr in self.get_predecessors_addresses(record.address):
             heap_context = self.get_context_for_address(record_addr)
             records.append(heap_context.get_record_for_address(record_addr))
         return records
@@ -240,12 +347,13 @@ class HeapContext(object):
         # cache it
         ### memory_handler.set_context_for_heap(heap, self)
         self.dumpname = memory_handler.get_name()
-        self.walker = walker
+        self._walker = walker
         self._heap_start = walker.get_heap_address()
         self._function_names = dict()
         # refresh heap pointers list and allocators chunks
         self._reversedTypes = dict()
         self._structures = None
+        self._record_table = None
         self._init2()
         return
 
@@ -254,32 +362,17 @@ class HeapContext(object):
         # Check that cache folder exists
         config.create_cache_folder(self.dumpname)
 
-        # re-open the heap walker
-        heap_mapping = self.memory_handler.get_mapping_for_address(self._heap_start)
-        finder = self.memory_handler.get_heap_finder()
-        self.walker = finder.get_heap_walker(heap_mapping)
-
-        # we need a heap walker to parse all allocations
+        # the heap walker is only opened if the pointers or the allocations are not cached yet
         log.debug('[+] Searching pointers in heap')
         # get all pointers found in from allocated space.
-        all_offsets, all_values = self.get_heap_pointers_from_allocated(self.walker)
+        all_offsets, all_values = self.get_heap_pointers_from_allocated()
         self._pointers_values = all_values
         self._pointers_offsets = all_offsets
 
         log.debug('[+] Gathering allocated heap chunks')
-        res = utils.cache_get_user_allocations(self, self.walker)
+        res = utils.cache_get_user_allocations(self)
         self._structures_addresses, self._structures_sizes = res
 
-        # clean a bit the open fd's
-        self.walker = None
-        self.memory_handler.reset_mappings()
-        # CAUTION: all heap walker, mappings are resetted.
-        # Segmentation Fault will ensue if we don't restore heap walkers.
-        heap_mapping = self.memory_handler.get_mapping_for_address(self._heap_start)
-        finder = self.memory_handler.get_heap_finder()
-        self.walker = finder.get_heap_walker(heap_mapping)
-
-
         #if self.memory_handler.get_target_platform().get_os_name() not in ['winxp', 'win7']:
         #    log.info('[+] Reversing function pointers names')
         #    # TODO in reversers
@@ -287,6 +380,19 @@ class HeapContext(object):
         #    self._function_names = dict()
         return
 
+    def get_heap_walker(self):
+        """
+        Returns the IHeapWalker of this heap, opened on first use.
+        Heap walkers are shared by all the contexts of the process through the heap finder.
+        """
+        if self._walker is None:
+            heap_mapping = self.memory_handler.get_mapping_for_address(self._heap_start)
+            finder = self.memory_handler.get_heap_finder()
+            self._walker = finder.get_heap_walker(heap_mapping)
+        return self._walker
+
+    walker = property(get_heap_walker)
+
     def _is_record_cache_dirty(self):
         return self._structures is None or len(self._structures) != len(self._structures_addresses)
 
@@ -297,7 +403,11 @@ class HeapContext(object):
 
         # otherwise cache Load
         log.debug('[+] Loading cached records list')
-        self._structures = dict([(long(vaddr), s) for vaddr, s in structure.cache_load_all_lazy(self)])
+        records = dict([(long(vaddr), s) for vaddr, s in structure.cache_load_all_lazy(self)])
+        # keep the records already loaded one by one, they can have unsaved changes
+        if self._structures is not None:
+            records.update(self._structures)
+        self._structures = records
         log.debug('[+] Loaded %d cached records addresses from disk', len(self._structures))
 
         # If we are missing some allocators from the cache loading
@@ -354,6 +464,28 @@ class HeapContext(object):
             return st
         raise IndexError('No known structure covers that ptr_value')
 
+    def get_record_table(self):
+        """
+        Returns the columnar metadata table of the records of this heap.
+        The table is updated when records are saved, and saved with the context.
+        """
+        if self._record_table is None:
+            self._record_table = recordtable.get_record_table(self)
+        return self._record_table
+
+    def _get_cached_record(self, addr):
+        """Returns the record for this address from the records cache, without listing all records"""
+        if self._structures is not None and addr in self._structures:
+            return self._structures[addr]
+        try:
+            _record = structure.CacheWrapper(self, addr)
+        except ValueError as e:
+            return None
+        if self._structures is None:
+            self._structures = dict()
+        self._structures[long(addr)] = _record
+        return _record
+
     def get_record_for_address(self, addr):
         """
         return the structure.AnonymousRecord associated with this address
@@ -361,6 +493,11 @@ class HeapContext(object):
         :param addr:
         :return:
         """
+        if self._is_record_cache_dirty():
+            # do not list all the records cache for one record
+            _record = self._get_cached_record(addr)
+            if _record is not None:
+                return _record
         return self._list_records()[addr]
 
     def listOffsetsForPointerValue(self, ptr_value):
@@ -425,6 +562,18 @@ class HeapContext(object):
     def get_filename_cache_allocations_sizes(self):
         return config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, self.dumpname, self._heap_start)
 
+    def get_filename_cache_allocations_hashes(self):
+        return config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_HASHES, self.dumpname, self._heap_start)
+
+    def get_filename_cache_record_table(self):
+        return config.get_cache_filename(config.CACHE_RECORD_TABLE, self.dumpname, self._heap_start)
+
+    def get_filename_cache_record_table_layouts(self):
+        return config.get_cache_filename(config.CACHE_RECORD_TABLE_LAYOUTS, self.dumpname, self._heap_start)
+
+    def get_filename_cache_record_table_types(self):
+        return config.get_cache_filename(config.CACHE_RECORD_TABLE_TYPES, self.dumpname, self._heap_start)
+
     def get_filename_cache_signatures(self):
         return config.get_cache_filename(config.CACHE_SIGNATURE_GROUPS_DIR, self.dumpname, self._heap_start)
 
@@ -447,20 +596,33 @@ class HeapContext(object):
         enumerator = enumerators.WordAlignedEnumerator(self.heap, matcher, feedback, word_size)
         return utils.get_cache_heap_pointers(self, enumerator)
 
-    def get_heap_pointers_from_allocated(self, heap_walker):
+    def get_heap_pointers_from_allocated(self, heap_walker=None):
         """
         Search Heap pointers values in stack and heap.
             records values and pointers address in heap.
         :param dumpfilename:
         :param memory_handler:
-        :param heap_walker:
+        :param heap_walker: defaults to the heap walker of this context, if the pointers are not cached
         :return:
         """
+        enumerator = None
+        if heap_walker is not None:
+            enumerator = self.get_allocated_pointers_enumerator(heap_walker)
+        return utils.get_cache_heap_pointers(self, enumerator)
+
+    def get_allocated_pointers_enumerator(self, heap_walker=None):
+        """
+        Returns the enumerator of pointers values in the allocated chunks of the heap.
+
+        :param heap_walker: defaults to the heap walker of this context
+        :return:
+        """
+        if heap_walker is None:
+            heap_walker = self.get_heap_walker()
         feedback = searchers.NoFeedback()
         matcher = matchers.PointerEnumerator(self.memory_handler)
         word_size = self.memory_handler.get_target_platform().get_word_size()
-        enumerator = enumerators.AllocatedWordAlignedEnumerator(heap_walker, matcher, feedback, word_size)
-        return utils.get_cache_heap_pointers(self, enumerator)
+        return enumerators.AllocatedWordAlignedEnumerator(heap_walker, matcher, feedback, word_size)
 
     @classmethod
     def cacheLoad(cls, memory_handler, heap_addr):
@@ -493,6 +655,8 @@ class HeapContext(object):
             log.error("Pickling error on %s, file removed", cache_context_filename)
             os.remove(cache_context_filename)
             raise e
+        if self._record_table is not None:
+            self._record_table.save(self)
 
     def reset(self):
         try:
@@ -510,7 +674,9 @@ class HeapContext(object):
     def __setstate__(self, d):
         self.dumpname = d['dumpname']
         self._heap_start = d['_heap_start']
+        self._walker = None
         self._structures = None
+        self._record_table = None
         self._function_names = dict()
         return
 
@@ -524,7 +690,13 @@ class HeapContext(object):
             try:
                 s.saveme(self)
             except KeyboardInterrupt as e:
-                os.remove(s.fname)
+                fname = structure.make_filename_from_addr(self, s.address)
+                if os.access(fname, os.F_OK):
+                    os.remove(fname)
+                # the record will be reversed again, the interrupted save does not save the table
+                record_table = self.get_record_table()
+                record_table.set_dirty(s.address)
+                record_table.save(self)
                 raise e
             if time.time() - t0 > 30:  # i>0 and i%10000 == 0:
                 tl = time.time()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compressed sparse row (CSR) representation of a pointer graph,
+and the graph analytics used by the graph tools.
+
+Nodes are memory addresses, kept in a sorted int64 array.
+The node index of an address is its position in that array.
+Successors and predecessors of a node are contiguous slices of
+the indices arrays, delimited by the indptr arrays.
+
+All algorithms work on whole arrays at a time, and scale linearly with
+the number of edges:
+    - in and out degrees, and top in-degree ranking
+    - weakly connected components (min-label hooking and pointer jumping)
+    - bounded-depth breadth-first neighbourhood
+    - Weisfeiler-Lehman hashes, to bucket isomorphic candidate components
+"""
+
+import logging
+
+import numpy
+
+log = logging.getLogger('csrgraph')
+
+# splitmix64 constants, used to mix labels in Weisfeiler-Lehman hashes
+_MIX_1 = numpy.uint64(0xbf58476d1ce4e5b9)
+_MIX_2 = numpy.uint64(0x94d049bb133111eb)
+_GOLDEN = numpy.uint64(0x9e3779b97f4a7c15)
+
+
+def _mix(values):
+    """splitmix64 finalizer on an uint64 array"""
+    with numpy.errstate(over='ignore'):
+        z = values + _GOLDEN
+        z = (z ^ (z >> numpy.uint64(30))) * _MIX_1
+        z = (z ^ (z >> numpy.uint64(27))) * _MIX_2
+        return z ^ (z >> numpy.uint64(31))
+
+
+def _gather(indptr, indices, rows):
+    """Returns the concatenated slices of indices for these rows, and the row of each value"""
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    # offset of each row in the output
+    offsets = numpy.cumsum(counts) - counts
+    positions = numpy.arange(total, dtype=numpy.int64) + numpy.repeat(starts - offsets, counts)
+    return indices[positions], numpy.repeat(rows, counts)
+
+
+def _sum_rows(indptr, values):
+    """Sum of values per row of a CSR structure, with wraparound on uint64"""
+    nb_rows = len(indptr) - 1
+    sums = numpy.zeros(nb_rows, dtype=values.dtype)
+    if len(values) == 0:
+        return sums
+    counts = numpy.diff(indptr)
+    non_empty = counts > 0
+    with numpy.errstate(over='ignore'):
+        sums[non_empty] = numpy.add.reduceat(values, indptr[:-1][non_empty])
+    return sums
+
+
+class CSRGraph(object):
+    """
+    A directed graph in CSR format.
+    Use CSRGraph.from_edges or CSRGraph.from_networkx to build one.
+    """
+
+    def __init__(self, nodes, sources, targets, labels=None):
+        """
+        :param nodes: sorted unique int64 array of node addresses
+        :param sources: int64 array of edge source node indexes
+        :param targets: int64 array of edge target node indexes
+        :param labels: optional array of node labels aligned with nodes
+        """
+        self.nodes = nodes
+        self._labels = labels
+        nb_nodes = len(nodes)
+        # out edges, sorted by source
+        order = numpy.lexsort((targets, sources))
+        self.indices = targets[order]
+        self.indptr = numpy.zeros(nb_nodes + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(sources, minlength=nb_nodes), out=self.indptr[1:])
+        # in edges, sorted by target
+        order = numpy.lexsort((sources, targets))
+        self.rev_indices = sources[order]
+        self.rev_indptr = numpy.zeros(nb_nodes + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(targets, minlength=nb_nodes), out=self.rev_indptr[1:])
+        self._components = None
+
+    @classmethod
+    def from_edges(cls, sources, targets, nodes=None, labels=None):
+        """
+        Build a graph from edges given as address arrays.
+        Duplicated edges are removed.
+
+        :param sources: edge sources addresses
+        :param targets: edge targets addresses
+        :param nodes: optional addresses of nodes, to add isolated nodes
+        :param labels: optional labels, aligned with nodes
+        """
+        sources = numpy.asarray(sources, dtype=numpy.int64)
+        targets = numpy.asarray(targets, dtype=numpy.int64)
+        if len(sources) != len(targets):
+            raise ValueError('sources and targets should have the same length')
+        if nodes is None:
+            nodes = numpy.zeros(0, dtype=numpy.int64)
+        nodes = numpy.asarray(nodes, dtype=numpy.int64)
+        all_nodes, inverse = numpy.unique(numpy.concatenate([nodes, sources, targets]), return_inverse=True)
+        inverse = inverse.reshape(-1).astype(numpy.int64)
+        nb = len(nodes)
+        _sources = inverse[nb:nb + len(sources)]
+        _targets = inverse[nb + len(sources):]
+        # remove duplicated edges
+        if len(_sources) > 1:
+            keys = numpy.unique(_sources * len(all_nodes) + _targets)
+            _sources = keys // len(all_nodes)
+            _targets = keys % len(all_nodes)
+        _labels = None
+        if labels is not None:
+            _labels = numpy.empty(len(all_nodes), dtype=object)
+            _labels[inverse[:nb]] = labels
+        return cls(all_nodes, _sources, _targets, _labels)
+
+    @classmethod
+    def from_networkx(cls, digraph):
+        """
+        Build a graph from a networkx graph with hexadecimal string nodes, like the gexf graphs.
+        The original node labels are kept.
+        """
+        labels = list(digraph.nodes())
+        addresses = [int(label, 16) for label in labels]
+        edges = list(digraph.edges())
+        sources = [int(s, 16) for s, t in edges]
+        targets = [int(t, 16) for s, t in edges]
+        return cls.from_edges(sources, targets, addresses, labels)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def get_labels(self, indexes):
+        """Returns the labels of these node indexes"""
+        if self._labels is not None:
+            return list(self._labels[indexes])
+        return ['0x%x' % addr for addr in self.nodes[indexes]]
+
+    def get_indexes(self, addresses):
+        """Returns the node indexes of these addresses. Raises ValueError on an unknown address."""
+        addresses = numpy.asarray(addresses, dtype=numpy.int64)
+        indexes = numpy.searchsorted(self.nodes, addresses)
+        indexes = numpy.minimum(indexes, max(len(self.nodes) - 1, 0))
+        if len(self.nodes) == 0 or (self.nodes[indexes] != addresses).any():
+            raise ValueError('unknown node address')
+        return indexes.astype(numpy.int64)
+
+    def successors(self, address):
+        """Returns the addresses of the successors of a node"""
+        i = self.get_indexes([address])[0]
+        return self.nodes[self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def predecessors(self, address):
+        """Returns the addresses of the predecessors of a node"""
+        i = self.get_indexes([address])[0]
+        return self.nodes[self.rev_indices[self.rev_indptr[i]:self.rev_indptr[i + 1]]]
+
+    def in_degree(self):
+        """Returns the in degree array, aligned with nodes"""
+        return numpy.diff(self.rev_indptr)
+
+    def out_degree(self):
+        """Returns the out degree array, aligned with nodes"""
+        return numpy.diff(self.indptr)
+
+    def top_in_degree(self, count=None):
+        """
+        Rank nodes by decreasing in degree.
+
+        :param count: number of nodes to return, all by default
+        :return: node indexes, in degrees
+        """
+        degrees = self.in_degree()
+        # stable sort on the negated degree, ties stay sorted by address
+        order = numpy.argsort(-degrees, kind='mergesort')
+        if count is not None:
+            order = order[:count]
+        return order, degrees[order]
+
+    def isolates(self):
+        """Returns the indexes of nodes without any edge"""
+        return numpy.flatnonzero((self.in_degree() + self.out_degree()) == 0)
+
+    def connected_components(self):
+        """
+        Weakly connected components.
+        Each component is labelled by a number, components are ordered by decreasing size.
+
+        :return: component number array aligned with nodes, sizes of components
+        """
+        if self._components is not None:
+            return self._components
+        nb_nodes = len(self.nodes)
+        parent = numpy.arange(nb_nodes, dtype=numpy.int64)
+        sources = numpy.repeat(numpy.arange(nb_nodes, dtype=numpy.int64), self.out_degree())
+        targets = self.indices
+        while True:
+            # hook the larger root on the smaller root of each edge
+            p_s = parent[sources]
+            p_t = parent[targets]
+            low = numpy.minimum(p_s, p_t)
+            high = numpy.maximum(p_s, p_t)
+            changed = low != high
+            if not changed.any():
+                break
+            numpy.minimum.at(parent, high[changed], low[changed])
+            # pointer jumping, until every node points to its root
+            while True:
+                grand_parent = parent[parent]
+                if (grand_parent == parent).all():
+                    break
+                parent = grand_parent
+            # edges inside a finished component are no longer needed
+            sources = sources[changed]
+            targets = targets[changed]
+        roots, labels, sizes = numpy.unique(parent, return_inverse=True, return_counts=True)
+        labels = labels.reshape(-1)
+        # renumber by decreasing size
+        order = numpy.argsort(-sizes, kind='mergesort')
+        rank = numpy.empty(len(order), dtype=numpy.int64)
+        rank[order] = numpy.arange(len(order), dtype=numpy.int64)
+        self._components = (rank[labels], sizes[order])
+        log.debug('%d connected components for %d nodes', len(sizes), nb_nodes)
+        return self._components
+
+    def component_nodes(self, component):
+        """Returns the node indexes of a component"""
+        labels, sizes = self.connected_components()
+        return numpy.flatnonzero(labels == component)
+
+    def subgraph(self, indexes):
+        """Returns the subgraph induced by these node indexes"""
+        keep = numpy.zeros(len(self.nodes), dtype=bool)
+        keep[indexes] = True
+        sources = numpy.repeat(numpy.arange(len(self.nodes), dtype=numpy.int64), self.out_degree())
+        edges = keep[sources] & keep[self.indices]
+        labels = None
+        if self._labels is not None:
+            labels = self._labels[keep]
+        return CSRGraph.from_edges(self.nodes[sources[edges]], self.nodes[self.indices[edges]],
+                                   self.nodes[keep], labels)
+
+    def neighbourhood(self, roots, depth):
+        """
+        Breadth-first neighbourhood of root nodes, following successors.
+
+        :param roots: node indexes
+        :param depth: maximum distance from roots
+        :return: node indexes reached, their distance to roots
+        """
+        distance = numpy.empty(len(self.nodes), dtype=numpy.int64)
+        distance.fill(-1)
+        frontier = numpy.unique(numpy.asarray(roots, dtype=numpy.int64))
+        distance[frontier] = 0
+        for level in range(1, depth + 1):
+            if len(frontier) == 0:
+                break
+            reached, _ = _gather(self.indptr, self.indices, frontier)
+            reached = numpy.unique(reached)
+            frontier = reached[distance[reached] == -1]
+            distance[frontier] = level
+        reached = numpy.flatnonzero(distance != -1)
+        return reached, distance[reached]
+
+    def neighbourhood_edges(self, roots, depth):
+        """
+        Edges followed in a breadth-first walk of depth hops from roots.
+        That is all out edges of nodes closer than depth to roots.
+
+        :return: sources node indexes, targets node indexes
+        """
+        reached, distance = self.neighbourhood(roots, depth - 1) if depth > 0 else ([], [])
+        if len(reached) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        targets, sources = _gather(self.indptr, self.indices, reached)
+        return sources, targets
+
+    def weisfeiler_lehman_hashes(self, iterations=3):
+        """
+        Weisfeiler-Lehman refinement of node labels.
+        Nodes start labelled by their in and out degrees. At each iteration, a node label
+        is mixed with the multiset of its successors and predecessors labels.
+        Two isomorphic graphs have the same multiset of node hashes.
+
+        :return: uint64 array of node hashes
+        """
+        with numpy.errstate(over='ignore'):
+            labels = _mix(self.in_degree().astype(numpy.uint64) * numpy.uint64(0x10001) +
+                          self.out_degree().astype(numpy.uint64))
+            for i in range(iterations):
+                # commutative sum of mixed labels is a multiset hash
+                out_sum = _sum_rows(self.indptr, _mix(labels[self.indices]))
+                in_sum = _sum_rows(self.rev_indptr, _mix(labels[self.rev_indices] ^ _MIX_1))
+                labels = _mix(labels ^ _mix(out_sum + _mix(in_sum)))
+        return labels
+
+    def to_undirected(self):
+        """
+        Returns the graph with the edges of this graph in both directions.
+        Reciprocal edges become a single pair of edges.
+        """
+        sources = numpy.repeat(numpy.arange(len(self.nodes), dtype=numpy.int64), self.out_degree())
+        return CSRGraph.from_edges(self.nodes[numpy.concatenate([sources, self.indices])],
+                                   self.nodes[numpy.concatenate([self.indices, sources])],
+                                   self.nodes, self._labels)
+
+    def _component_hashes(self, graph, iterations):
+        """Hash per connected component of the Weisfeiler-Lehman hashes of graph, on the same nodes"""
+        components, sizes = self.connected_components()
+        node_hashes = _mix(graph.weisfeiler_lehman_hashes(iterations))
+        hashes = numpy.zeros(len(sizes), dtype=numpy.uint64)
+        with numpy.errstate(over='ignore'):
+            numpy.add.at(hashes, components, node_hashes)
+        return hashes
+
+    def component_hashes(self, iterations=3, directed=True):
+        """
+        Returns a hash per connected component, made from the multiset of
+        Weisfeiler-Lehman hashes of its nodes.
+
+        :param directed: if False, hash the undirected graph
+        """
+        return self._component_hashes(self if directed else self.to_undirected(), iterations)
+
+    def isomorphic_candidates(self, min_size=1, iterations=3, directed=True):
+        """
+        Group components that could be isomorphic.
+        Components in a group have the same number of nodes, of edges, and the same
+        Weisfeiler-Lehman hash. Components in different groups are not isomorphic.
+
+        :param min_size: ignore components with less nodes
+        :param directed: if False, ignore the edges directions, for an isomorphism test
+            on undirected graphs. Reciprocal edges count as one edge.
+        :return: list of arrays of component numbers, groups of 2 or more components
+        """
+        components, sizes = self.connected_components()
+        graph = self if directed else self.to_undirected()
+        sources = numpy.repeat(numpy.arange(len(self.nodes), dtype=numpy.int64), graph.out_degree())
+        if not directed:
+            # each undirected edge once
+            sources = sources[sources <= graph.indices]
+        nb_edges = numpy.bincount(components[sources], minlength=len(sizes))
+        hashes = self._component_hashes(graph, iterations)
+        selected = numpy.flatnonzero(sizes >= min_size)
+        if len(selected) == 0:
+            return []
+        keys = numpy.rec.fromarrays([sizes[selected], nb_edges[selected], hashes[selected]])
+        _, inverse, counts = numpy.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        order = numpy.argsort(inverse, kind='mergesort')
+        groups = numpy.split(selected[order], numpy.cumsum(counts)[:-1])
+        return [g for g in groups if len(g) > 1]
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A local query daemon keeping the reverse context of a dump warm.
+
+The daemon loads the memory handler of a dump once, and answers queries
+on its records on a Unix socket. Each client connection is served
+concurrently by an asyncio event loop. Queries themselves run one at a
+time in a worker thread, as the reverse context is not thread-safe.
+Loaded records are kept in a bounded LRU cache.
+
+The protocol is JSON lines. Each request is a JSON object on one line:
+    {"command": "show", "address": "0x1010"}
+and is answered with a JSON object on one line, with the same values as
+the --json output of the query commands, or {"error": "..."}.
+
+Commands are show, hex, parents, type and strings.
+This module requires Python 3.5.
+"""
+
+import asyncio
+import binascii
+import concurrent.futures
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+
+from haystack import cli
+from haystack.reverse import lrucache
+from haystack.reverse import query
+from haystack.reverse import stringtable
+
+log = logging.getLogger('daemon')
+
+REVERSE_DAEMON_DESC = 'Serve queries on the records of a dump on a local Unix socket'
+
+COMMANDS = ['show', 'hex', 'parents', 'type', 'strings']
+
+# the values of a command, besides the record address
+_COMMANDS_KEYS = {
+    'show': ['type', 'text'],
+    'hex': ['bytes'],
+    'parents': ['parents'],
+    'type': ['type', 'size', 'reverse_level', 'signature'],
+    'strings': ['strings'],
+}
+
+# number of records kept loaded
+RECORD_CACHE_SIZE = 5000
+
+
+class QueryService(object):
+    """
+    Answers the queries on the records of a dump.
+
+    Records are read from the records cache of a reversed dump, and kept in
+    a LRU cache. The reverse context of the dump is only made on first use,
+    for a dump that was not reversed.
+
+    :param memory_handler: the memory handler of the dump
+    :param cache_size: the number of records kept loaded
+    """
+
+    def __init__(self, memory_handler, cache_size=RECORD_CACHE_SIZE):
+        self._memory_handler = memory_handler
+        self.dumpname = memory_handler.get_name()
+        try:
+            self._record_query = query.RecordQuery(memory_handler)
+        except IOError as e:
+            log.debug('%s, using the reverse context', e)
+            self._record_query = None
+        self._records = lrucache.LRUCache(cache_size)
+        self._strings_tables = {}
+
+    def _get_record_from_context(self, address):
+        process_context = self._memory_handler.get_reverse_context()
+        try:
+            ctx = process_context.get_context_for_address(address)
+            return ctx.get_record_at_address(address)
+        except (ValueError, IndexError) as e:
+            return None
+
+    def get_record(self, address):
+        """Returns the record containing this address, or None"""
+        if self._record_query is None:
+            # the heap contexts keep their own bounded cache of loaded records
+            return self._get_record_from_context(address)
+        record_addresses, _ = self._record_query.get_records_addresses_at_addresses([address])
+        record_address = int(record_addresses[0])
+        if record_address == query.NO_RECORD:
+            return None
+        if record_address in self._records:
+            return self._records[record_address]
+        try:
+            _record = self._record_query.get_record(record_address)
+        except IOError as e:
+            log.debug('%s, using the reverse context', e)
+            _record = self._get_record_from_context(address)
+        if _record is not None:
+            self._records[record_address] = _record
+        return _record
+
+    def _get_predecessors(self, _record):
+        if self._record_query is not None:
+            try:
+                return self._record_query.get_predecessors(_record)
+            except IOError as e:
+                log.debug('%s, using the reverse context', e)
+        return self._memory_handler.get_reverse_context().get_predecessors(_record)
+
+    def _get_strings_table(self, record_address):
+        """Returns the strings table of the heap of that record, or None"""
+        if self._record_query is not None:
+            heap_addr = self._record_query.get_heap_address_for_record(record_address)
+        else:
+            heap_addr = self._memory_handler.get_reverse_context().get_context_for_address(record_address)._heap_start
+        if heap_addr not in self._strings_tables:
+            try:
+                self._strings_tables[heap_addr] = stringtable.StringTable.load(self.dumpname, heap_addr)
+            except IOError as e:
+                log.debug(e)
+                self._strings_tables[heap_addr] = None
+        return self._strings_tables[heap_addr]
+
+    def query(self, command, address):
+        """
+        Returns the values of a command on the record containing this address.
+
+        :raises ValueError: on an unknown command
+        """
+        if command not in COMMANDS:
+            raise ValueError('Unknown command %s' % command)
+        _record = self.get_record(address)
+        if _record is None:
+            res = {'record': None}
+            res.update(dict((key, None) for key in _COMMANDS_KEYS[command]))
+            return res
+        res = {'record': '0x%x' % _record.address}
+        if command == 'show':
+            res['type'] = _record.record_type.type_name
+            res['text'] = _record.to_string()
+        elif command == 'hex':
+            res['bytes'] = binascii.hexlify(_record.bytes).decode('ascii')
+        elif command == 'parents':
+            res['parents'] = ['0x%x' % p_record.address for p_record in self._get_predecessors(_record)]
+        elif command == 'type':
+            res['type'] = _record.record_type.type_name
+            res['size'] = len(_record)
+            res['reverse_level'] = _record.get_reverse_level()
+            res['signature'] = _record.get_signature_text()
+        elif command == 'strings':
+            table = self._get_strings_table(_record.address)
+            if table is None:
+                res['strings'] = None
+            else:
+                res['strings'] = [{'address': '0x%x' % string_address, 'value': value}
+                                  for string_address, value in table.get_strings_for_record(_record.address)]
+        return res
+
+    def answer(self, line):
+        """Returns the JSON response line to a JSON request line, both bytes"""
+        try:
+            # json.loads only reads bytes from Python 3.6
+            request = json.loads(line.decode('utf-8'))
+            command = request['command']
+            address = request['address']
+            if not isinstance(address, int):
+                address = int(address, 16)
+            res = self.query(command, address)
+            res['address'] = '0x%x' % address
+        except (ValueError, KeyError, TypeError, OverflowError, IOError) as e:
+            res = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        except Exception as e:
+            # a failed query does not drop the client
+            log.exception('Could not answer %r', line)
+            res = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        return json.dumps(res, sort_keys=True).encode('utf-8') + b'\n'
+
+
+def _remove_stale_socket(socket_path):
+    """
+    Remove the socket left at this path by a daemon that is not running anymore.
+
+    :raises IOError: if the path is not a socket, or if a daemon listens on it
+    """
+    if not os.path.lexists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise IOError('%s exists and is not a socket' % socket_path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except ConnectionRefusedError:
+        log.info('Removing the stale socket %s', socket_path)
+        os.unlink(socket_path)
+        return
+    finally:
+        client.close()
+    raise IOError('A daemon is already listening on %s' % socket_path)
+
+
+class QueryServer(object):
+    """
+    Serves a QueryService on a Unix socket.
+
+    :param service: the QueryService
+    :param socket_path: the path of the Unix socket
+    """
+
+    def __init__(self, service, socket_path):
+        self.service = service
+        self.socket_path = socket_path
+        # one worker, queries share the reverse context
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._loop = None
+        self._stopped = None
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if len(line.strip()) == 0:
+                    continue
+                response = await self._loop.run_in_executor(self._executor, self.service.answer, line)
+                writer.write(response)
+                await writer.drain()
+        except ConnectionError as e:
+            log.debug('client disconnected: %s', e)
+        finally:
+            writer.close()
+        return
+
+    async def serve(self):
+        """Serve until stop() is called"""
+        self._loop = asyncio.get_event_loop()
+        self._stopped = asyncio.Event()
+        _remove_stale_socket(self.socket_path)
+        # the records can hold secrets, only the user can connect
+        umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+        log.info('Serving %s on %s', self.service.dumpname, self.socket_path)
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        return
+
+    def run(self):
+        """Serve until stop() is called, or until interrupted"""
+        # a new loop, the server can run in any thread
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.serve())
+        except KeyboardInterrupt:
+            log.info('Interrupted')
+        finally:
+            self._executor.shutdown()
+            asyncio.set_event_loop(None)
+            loop.close()
+        return
+
+    def stop(self):
+        """Stop serving. Can be called from any thread."""
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        return
+
+
+class QueryClient(object):
+    """
+    A blocking client of a QueryServer.
+
+    :param socket_path: the path of the Unix socket of the server
+    """
+
+    def __init__(self, socket_path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._file = self._socket.makefile('rwb')
+
+    def query(self, command, address):
+        """
+        Returns the values of a command on the record containing this address.
+
+        :raises ValueError: if the server could not answer
+        """
+        request = {'command': command, 'address': '0x%x' % address}
+        self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ValueError('The server closed the connection')
+        res = json.loads(line.decode('utf-8'))
+        if 'error' in res:
+            raise ValueError(res['error'])
+        return res
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+        return
+
+
+def main():
+    argv = sys.argv[1:]
+    desc = REVERSE_DAEMON_DESC
+    rootparser = cli.base_argparser(program_name=os.path.basename(sys.argv[0]), description=desc)
+    rootparser.add_argument('--socket', required=True, help='The path of the Unix socket to listen on.')
+    rootparser.add_argument('--cache-size', type=int, default=RECORD_CACHE_SIZE,
+                            help='The number of records kept loaded.')
+    opts = rootparser.parse_args(argv)
+    # apply verbosity
+    cli.set_logging_level(opts)
+    # check the socket before loading the dump
+    try:
+        _remove_stale_socket(opts.socket)
+        memory_handler = cli.make_memory_handler(opts)
+        server = QueryServer(QueryService(memory_handler, opts.cache_size), opts.socket)
+        server.run()
+    except IOError as e:
+        rootparser.error(str(e))
+    return
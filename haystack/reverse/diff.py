@@ -14,12 +14,11 @@ import argparse
 import logging
 import sys
 
+import numpy
 import os
 
 from haystack import argparse_utils
 from haystack.mappings import folder
-from haystack.reverse.heuristics import reversers
-from haystack.reverse import context
 from haystack.reverse import config
 from haystack.reverse import structure
 
@@ -33,88 +32,71 @@ __status__ = "Production"
 
 log = logging.getLogger('diff')
 
+# bytes compared at once
+CHUNK_SIZE = 0x1000000
+
 
 def make(opts):
-    log.info('[+] Loading context of %s' % opts.dump1)
-    # '../../outputs/skype.1.a') # TODO
-    ctx = context.get_context(opts.dump1)
-    # refresh
-    if len(ctx.structures) != len(ctx.structures_addresses):
-        log.info(
-            '[+] Refreshing from %d allocators cached' %
-            (len(
-                ctx.structures)))
-        # FIXME, I think its now an heapwalker, not a reverser
-        mallocRev = reversers.MallocReverser()
-        ctx = mallocRev.reverse(ctx)
-        mallocRev.check_inuse(ctx)
-        log.info(
-            '[+] Final %d allocators from malloc blocs' %
-            (len(
-                ctx.structures)))
-    finder = ctx.get_memory_handler().get_heap_finder()
-    heap1 = finder.list_heap_walkers()[0]
+    log.info('[+] Loading _memory_handler of %s' % opts.dump1)
+    memory_handler = folder.load(opts.dump1)
+    process_context = memory_handler.get_reverse_context()
     log.info('[+] Loading _memory_handler of %s' % opts.dump2)
     newmappings = folder.load(opts.dump2)
-    finder2 = newmappings.get_heap_finder()
-    heap2 = finder2.list_heap_walkers()[0]
-    log.info('[+] finding diff values with %s' % opts.dump2)
-    addrs = cmd_cmp(heap1, heap2, heap1.start)
-
-    # now compare with allocators addresses
     structures = []
-    realloc = 0
-    log.info('[+] Looking at %d differences' % (len(addrs)))
-    st = []
-    # joined iteration, found structure affected
-    # use info from malloc : allocators.start + .size
-    addr_iter = iter(addrs)
-    structs_addr_iter = iter(ctx.malloc_addresses)
-    structs_size_iter = iter(ctx.malloc_sizes)
-    try:
-        addr = addr_iter.next()
-        st_addr = structs_addr_iter.next()
-        st_size = structs_size_iter.next()
-        cnt = 1
-        while True:
-
-            while (addr - st_addr) >= st_size:  # find st containing offset
-                st_addr = structs_addr_iter.next()
-                st_size = structs_size_iter.next()
-            # check for gaps
-            if (addr - st_addr) < 0:  # went to far - no struct overlapping
-                # addr is in between two struct - dump all addr stuck out of
-                # malloc_chunks
-                while (addr - st_addr) < 0:
-                    addr = addr_iter.next()
-                    pass
-                continue
-
-            #
-            # check if offset is really in st ( should be always if your not
-            # dumb/there no holes )
-            if 0 <= (addr - st_addr) < st_size:
-                # tag the structure as different
-                structures.append(ctx.structures[st_addr])
-                cnt += 1
-            else:
-                # (addr - st_addr) < 0 # impossible by previous while
-                # (addr - st_addr) >= st_size # then continur
-                continue
-
-            while (addr - st_addr) < st_size:  # enumerate offsets in st range
-                addr = addr_iter.next()
-                cnt += 1
-    except StopIteration as e:
-        pass
-    addrs_found = cnt
-
-    log.info(
-        '[+] On %d diffs, found %d structs with different values. realloc: %d' %
-        (addrs_found, len(structures), realloc))
+    for heap_context in process_context.list_contextes():
+        heap1 = memory_handler.get_mapping_for_address(heap_context._heap_start)
+        heap2 = newmappings.get_mapping_for_address(heap_context._heap_start)
+        log.info('[+] finding diff values with %s in %s' % (opts.dump2, heap1))
+        starts, ends = diff_mappings(heap1, heap2)
+        log.info('[+] Looking at %d differences' % (len(starts)))
+        # use info from malloc : allocators.start + .size
+        addresses = heap_context._structures_addresses
+        indexes, counts = changed_records(starts, ends, addresses, heap_context._structures_sizes)
+        nb_changed = int((ends - starts).sum())
+        log.info(
+            '[+] On %d diffs, found %d structs with different values. %d bytes out of structs' %
+            (nb_changed, len(indexes), nb_changed - int(counts.sum())))
+        for i in numpy.argsort(counts, kind='mergesort')[::-1][:10]:
+            log.debug('0x%x: %d changed bytes', addresses[indexes[i]], counts[i])
+        structures.extend(heap_context.get_record_for_address(int(addresses[i])) for i in indexes)
+
     log.info('[+] Outputing to file (will be long-ish)')
 
-    print_diff_files(opts, context, newmappings, structures)
+    print_diff_files(opts, process_context, newmappings, structures)
+
+
+def changed_records(starts, ends, addresses, sizes):
+    """
+    Joins the changed ranges with the records allocations.
+
+    :param starts: sorted starts addresses of changed ranges
+    :param ends: ends addresses of changed ranges, ranges do not overlap
+    :param addresses: sorted records addresses
+    :param sizes: records sizes
+    :return: int64 arrays of the indexes of changed records in addresses,
+        and of their number of changed bytes
+    """
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.asarray(ends, dtype=numpy.int64)
+    addresses = numpy.asarray(addresses, dtype=numpy.int64)
+    sizes = numpy.asarray(sizes, dtype=numpy.int64)
+    if len(starts) == 0 or len(addresses) == 0:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    cumul = numpy.cumsum(ends - starts)
+
+    def changed_before(_addresses):
+        # number of changed bytes below each address
+        res = numpy.zeros(len(_addresses), dtype=numpy.int64)
+        last = numpy.searchsorted(starts, _addresses, side='left') - 1
+        valid = last >= 0
+        last = last[valid]
+        # remove the part of the last range that is above the address
+        res[valid] = cumul[last] - numpy.maximum(0, ends[last] - _addresses[valid])
+        return res
+
+    counts = changed_before(addresses + sizes) - changed_before(addresses)
+    indexes = numpy.flatnonzero(counts > 0)
+    return indexes, counts[indexes]
 
 
 def print_diff_files(opts, context, newmappings, structures):
@@ -156,28 +138,108 @@ def print_diff_files(opts, context, newmappings, structures):
     log.info('[+] diffed allocators dumped in %s %s' % (d1out, d2out))
 
 
-def cmd_cmp(heap1, heap2, baseOffset):
-    # LINUX based system command cmp parsing
-    import subprocess
-
-    f1 = heap1._memdump.name
-    f2 = heap2._memdump.name
-
-    addrs = []
-    try:
-        res = subprocess.check_output(['cmp', f1, f2, '-l'])
-    except subprocess.CalledProcessError as e:
-        res = e.output
-    for line in res.split('\n'):
-        cols = line.split(' ')
-        try:
-            while cols[0] == '':
-                cols.pop(0)
-        except:
+def _get_file_content(filename):
+    """Returns the memory-mapped content of a dump file as an uint8 array"""
+    if os.path.getsize(filename) == 0:
+        return numpy.zeros(0, dtype=numpy.uint8)
+    return numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+
+
+def get_mapping_content(mapping):
+    """
+    Returns the content of a memory mapping as an uint8 array.
+    Dump files are memory-mapped, other mappings are read in memory.
+    """
+    filename = getattr(mapping, '_memdumpname', None)
+    if filename is None:
+        filename = getattr(getattr(mapping, '_memdump', None), 'name', None)
+    if isinstance(filename, str) and os.access(filename, os.R_OK):
+        return _get_file_content(filename)
+    return numpy.frombuffer(mapping.read_bytes(mapping.start, len(mapping)), dtype=numpy.uint8)
+
+
+def _changed_runs(content1, content2):
+    """Returns the starts and ends offsets of the runs of different bytes"""
+    different = numpy.empty(len(content1) + 2, dtype=bool)
+    different[0] = different[-1] = False
+    numpy.not_equal(content1, content2, out=different[1:-1])
+    edges = numpy.flatnonzero(different[1:] != different[:-1])
+    return edges[0::2], edges[1::2]
+
+
+def iter_diff_contents(content1, content2, base_address=0, chunk_size=CHUNK_SIZE):
+    """
+    Compares two byte arrays chunk by chunk.
+    If the contents lengths differ, the tail of the longest one is a changed range.
+
+    :param base_address: the address of the first byte
+    :return: yields int64 arrays of starts and ends addresses of changed ranges.
+        Ranges are coalesced, including across chunks.
+    """
+    common = min(len(content1), len(content2))
+    pending = None
+    for offset in range(0, common, chunk_size):
+        end = min(offset + chunk_size, common)
+        starts, ends = _changed_runs(content1[offset:end], content2[offset:end])
+        if len(starts) == 0:
             continue
-        addrs.append(int(cols.pop(0)) + baseOffset - 1)  # starts with 1
-
-    return addrs
+        starts += base_address + offset
+        ends += base_address + offset
+        if pending is not None:
+            if pending[1][-1] == starts[0]:
+                # the run continues from the previous chunk
+                starts[0] = pending[0][-1]
+                pending = (pending[0][:-1], pending[1][:-1])
+            if len(pending[0]) > 0:
+                yield pending
+        pending = (starts, ends)
+    tail = None
+    if len(content1) != len(content2):
+        tail = (base_address + common, base_address + max(len(content1), len(content2)))
+        if pending is not None and pending[1][-1] == tail[0]:
+            tail = (pending[0][-1], tail[1])
+            pending = (pending[0][:-1], pending[1][:-1])
+    if pending is not None and len(pending[0]) > 0:
+        yield pending
+    if tail is not None:
+        yield numpy.array([tail[0]], dtype=numpy.int64), numpy.array([tail[1]], dtype=numpy.int64)
+    return
+
+
+def diff_contents(content1, content2, base_address=0, chunk_size=CHUNK_SIZE):
+    """
+    Compares two byte arrays.
+
+    :return: int64 arrays of starts and ends addresses of changed ranges
+    """
+    starts = [numpy.zeros(0, dtype=numpy.int64)]
+    ends = [numpy.zeros(0, dtype=numpy.int64)]
+    for _starts, _ends in iter_diff_contents(content1, content2, base_address, chunk_size):
+        starts.append(_starts)
+        ends.append(_ends)
+    return numpy.concatenate(starts).astype(numpy.int64), numpy.concatenate(ends).astype(numpy.int64)
+
+
+def diff_files(filename1, filename2, base_address=0, chunk_size=CHUNK_SIZE):
+    """
+    Compares two dump files, memory-mapped.
+
+    :return: int64 arrays of starts and ends addresses of changed ranges
+    """
+    content1 = _get_file_content(filename1)
+    content2 = _get_file_content(filename2)
+    return diff_contents(content1, content2, base_address, chunk_size)
+
+
+def diff_mappings(mapping1, mapping2, chunk_size=CHUNK_SIZE):
+    """
+    Compares the contents of two memory mappings, at the start address of the first one.
+
+    :return: int64 arrays of starts and ends addresses of changed ranges
+    """
+    content1 = get_mapping_content(mapping1)
+    content2 = get_mapping_content(mapping2)
+    return diff_contents(content1, content2, mapping1.start, chunk_size)
 
 
 def argparser():
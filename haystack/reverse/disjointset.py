@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Array based disjoint-set (union-find) over integer indexes.
+
+Used to chain similar records together as similar pairs are produced,
+without keeping the pairs or building a graph.
+Memory is two integer arrays, linear in the number of elements.
+"""
+
+import array
+import logging
+
+log = logging.getLogger('disjointset')
+
+
+class DisjointSet(object):
+    """
+    Disjoint-set over the indexes 0..n-1, with union by size and path halving.
+    """
+
+    def __init__(self, size=0):
+        self._parent = array.array('q', range(size))
+        self._size = array.array('q', [1]) * size
+
+    def __len__(self):
+        return len(self._parent)
+
+    def add(self):
+        """Add a new singleton set, returns its index"""
+        index = len(self._parent)
+        self._parent.append(index)
+        self._size.append(1)
+        return index
+
+    def find(self, index):
+        """Returns the representative index of the set of index"""
+        parent = self._parent
+        while parent[index] != index:
+            # path halving
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def union(self, index1, index2):
+        """Merge the sets of two indexes. Returns False if they were already in the same set."""
+        root1 = self.find(index1)
+        root2 = self.find(index2)
+        if root1 == root2:
+            return False
+        if self._size[root1] < self._size[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._size[root1] += self._size[root2]
+        return True
+
+    def union_pairs(self, pairs):
+        """Merge the sets of each pair of indexes. Returns the number of merges."""
+        nb = 0
+        for index1, index2 in pairs:
+            if self.union(index1, index2):
+                nb += 1
+        return nb
+
+    def connected(self, index1, index2):
+        return self.find(index1) == self.find(index2)
+
+    def set_size(self, index):
+        """Returns the size of the set of index"""
+        return self._size[self.find(index)]
+
+    def groups(self, min_size=1):
+        """
+        Returns the sets as lists of indexes, sorted by their smallest index.
+
+        :param min_size: ignore sets with less members
+        """
+        groups = {}
+        for index in range(len(self._parent)):
+            root = self.find(index)
+            if self._size[root] < min_size:
+                continue
+            if root not in groups:
+                groups[root] = []
+            groups[root].append(index)
+        return sorted(groups.values())
@@ -6,18 +6,18 @@
 
 from __future__ import print_function
 
-from collections import defaultdict
-
 import networkx
 import argparse
 import logging
 import os
 import sys
 
+import numpy
 import matplotlib.pyplot as plt
 from haystack import argparse_utils
 from haystack.mappings import folder
 from haystack.reverse import config
+from haystack.reverse import csrgraph
 from haystack.reverse import utils
 from haystack import cli
 from networkx.drawing.nx_agraph import graphviz_layout
@@ -53,13 +53,18 @@ def print_graph(G, memory_handler):
 
 
 def depthSubgraph(source, target, nodes, depth):
+    """
+    Add to target the edges reached from nodes in a walk of depth hops in source.
+
+    :param source: a networkx.DiGraph or a csrgraph.CSRGraph
+    """
     if depth == 0:
         return
-    depth -= 1
-    for node in nodes:
-        neighbors = source.successors(node)
-        target.add_edges_from(source.edges(node))
-        depthSubgraph(source, target, neighbors, depth)
+    if not isinstance(source, csrgraph.CSRGraph):
+        source = csrgraph.CSRGraph.from_networkx(source)
+    roots = source.get_indexes([int(node, 16) for node in nodes])
+    sources, targets = source.neighbourhood_edges(roots, depth)
+    target.add_edges_from(zip(source.get_labels(sources), source.get_labels(targets)))
     return
 
 
@@ -103,56 +108,40 @@ def make(opts):
     print_graph(graph, memory_handler)
 
 
-def clean(digraph):
+def clean(digraph, ctx=None):
+    csr = csrgraph.CSRGraph.from_networkx(digraph)
     # clean solos
-    isolates = networkx.algorithms.isolate.isolates(digraph)
+    isolates = csr.get_labels(csr.isolates())
     digraph.remove_nodes_from(isolates)
 
     # clean solos clusters
-    graph = networkx.Graph(digraph)  # undirected
-    subgraphs = networkx.algorithms.components.connected.connected_component_subgraphs(
-        graph)
-    isolates1 = set(utils.flatten(g.nodes() for g in subgraphs if len(g) == 1))  # self connected
-    isolates2 = set(utils.flatten(g.nodes() for g in subgraphs if len(g) == 2))
-    isolates3 = set(utils.flatten(g.nodes() for g in subgraphs if len(g) == 3))
-    digraph.remove_nodes_from(isolates1)
-    digraph.remove_nodes_from(isolates2)
-    digraph.remove_nodes_from(isolates3)
-
-    #
-    #graph = digraph.to_undirected()
-    #subgraphs = networkx.algorithms.components.connected.connected_component_subgraphs(graph)
-    subgraphs = [g for g in subgraphs if len(g) > 3]
-    isolatedGraphs = subgraphs[1:100]
-
-    # group by nodes number
-    isoDict = defaultdict(list)
-    [isoDict[len(g)].append(g) for g in isolatedGraphs]
-
-    # test isomorphism
+    components, sizes = csr.connected_components()
+    small = numpy.flatnonzero(sizes[components] <= 3)
+    digraph.remove_nodes_from(csr.get_labels(small))
+
+    # components are numbered by decreasing size
+    big_components = numpy.flatnonzero(sizes > 3)
+    isolated_components = set(big_components[1:100])
+
+    # test isomorphism on candidates with the same Weisfeiler-Lehman hash
+    # of the undirected graph, as networkx.Graph is tested below
     isoGraphs = dict()
-    for numNodes, graphs in isoDict.items():
-        numgraphs = len(graphs)
-        if numgraphs == 1:
+    for group in csr.isomorphic_candidates(min_size=4, directed=False):
+        group = [c for c in group if c in isolated_components]
+        if len(group) < 2:
             continue
-        isoGraph = networkx.Graph()
-        # quick find isomorphisms
-        todo = set(graphs)
+        numNodes = int(sizes[group[0]])
+        graphs = [networkx.Graph(digraph.subgraph(csr.get_labels(csr.component_nodes(c)))) for c in group]
+        isoGraph = isoGraphs.setdefault(numNodes, networkx.Graph())
         for i, g1 in enumerate(graphs):
-            for g2 in graphs[i + 1:]:
+            for j, g2 in enumerate(graphs[i + 1:], i + 1):
                 if networkx.is_isomorphic(g1, g2):
-                    print('numNodes:%d graphs %d, %d are isomorphic' % (numNodes, i, i + 1))
-                    isoGraph.add_edge(g1, g2, {'isomorphic': True})
-                    if g2 in todo:
-                        todo.remove(g2)
-                    if g1 in todo:
-                        todo.remove(g1)
+                    print('numNodes:%d graphs %d, %d are isomorphic' % (numNodes, group[i], group[j]))
+                    isoGraph.add_edge(g1, g2, isomorphic=True)
                     # we can stop here, chain comparaison will work between g2
                     # and g3
                     break
-
-        if len(isoGraph) > 0:
-            isoGraphs[numNodes] = isoGraph
+    isoGraphs = dict((num, g) for num, g in isoGraphs.items() if len(g) > 0)
 
     # draw the isomorphisms
     for i, item in enumerate(isoGraphs.items()):
@@ -166,23 +155,22 @@ def clean(digraph):
         plt.clf()
     # need to use gephi-like for rendering nicely on the same pic
 
-    bigGraph = networkx.DiGraph()
-    bigGraph.add_edges_from(digraph.edges(subgraphs[0].nodes()))
-
-    stack_addrs = utils.int_array_cache(
-        config.get_cache_filename(config.CACHE_STACK_VALUES, ctx.dumpname, ctx._heap_addr))
-    stack_addrs_txt = set(['%x' % addr
-                           for addr in stack_addrs])  # new, no long
+    if len(big_components) == 0:
+        return
+    bigGraph = csr.subgraph(csr.component_nodes(big_components[0]))
 
-    stacknodes = list(set(bigGraph.nodes()) & stack_addrs_txt)
-    print('stacknodes left', len(stacknodes))
-    orig = list(set(graph.nodes()) & stack_addrs_txt)
-    print('stacknodes orig', len(orig))
+    if ctx is not None:
+        stack_addrs = utils.int_array_cache(
+            config.get_cache_filename(config.CACHE_STACK_VALUES, ctx.dumpname, ctx._heap_addr))
+        stacknodes = numpy.intersect1d(bigGraph.nodes, stack_addrs)
+        print('stacknodes left', len(stacknodes))
+        orig = numpy.intersect1d(csr.nodes, stack_addrs)
+        print('stacknodes orig', len(orig))
 
     # identify strongly referenced allocators
-    degreesList = [(bigGraph.in_degree(node), node)
-                   for node in bigGraph.nodes()]
-    degreesList.sort(reverse=True)
+    indexes, degrees = bigGraph.top_in_degree()
+    degreesList = list(zip(degrees.tolist(), bigGraph.get_labels(indexes)))
+    return bigGraph, degreesList
 
 # important struct
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Persisted reverse adjacency index of the process pointer graph.
+
+The index is made of two arrays of the same length, sorted by pointee address:
+    - targets: the pointee address of each edge
+    - sources: the address of the record holding the pointer
+
+The predecessors of an address are a contiguous slice of sources,
+found with two binary searches on targets.
+Both arrays are memory-mapped, so a lookup does not read the whole index.
+"""
+
+import logging
+
+import numpy
+
+from haystack.reverse import config
+from haystack.reverse import utils
+
+log = logging.getLogger('graphindex')
+
+
+def get_filenames_cache_predecessors(dumpname):
+    """Returns the filenames of the targets and sources arrays"""
+    targets = config.get_cache_filename(config.CACHE_GRAPH_PREDECESSORS_TARGETS, dumpname)
+    sources = config.get_cache_filename(config.CACHE_GRAPH_PREDECESSORS_SOURCES, dumpname)
+    return targets, sources
+
+
+def save_predecessors_index(dumpname, sources, targets):
+    """
+    Sort the pointer edges by target address and save them to cache.
+    Duplicate edges are removed.
+
+    :param dumpname: the dump name to get the cache folder
+    :param sources: sequence of record addresses holding a pointer
+    :param targets: sequence of pointee addresses, same length as sources
+    :return: number of edges in the index
+    """
+    sources = numpy.asarray(sources, dtype=numpy.int64)
+    targets = numpy.asarray(targets, dtype=numpy.int64)
+    if len(sources) != len(targets):
+        raise ValueError('sources and targets should have the same length')
+    # sort by targets, then by sources
+    order = numpy.lexsort((sources, targets))
+    sources = sources[order]
+    targets = targets[order]
+    # remove duplicated edges
+    if len(targets) > 1:
+        keep = numpy.ones(len(targets), dtype=bool)
+        keep[1:] = (targets[1:] != targets[:-1]) | (sources[1:] != sources[:-1])
+        sources = sources[keep]
+        targets = targets[keep]
+    f_targets, f_sources = get_filenames_cache_predecessors(dumpname)
+    utils.int_array_save(f_targets, targets)
+    utils.int_array_save(f_sources, sources)
+    log.debug('[+] Saved predecessors index of %d edges', len(targets))
+    return len(targets)
+
+
+class PredecessorIndex(object):
+    """
+    Read only access to the predecessors index of a dump.
+    """
+
+    def __init__(self, dumpname):
+        f_targets, f_sources = get_filenames_cache_predecessors(dumpname)
+        self._targets = utils.int_array_cache(f_targets, mmap_mode='r')
+        self._sources = utils.int_array_cache(f_sources, mmap_mode='r')
+        if self._targets is None or self._sources is None:
+            raise IOError('No predecessors index in cache for %s' % dumpname)
+        if len(self._targets) != len(self._sources):
+            raise IOError('Corrupted predecessors index for %s' % dumpname)
+
+    def get_predecessors(self, address):
+        """
+        Returns the sorted array of record addresses with a pointer to this address.
+
+        :param address: the pointee address
+        :return: numpy.array
+        """
+        start, end = self._get_slice(address)
+        return numpy.array(self._sources[start:end])
+
+    def count_predecessors(self, address):
+        """Returns the number of records with a pointer to this address"""
+        start, end = self._get_slice(address)
+        return end - start
+
+    def _get_slice(self, address):
+        if len(self._targets) == 0:
+            return 0, 0
+        _address = numpy.int64(address)
+        start = int(numpy.searchsorted(self._targets, _address, side='left'))
+        end = int(numpy.searchsorted(self._targets, _address, side='right'))
+        return start, end
+
+    def __len__(self):
+        return len(self._targets)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming writers for the pointer graphs.
+
+networkx builds a full ElementTree of the graph before writing a GEXF file.
+These writers emit the XML text directly from the node and edge arrays,
+chunk by chunk, so that exporting a very large graph only needs the arrays.
+
+Nodes are memory addresses, written with a '0x%x' identifier,
+like the labels used in the networkx graphs.
+Node attributes are int64 arrays aligned with the nodes array,
+a value of -1 is a missing attribute value.
+"""
+
+import gzip
+import logging
+
+import numpy
+
+log = logging.getLogger('graphwriter')
+
+CHUNK_SIZE = 0x10000
+
+MISSING = -1
+
+
+class NodeAttribute(object):
+    """
+    A node attribute definition and its values.
+
+    :param name: the attribute name
+    :param values: int64 array aligned with the nodes array, -1 for no value
+    :param fmt: the output format of a value, '%d' or '0x%x'
+    """
+
+    def __init__(self, name, values, fmt='%d'):
+        self.name = name
+        self.values = numpy.asarray(values, dtype=numpy.int64)
+        self.fmt = fmt
+
+    def get_type(self):
+        if self.fmt == '%d':
+            return 'long'
+        return 'string'
+
+
+def merge_nodes(nodes, attributes, sources, targets):
+    """
+    Deduplicate nodes, add the edges end points as nodes, and
+    merge the attributes values of duplicated nodes.
+    The last valid value of an attribute wins, like in networkx.add_node.
+
+    :return: sorted unique nodes, list of NodeAttribute aligned with them
+    """
+    nodes = numpy.asarray(nodes, dtype=numpy.int64)
+    all_nodes = numpy.unique(numpy.concatenate([nodes, sources, targets]))
+    merged = []
+    for attr in attributes:
+        values = numpy.empty(len(all_nodes), dtype=numpy.int64)
+        values.fill(MISSING)
+        valid = attr.values != MISSING
+        _nodes = nodes[valid][::-1]
+        _values = attr.values[valid][::-1]
+        # on the reversed arrays, unique returns the last occurrence
+        _nodes, first = numpy.unique(_nodes, return_index=True)
+        values[numpy.searchsorted(all_nodes, _nodes)] = _values[first]
+        merged.append(NodeAttribute(attr.name, values, attr.fmt))
+    return all_nodes, merged
+
+
+def unique_edges(sources, targets):
+    """Returns the sorted, deduplicated edges of a directed graph"""
+    sources = numpy.asarray(sources, dtype=numpy.int64)
+    targets = numpy.asarray(targets, dtype=numpy.int64)
+    if len(sources) < 2:
+        return sources, targets
+    order = numpy.lexsort((targets, sources))
+    sources = sources[order]
+    targets = targets[order]
+    keep = numpy.ones(len(sources), dtype=bool)
+    keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+    return sources[keep], targets[keep]
+
+
+class StreamingGraphWriter(object):
+    """
+    Abstract streaming writer.
+    Subclasses implement the header, node, edge and footer formats.
+    """
+
+    def __init__(self, filename, compress=False, chunk_size=CHUNK_SIZE):
+        if compress and not filename.endswith('.gz'):
+            filename += '.gz'
+        self.filename = filename
+        self._compress = compress
+        self._chunk_size = chunk_size
+        self._fout = None
+
+    def write(self, nodes, sources, targets, attributes=None):
+        """
+        Write the graph to file.
+
+        :param nodes: array of node addresses, can hold duplicates
+        :param sources: array of edge source addresses
+        :param targets: array of edge target addresses
+        :param attributes: list of NodeAttribute aligned with nodes
+        :return: number of nodes, number of edges written
+        """
+        if attributes is None:
+            attributes = []
+        sources, targets = unique_edges(sources, targets)
+        nodes, attributes = merge_nodes(nodes, attributes, sources, targets)
+        if self._compress:
+            self._fout = gzip.open(self.filename, 'wb')
+        else:
+            self._fout = open(self.filename, 'wb')
+        try:
+            self._write(self._header(attributes))
+            for start in range(0, len(nodes), self._chunk_size):
+                end = start + self._chunk_size
+                chunk = [nodes[start:end].tolist()] + [attr.values[start:end].tolist() for attr in attributes]
+                self._write(self._nodes(attributes, chunk))
+            self._write(self._middle())
+            for start in range(0, len(sources), self._chunk_size):
+                end = start + self._chunk_size
+                self._write(self._edges(start, sources[start:end].tolist(), targets[start:end].tolist()))
+            self._write(self._footer())
+        finally:
+            self._fout.close()
+            self._fout = None
+        log.debug('[+] wrote %d nodes %d edges to %s', len(nodes), len(sources), self.filename)
+        return len(nodes), len(sources)
+
+    def _write(self, lines):
+        if len(lines) > 0:
+            self._fout.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def _header(self, attributes):
+        raise NotImplementedError('This should be implemented.')
+
+    def _nodes(self, attributes, chunk):
+        raise NotImplementedError('This should be implemented.')
+
+    def _middle(self):
+        raise NotImplementedError('This should be implemented.')
+
+    def _edges(self, first_id, sources, targets):
+        raise NotImplementedError('This should be implemented.')
+
+    def _footer(self):
+        raise NotImplementedError('This should be implemented.')
+
+
+class GEXFWriter(StreamingGraphWriter):
+    """Writes a directed graph in GEXF 1.2 format."""
+
+    def _header(self, attributes):
+        lines = ['<?xml version="1.0" encoding="utf-8"?>',
+                 '<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">',
+                 '  <graph defaultedgetype="directed" mode="static">']
+        if len(attributes) > 0:
+            lines.append('    <attributes class="node" mode="static">')
+            for i, attr in enumerate(attributes):
+                lines.append('      <attribute id="%d" title="%s" type="%s" />' % (i, attr.name, attr.get_type()))
+            lines.append('    </attributes>')
+        lines.append('    <nodes>')
+        return lines
+
+    def _nodes(self, attributes, chunk):
+        lines = []
+        fmts = [attr.fmt for attr in attributes]
+        for row in zip(*chunk):
+            node = '0x%x' % row[0]
+            values = ['<attvalue for="%d" value="%s" />' % (i, fmts[i] % v)
+                      for i, v in enumerate(row[1:]) if v != MISSING]
+            if len(values) == 0:
+                lines.append('      <node id="%s" label="%s" />' % (node, node))
+            else:
+                lines.append('      <node id="%s" label="%s"><attvalues>%s</attvalues></node>' % (
+                    node, node, ''.join(values)))
+        return lines
+
+    def _middle(self):
+        return ['    </nodes>', '    <edges>']
+
+    def _edges(self, first_id, sources, targets):
+        return ['      <edge id="%d" source="0x%x" target="0x%x" />' % (first_id + i, s, t)
+                for i, (s, t) in enumerate(zip(sources, targets))]
+
+    def _footer(self):
+        return ['    </edges>', '  </graph>', '</gexf>']
+
+
+class GraphMLWriter(StreamingGraphWriter):
+    """Writes a directed graph in GraphML format."""
+
+    def _header(self, attributes):
+        lines = ['<?xml version="1.0" encoding="utf-8"?>',
+                 '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">']
+        for i, attr in enumerate(attributes):
+            lines.append('  <key id="d%d" for="node" attr.name="%s" attr.type="%s" />' % (i, attr.name, attr.get_type()))
+        lines.append('  <graph edgedefault="directed">')
+        return lines
+
+    def _nodes(self, attributes, chunk):
+        lines = []
+        fmts = [attr.fmt for attr in attributes]
+        for row in zip(*chunk):
+            values = ['<data key="d%d">%s</data>' % (i, fmts[i] % v)
+                      for i, v in enumerate(row[1:]) if v != MISSING]
+            lines.append('    <node id="0x%x">%s</node>' % (row[0], ''.join(values)))
+        return lines
+
+    def _middle(self):
+        return []
+
+    def _edges(self, first_id, sources, targets):
+        return ['    <edge source="0x%x" target="0x%x" />' % (s, t) for s, t in zip(sources, targets)]
+
+    def _footer(self):
+        return ['  </graph>', '</graphml>']
+
+
+def write_gexf(filename, nodes, sources, targets, attributes=None, compress=False, chunk_size=CHUNK_SIZE):
+    """Write a directed graph to a GEXF file. Returns the number of nodes and edges written."""
+    writer = GEXFWriter(filename, compress, chunk_size)
+    return writer.write(nodes, sources, targets, attributes)
+
+
+def write_graphml(filename, nodes, sources, targets, attributes=None, compress=False, chunk_size=CHUNK_SIZE):
+    """Write a directed graph to a GraphML file. Returns the number of nodes and edges written."""
+    writer = GraphMLWriter(filename, compress, chunk_size)
+    return writer.write(nodes, sources, targets, attributes)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Heap growth analysis across a series of reversed dumps of the same process.
+
+The instance counts and byte totals are computed per record size and per
+record type name, from the columnar cache files of each dump:
+    - the allocations sizes, in <heap>.mchunks.sizes
+    - the type id of each allocation, in the record table <heap>.records.table
+      and the type names in <heap>.records.table.types, see recordtable
+No record is loaded. Allocations of records without a type name, or with a
+dirty row in the record table, only count per size.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import re
+import sys
+
+import numpy
+
+from haystack import argparse_utils
+from haystack.reverse import config
+from haystack.reverse import recordtable
+from haystack.reverse import utils
+
+log = logging.getLogger('growth')
+
+# type id of a record with its default name
+NO_TYPE = recordtable.NO_ID
+
+_SIZES_FILENAME = re.compile(r'^([0-9a-f]+)\.%s(\.npy)?$' % re.escape(config.CACHE_MALLOC_CHUNKS_SIZES))
+
+
+def _load_type_ids(dumpname, heap_addr, nb_allocations):
+    """
+    Returns the type ids of the allocations of a heap from its record table, NO_TYPE
+    for dirty rows, and the type names. Returns None if the heap has no record table.
+    """
+    table = utils.int_array_cache(config.get_cache_filename(config.CACHE_RECORD_TABLE, dumpname, heap_addr),
+                                  mmap_mode='r')
+    if table is None or table.shape[1] != nb_allocations:
+        return None
+    type_ids = numpy.where(table[recordtable.DIRTY] == 0, table[recordtable.TYPE_ID], NO_TYPE)
+    with open(config.get_cache_filename(config.CACHE_RECORD_TABLE_TYPES, dumpname, heap_addr)) as fin:
+        type_names = [line.rstrip('\n') for line in fin]
+    return type_ids, type_names
+
+
+def list_heaps(dumpname):
+    """Returns the sorted addresses of the heaps with cached allocations in a reversed dump"""
+    folder = config.get_cache_folder_name(dumpname)
+    heaps = set()
+    for fname in os.listdir(folder):
+        m = _SIZES_FILENAME.match(fname)
+        if m is not None:
+            heaps.add(int(m.group(1), 16))
+    return sorted(heaps)
+
+
+def _count_sorted(keys, weights):
+    """Returns the unique values of sorted keys, their count and the sum of their weights"""
+    if len(keys) == 0:
+        return keys, numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+    first = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+    counts = numpy.diff(numpy.append(first, len(keys)))
+    totals = numpy.add.reduceat(weights, first)
+    return keys[first], counts, totals
+
+
+class Snapshot(object):
+    """
+    The allocations sizes and record types of a reversed dump.
+
+    :param dumpname: the reversed dump
+    """
+
+    def __init__(self, dumpname):
+        self.dumpname = dumpname
+        sizes = []
+        type_ids = []
+        self.type_names = []
+        for heap_addr in list_heaps(dumpname):
+            _sizes = utils.int_array_cache(
+                config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, dumpname, heap_addr), mmap_mode='r')
+            sizes.append(numpy.asarray(_sizes, dtype=numpy.int64))
+            res = _load_type_ids(dumpname, heap_addr, len(_sizes))
+            if res is None:
+                log.warning('No record table for heap 0x%x in %s', heap_addr, dumpname)
+                type_ids.append(numpy.full(len(_sizes), NO_TYPE, dtype=numpy.int64))
+                continue
+            _types, _names = res
+            # type ids are local to a heap, shift them after the names of the previous heaps
+            type_ids.append(numpy.where(_types == NO_TYPE, NO_TYPE, _types + len(self.type_names)))
+            self.type_names.extend(_names)
+        self.sizes = numpy.concatenate(sizes) if len(sizes) > 0 else numpy.zeros(0, dtype=numpy.int64)
+        self.type_ids = numpy.concatenate(type_ids) if len(type_ids) > 0 else numpy.zeros(0, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def count_per_size(self):
+        """Returns the sorted record sizes, their instance count and bytes total"""
+        sizes = numpy.sort(self.sizes)
+        return _count_sorted(sizes, sizes)
+
+    def count_per_type(self):
+        """Returns the type names, their instance count and bytes total"""
+        typed = self.type_ids != NO_TYPE
+        order = numpy.argsort(self.type_ids[typed], kind='mergesort')
+        ids, counts, totals = _count_sorted(self.type_ids[typed][order], self.sizes[typed][order])
+        # several heaps can hold the same type name
+        res = {}
+        for _id, count, total in zip(ids.tolist(), counts.tolist(), totals.tolist()):
+            name = self.type_names[_id]
+            _count, _total = res.get(name, (0, 0))
+            res[name] = (_count + count, _total + total)
+        names = sorted(res)
+        counts = numpy.array([res[name][0] for name in names], dtype=numpy.int64)
+        totals = numpy.array([res[name][1] for name in names], dtype=numpy.int64)
+        return names, counts, totals
+
+
+class GrowthAnalysis(object):
+    """
+    Instance counts and byte totals per record size and per record type, across snapshots.
+
+    :param dumpnames: the reversed dumps of the same process, in chronological order
+    """
+
+    def __init__(self, dumpnames):
+        if len(dumpnames) < 2:
+            raise ValueError('At least two dumps are required')
+        self.dumpnames = list(dumpnames)
+        self.sizes = None
+        self.sizes_counts = None
+        self.sizes_bytes = None
+        self.types = None
+        self.types_counts = None
+        self.types_bytes = None
+        self._analyse()
+
+    def _analyse(self):
+        per_size = []
+        per_type = []
+        for dumpname in self.dumpnames:
+            log.info('[+] Loading snapshot %s', dumpname)
+            snapshot = Snapshot(dumpname)
+            per_size.append(snapshot.count_per_size())
+            per_type.append(snapshot.count_per_type())
+        # sizes of all snapshots
+        self.sizes = numpy.sort(numpy.concatenate([keys for keys, _, _ in per_size]))
+        self.sizes = _count_sorted(self.sizes, self.sizes)[0]
+        self.sizes_counts = numpy.zeros((len(self.sizes), len(self.dumpnames)), dtype=numpy.int64)
+        self.sizes_bytes = numpy.zeros((len(self.sizes), len(self.dumpnames)), dtype=numpy.int64)
+        for i, (keys, counts, totals) in enumerate(per_size):
+            index = numpy.searchsorted(self.sizes, keys)
+            self.sizes_counts[index, i] = counts
+            self.sizes_bytes[index, i] = totals
+        # type names of all snapshots
+        self.types = sorted(set(name for names, _, _ in per_type for name in names))
+        types_index = dict((name, i) for i, name in enumerate(self.types))
+        self.types_counts = numpy.zeros((len(self.types), len(self.dumpnames)), dtype=numpy.int64)
+        self.types_bytes = numpy.zeros((len(self.types), len(self.dumpnames)), dtype=numpy.int64)
+        for i, (names, counts, totals) in enumerate(per_type):
+            index = numpy.array([types_index[name] for name in names], dtype=numpy.int64)
+            self.types_counts[index, i] = counts
+            self.types_bytes[index, i] = totals
+        return
+
+    def _get_matrix(self, key, value):
+        if key not in ['size', 'type']:
+            raise ValueError('key should be size or type')
+        if value not in ['count', 'bytes']:
+            raise ValueError('value should be count or bytes')
+        if key == 'size':
+            keys = self.sizes.tolist()
+            matrix = self.sizes_counts if value == 'count' else self.sizes_bytes
+        else:
+            keys = self.types
+            matrix = self.types_counts if value == 'count' else self.types_bytes
+        return keys, matrix
+
+    def ranking(self, key='type', value='bytes', top=20):
+        """
+        Returns the keys with the largest growth between the first and last snapshot.
+
+        :param key: 'type' or 'size'
+        :param value: 'bytes' or 'count'
+        :param top: the number of results, all if None
+        :return: list of (key, growth, slope, monotonic, values per snapshot).
+            slope is the least squares growth per snapshot, monotonic is True if the
+            value never decreases across snapshots.
+        """
+        keys, matrix = self._get_matrix(key, value)
+        if len(keys) == 0:
+            return []
+        growth = matrix[:, -1] - matrix[:, 0]
+        x = numpy.arange(matrix.shape[1], dtype=numpy.float64)
+        x -= x.mean()
+        slopes = (matrix - matrix.mean(axis=1)[:, numpy.newaxis]).dot(x) / (x * x).sum()
+        monotonic = (numpy.diff(matrix, axis=1) >= 0).all(axis=1)
+        # largest growth first, then most regular
+        order = numpy.lexsort((-slopes, -growth))
+        if top is not None:
+            order = order[:top]
+        return [(keys[i], int(growth[i]), float(slopes[i]), bool(monotonic[i]), matrix[i].tolist())
+                for i in order]
+
+
+def print_ranking(ranking, key, fout=sys.stdout):
+    """Print a ranking, one key per line"""
+    for _key, growth, slope, monotonic, values in ranking:
+        if key == 'size':
+            _key = '%d' % _key
+        print('%-40s %+12d %+14.1f %s %s' % (_key, growth, slope, 'M' if monotonic else ' ',
+                                             ' '.join('%d' % v for v in values)), file=fout)
+    return
+
+
+def growth_cmdline(opts):
+    analysis = GrowthAnalysis(opts.dumps)
+    for key in ['type', 'size']:
+        print('# growth per %s, in %s' % (key, opts.value))
+        print_ranking(analysis.ranking(key, opts.value, opts.top), key)
+    return
+
+
+def argparser():
+    rootparser = argparse.ArgumentParser(
+        prog='haystack-reverse-growth',
+        description='Rank the heap growth per record type and size across reversed dumps of the same process.')
+    rootparser.add_argument('--debug', action='store_true', help='Debug mode on.')
+    rootparser.add_argument('--value', choices=['bytes', 'count'], default='bytes',
+                            help='Rank on bytes totals or instance counts.')
+    rootparser.add_argument('--top', type=int, default=20, help='Number of results.')
+    rootparser.add_argument('dumps', type=argparse_utils.readable, nargs='+',
+                            help='Reversed dumps, in chronological order.')
+    rootparser.set_defaults(func=growth_cmdline)
+    return rootparser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparser()
+    opts = parser.parse_args(argv)
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+    opts.func(opts)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+MinHash locality sensitive hashing of record signatures.
+
+Comparing all signatures of a size together with Levenshtein is quadratic.
+Instead, each signature text is cut in shingles (overlapping sequences of fields,
+a field being a type letter and a size like 'P4' or 'z12'), summarized by a MinHash sketch, and the sketches are cut in bands.
+Two signatures sharing one band are proposed as a candidate pair.
+Only candidate pairs are then verified with Levenshtein.ratio.
+
+Similar signatures share a band with a high probability:
+with b bands of r rows, a pair of Jaccard similarity s is a candidate
+with probability 1 - (1 - s^r)^b.
+"""
+
+import itertools
+import logging
+import re
+import zlib
+
+import Levenshtein
+import numpy
+
+log = logging.getLogger('minhash')
+
+# Levenshtein ratio above which two signatures are similar
+SIMILARITY_THRESHOLD = 0.75
+
+# a field of a signature text, a type letter followed by its size
+_FIELD = re.compile(r'[^0-9][0-9]*')
+
+# splitmix64 constants
+_MIX_1 = numpy.uint64(0xbf58476d1ce4e5b9)
+_MIX_2 = numpy.uint64(0x94d049bb133111eb)
+
+
+def _mix(values):
+    """splitmix64 finalizer on an uint64 array"""
+    with numpy.errstate(over='ignore'):
+        z = (values ^ (values >> numpy.uint64(30))) * _MIX_1
+        z = (z ^ (z >> numpy.uint64(27))) * _MIX_2
+        return z ^ (z >> numpy.uint64(31))
+
+
+def shingles(text, size=2):
+    """Returns the unique crc32 of all sequences of this number of fields in a signature text"""
+    fields = _FIELD.findall(text)
+    if len(fields) <= size:
+        return numpy.array([zlib.crc32(' '.join(fields).encode('latin1', 'replace'))], dtype=numpy.uint64)
+    values = set(zlib.crc32(' '.join(fields[i:i + size]).encode('latin1', 'replace'))
+                 for i in range(len(fields) - size + 1))
+    return numpy.fromiter(values, dtype=numpy.uint64, count=len(values))
+
+
+class MinHashLSH(object):
+    """
+    Proposes candidate pairs of similar texts.
+
+    :param nb_hashes: size of a MinHash sketch
+    :param bands: number of bands, nb_hashes should be a multiple of bands
+    :param shingle_size: the number of fields in a shingle
+    :param max_bucket_size: a band bucket with more texts only proposes each text
+        with its next max_bucket_size neighbours in the bucket
+    :param seed: seed of the hash functions
+    """
+
+    def __init__(self, nb_hashes=128, bands=64, shingle_size=2, max_bucket_size=16, seed=0):
+        if nb_hashes % bands != 0:
+            raise ValueError('nb_hashes should be a multiple of bands')
+        self._nb_hashes = nb_hashes
+        self._bands = bands
+        self._rows = nb_hashes // bands
+        self._shingle_size = shingle_size
+        self._max_bucket_size = max_bucket_size
+        rng = numpy.random.RandomState(seed)
+        self._seeds = rng.randint(0, 2 ** 62, size=nb_hashes, dtype=numpy.int64).astype(numpy.uint64)
+
+    def sketch(self, text):
+        """Returns the MinHash sketch of a text"""
+        _shingles = shingles(text, self._shingle_size)
+        # one hash function per seed, on all shingles at once
+        return _mix(_shingles[:, numpy.newaxis] ^ self._seeds[numpy.newaxis, :]).min(axis=0)
+
+    def sketches(self, texts):
+        """Returns the matrix of MinHash sketches of texts, one row per text"""
+        res = numpy.empty((len(texts), self._nb_hashes), dtype=numpy.uint64)
+        for i, text in enumerate(texts):
+            res[i] = self.sketch(text)
+        return res
+
+    def candidate_pairs(self, texts):
+        """
+        Returns the candidate pairs of similar texts.
+
+        :param texts: list of texts
+        :return: int64 array of shape (n, 2) of texts indexes, i < j, without duplicates
+        """
+        nb = len(texts)
+        if nb < 2:
+            return numpy.zeros((0, 2), dtype=numpy.int64)
+        _sketches = self.sketches(texts)
+        pairs = []
+        with numpy.errstate(over='ignore'):
+            for band in range(self._bands):
+                rows = _sketches[:, band * self._rows:(band + 1) * self._rows]
+                # one key per band
+                keys = numpy.zeros(nb, dtype=numpy.uint64)
+                for col in range(self._rows):
+                    keys = _mix(keys ^ rows[:, col])
+                pairs.extend(self._bucket_pairs(keys))
+        if len(pairs) == 0:
+            return numpy.zeros((0, 2), dtype=numpy.int64)
+        pairs = numpy.concatenate(pairs)
+        # deduplicate pairs found in several bands
+        codes = numpy.unique(pairs[:, 0] * nb + pairs[:, 1])
+        return numpy.column_stack((codes // nb, codes % nb))
+
+    def _bucket_pairs(self, keys):
+        """Yields arrays of pairs of indexes with the same key"""
+        order = numpy.argsort(keys, kind='mergesort')
+        sorted_keys = keys[order]
+        # an offset d pairs each text with the d-th next text of the same bucket
+        for offset in range(1, min(self._max_bucket_size, len(keys) - 1) + 1):
+            same = numpy.flatnonzero(sorted_keys[offset:] == sorted_keys[:-offset])
+            if len(same) == 0:
+                break
+            first = order[same]
+            second = order[same + offset]
+            yield numpy.column_stack((numpy.minimum(first, second), numpy.maximum(first, second)))
+
+
+def verify_pairs(texts, pairs, threshold=SIMILARITY_THRESHOLD):
+    """Returns the pairs of texts indexes with a Levenshtein ratio above threshold"""
+    keep = [Levenshtein.ratio(texts[i], texts[j]) > threshold for i, j in pairs]
+    return numpy.asarray(pairs, dtype=numpy.int64).reshape(-1, 2)[numpy.array(keep, dtype=bool)]
+
+
+def exhaustive_pairs(texts, threshold=SIMILARITY_THRESHOLD):
+    """Compares all pairs of texts, returns the pairs above threshold"""
+    res = [(i, j) for i, j in itertools.combinations(range(len(texts)), 2)
+           if Levenshtein.ratio(texts[i], texts[j]) > threshold]
+    return numpy.asarray(res, dtype=numpy.int64).reshape(-1, 2)
+
+
+def similar_pairs(texts, lsh=None, threshold=SIMILARITY_THRESHOLD):
+    """
+    Returns the pairs of similar texts, and the number of candidates verified.
+
+    :param lsh: a MinHashLSH, default parameters if None
+    """
+    if lsh is None:
+        lsh = MinHashLSH()
+    candidates = lsh.candidate_pairs(texts)
+    return verify_pairs(texts, candidates, threshold), len(candidates)
+
+
+def evaluate(texts, lsh=None, threshold=SIMILARITY_THRESHOLD):
+    """
+    Compare the LSH mode against the exhaustive mode. Use on small inputs.
+
+    :return: dict with the number of comparisons, candidates, pairs found and the recall
+    """
+    nb = len(texts)
+    expected = exhaustive_pairs(texts, threshold)
+    found, nb_candidates = similar_pairs(texts, lsh, threshold)
+    expected = set(map(tuple, expected.tolist()))
+    found = set(map(tuple, found.tolist()))
+    recall = 1.0
+    if len(expected) > 0:
+        recall = len(expected & found) / float(len(expected))
+    res = {'texts': nb,
+           'comparisons': nb * (nb - 1) // 2,
+           'candidates': nb_candidates,
+           'expected': len(expected),
+           'found': len(found),
+           'recall': recall}
+    log.info('LSH: %(candidates)d candidates for %(comparisons)d comparisons, '
+             'found %(found)d/%(expected)d similar pairs, recall %(recall)0.3f', res)
+    return res
@@ -47,9 +47,17 @@ class AbstractReverser(hri.IReverser):
             yield ctx
 
     def _iterate_records(self, _context):
-        """ Override to change the list of record for this _context """
-        for _record in _context.listStructures():
-            if _record.get_reverse_level() >= self.get_reverse_level():
+        """
+        Override to change the list of record for this _context
+
+        Records saved at this reverse level or above are skipped with the record table,
+        without being loaded.
+        """
+        reverse_level = self.get_reverse_level()
+        addresses = _context.get_record_table().select(max_reverse_level=reverse_level)
+        for address in addresses.tolist():
+            _record = _context.get_record_for_address(address)
+            if _record.get_reverse_level() >= reverse_level:
                 continue
             yield _record
 
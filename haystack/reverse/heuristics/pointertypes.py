@@ -42,7 +42,10 @@ class PointerFieldReverser(model.AbstractReverser):
         # the caller
         pointer_fields = [field for field in _record.get_fields() if field.type.is_pointer()]
         log.debug('got %d pointer fields', len(pointer_fields))
-        for field in pointer_fields:
+        # resolve the heap of all pointer values at once
+        process_context = self._memory_handler.get_reverse_context()
+        context_ids = process_context.get_context_ids_for_addresses([field.value for field in pointer_fields])
+        for field, context_id in zip(pointer_fields, context_ids.tolist()):
             value = field.value
             # get the FieldInstance, and its value.
             # ? FIX ME This is messed up, this set_pointee_addr method should be in FieldInstance
@@ -53,10 +56,7 @@ class PointerFieldReverser(model.AbstractReverser):
             if value % self._target.get_word_size():
                 field.type.comment = 'Unaligned pointer value'
             # + ask _memory_handler for the context for that value
-            try:
-                ctx = context.get_context_for_address(self._memory_handler, value)  # no error expected.
-                # + ask context for the target structure or code info
-            except ValueError as e:
+            if context_id == context.NO_CONTEXT:
                 # value is a pointer, but not to a heap.
                 m = self._memory_handler.get_mapping_for_address(value)
                 # field.set_child_desc('ext_lib @%0.8x %s' % (m.start, m.pathname))
@@ -68,6 +68,8 @@ class PointerFieldReverser(model.AbstractReverser):
                 #    size, bbs, name = self.__functions_pointers[value]
                 #    field.name = 'func_ptr_%s_%d' % (name, field.offset)
                 continue
+            # + ask context for the target structure or code info
+            ctx = process_context.get_context_for_id(context_id)
             tgt = None
             try:
                 # get enclosing structure @throws KeyError
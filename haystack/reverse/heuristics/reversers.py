@@ -10,9 +10,14 @@ from past.builtins import long
 
 from haystack.reverse import config
 from haystack.reverse import context
+from haystack.reverse import diff
 from haystack.reverse import fieldtypes
+from haystack.reverse import graphindex
+from haystack.reverse import graphwriter
 from haystack.reverse import pattern
+from haystack.reverse import stringtable
 from haystack.reverse import structure
+from haystack.reverse import utils
 from haystack.reverse.heuristics import model
 from haystack.reverse.heuristics import signature
 
@@ -424,50 +429,74 @@ class DoubleLinkedListReverser(model.AbstractReverser):
 class PointerGraphReverser(model.AbstractReverser):
     """
       use the pointer relation between structure to map a graph.
+
+      Nodes and edges are accumulated in int64 arrays and the graphs are
+      streamed to GEXF files, without building networkx graphs in memory.
     """
     REVERSE_LEVEL = 150
 
-    def __init__(self, _memory_handler):
+    def __init__(self, _memory_handler, compress=False):
         super(PointerGraphReverser, self).__init__(_memory_handler)
-        import networkx
-        self._master_graph = networkx.DiGraph()
-        self._heaps_graph = networkx.DiGraph()
-        self._graph = None
+        self._compress = compress
+        # nodes and their attributes. -1 is no value.
+        self._nodes = utils.ArrayBuilder()
+        self._nodes_heap = utils.ArrayBuilder()
+        self._nodes_weight = utils.ArrayBuilder()
+        # edges of the process graph.
+        # known edges are pointers to a record, they make the heaps graph
+        self._edges_sources = utils.ArrayBuilder()
+        self._edges_targets = utils.ArrayBuilder()
+        self._edges_known = utils.ArrayBuilder()
 
     def reverse(self):
         super(PointerGraphReverser, self).reverse()
-        import networkx
         dumpname = self._memory_handler.get_name()
+        sources = self._edges_sources.to_array()
+        targets = self._edges_targets.to_array()
+        # save the reverse adjacency index first, used by get_predecessors
+        nb_edges = graphindex.save_predecessors_index(dumpname, sources, targets)
+        log.info('[+] Process Graph predecessors index == %d Edges', nb_edges)
         outname1 = os.path.sep.join([config.get_cache_folder_name(dumpname), config.CACHE_GRAPH])
         outname2 = os.path.sep.join([config.get_cache_folder_name(dumpname), config.CACHE_GRAPH_HEAP])
 
-        log.info('[+] Process Graph == %d Nodes', self._master_graph.number_of_nodes())
-        log.info('[+] Process Graph == %d Edges', self._master_graph.number_of_edges())
-        networkx.readwrite.gexf.write_gexf(self._master_graph, outname1)
-        log.info('[+] Process Heaps Graph == %d Nodes', self._heaps_graph.number_of_nodes())
-        log.info('[+] Process Heaps Graph == %d Edges', self._heaps_graph.number_of_edges())
-        networkx.readwrite.gexf.write_gexf(self._heaps_graph, outname2)
+        nb_nodes, nb_edges = self._write_graph(outname1, sources, targets)
+        log.info('[+] Process Graph == %d Nodes', nb_nodes)
+        log.info('[+] Process Graph == %d Edges', nb_edges)
+        known = self._edges_known.to_array().astype(bool)
+        nb_nodes, nb_edges = self._write_graph(outname2, sources[known], targets[known])
+        log.info('[+] Process Heaps Graph == %d Nodes', nb_nodes)
+        log.info('[+] Process Heaps Graph == %d Edges', nb_edges)
         return
 
+    def _write_graph(self, filename, sources, targets, nodes_start=0, nodes_end=None):
+        attributes = [graphwriter.NodeAttribute('heap', self._nodes_heap.to_array(nodes_start, nodes_end), '0x%x'),
+                      graphwriter.NodeAttribute('weight', self._nodes_weight.to_array(nodes_start, nodes_end))]
+        nodes = self._nodes.to_array(nodes_start, nodes_end)
+        return graphwriter.write_gexf(filename, nodes, sources, targets, attributes, compress=self._compress)
+
+    def _add_node(self, address, heap=-1, weight=-1):
+        self._nodes.append(address)
+        self._nodes_heap.append(heap)
+        self._nodes_weight.append(weight)
+
     def reverse_context(self, _context):
-        import networkx
         # we only need the addresses...
-        self._graph = networkx.DiGraph()
         t0 = time.time()
-        tl = t0
-        context_heap = hex(_context._heap_start)
+        nodes_start = len(self._nodes)
+        edges_start = len(self._edges_sources)
+        context_heap = _context._heap_start
         for _record in _context.listStructures():
             # in all case
-            self._graph.add_node(hex(_record.address), heap=context_heap, weight=len(_record))
-            self._master_graph.add_node(hex(_record.address), heap=context_heap, weight=len(_record))
-            self._heaps_graph.add_node(hex(_record.address), heap=context_heap, weight=len(_record))
+            self._add_node(_record.address, heap=context_heap, weight=len(_record))
             self.reverse_record(_context, _record)
             # output headers
-        #
-        log.info('[+] Heap %s Graph += %d Nodes', context_heap, self._graph.number_of_nodes())
-        log.info('[+] Heap %s Graph += %d Edges', context_heap, self._graph.number_of_edges())
-        networkx.readwrite.gexf.write_gexf(self._graph, _context.get_filename_cache_graph())
-        ##
+        # the heap graph is made of the nodes and edges added for that heap
+        sources = self._edges_sources.to_array(edges_start)
+        targets = self._edges_targets.to_array(edges_start)
+        nb_nodes, nb_edges = self._write_graph(_context.get_filename_cache_graph(), sources, targets, nodes_start)
+        log.info('[+] Heap 0x%x Graph += %d Nodes', context_heap, nb_nodes)
+        log.info('[+] Heap 0x%x Graph += %d Edges', context_heap, nb_edges)
+        log.debug('[+] Heap 0x%x Graph in %2.2f secs', context_heap, time.time() - t0)
         return
 
     def reverse_record(self, heap_context, _record):
@@ -477,45 +506,39 @@ class PointerGraphReverser(model.AbstractReverser):
         # target_struct_addr
 
         pointer_fields = [f for f in _record.get_fields() if f.type.is_pointer()]
-        for f in pointer_fields:
-            pointee_addr = f.value  # f._child_addr
+        pointees = [f.value for f in pointer_fields]  # f._child_addr
+        # resolve the heap of all pointees at once
+        process_context = self._memory_handler.get_reverse_context()
+        context_ids = process_context.get_context_ids_for_addresses(pointees)
+        for pointee_addr, context_id in zip(pointees, context_ids.tolist()):
             # we always feed these two
             # TODO: if a Node is out of heap/segment, replace it by a virtual node & color representing
             # the foreign heap/segment
-            self._graph.add_edge(hex(_record.address), hex(pointee_addr))
-            # add a colored node
-            self._master_graph.add_edge(hex(_record.address), hex(pointee_addr))
+            self._edges_sources.append(_record.address)
+            self._edges_targets.append(pointee_addr)
             # but we only feed the heaps graph if the target is known
-            heap = self._memory_handler.get_mapping_for_address(pointee_addr)
-            try:
-                heap_context = context.get_context_for_address(self._memory_handler, pointee_addr)
-            except ValueError as e:
-                continue
-            #heap_context = self._memory_handler.get_reverse_context().get_context_for_heap(heap)
-            if heap_context is None:
-                continue
-            # add a heap color
-            context_heap = hex(heap_context._heap_start)
-            self._graph.add_node(hex(pointee_addr), heap=context_heap)
-            self._master_graph.add_node(hex(pointee_addr), heap=context_heap)
-            self._heaps_graph.add_node(hex(pointee_addr), heap=context_heap)
-            try:
-                pointee = heap_context.get_record_at_address(pointee_addr)
-            except IndexError as e:
-                continue
-            except ValueError as e:
-                continue
-            self._heaps_graph.add_edge(hex(_record.address), hex(pointee_addr))
-            # add a weight
-            self._graph.add_node(hex(pointee_addr), weight=len(_record))
-            self._master_graph.add_node(hex(pointee_addr), weight=len(_record))
-            self._heaps_graph.add_node(hex(pointee_addr), weight=len(_record))
+            known = False
+            if context_id != context.NO_CONTEXT:
+                heap_context = process_context.get_context_for_id(context_id)
+                # add a heap color
+                self._add_node(pointee_addr, heap=heap_context._heap_start)
+                try:
+                    pointee = heap_context.get_record_at_address(pointee_addr)
+                    known = True
+                except (IndexError, ValueError) as e:
+                    pass
+            self._edges_known.append(known)
+            if known:
+                # add a weight
+                self._add_node(pointee_addr, weight=len(_record))
         return
 
     def load_process_graph(self):
         import networkx
         dumpname = self._memory_handler.get_name()
         fname = os.path.sep.join([config.get_cache_folder_name(dumpname), config.CACHE_GRAPH])
+        if not os.access(fname, os.F_OK) and os.access(fname + '.gz', os.F_OK):
+            fname += '.gz'
         my_graph = networkx.readwrite.gexf.read_gexf(fname)
         return my_graph
 
@@ -665,19 +688,26 @@ class InlineRecordReverser(model.AbstractReverser):
 
 class StringsReverser(model.AbstractReverser):
     """
-    Detect record types in a large one .
+    Extract all strings of the heap to a strings table, see stringtable.StringTable,
+    and write the strings in records from that table. Records are not loaded.
+
+    The <heap>.strings file has one "address,length,value" line per string found
+    in a record by the strings table scan: ASCII and UTF-16LE runs of printable
+    characters, at any offset. It used to list only the fields typed as strings
+    by the previous reversers, with the field address and the field length.
     """
     REVERSE_LEVEL = 500
 
     def reverse_context(self, _context):
-        self.fout = open(_context.get_filename_cache_strings(), 'w')
-        super(StringsReverser, self).reverse_context(_context)
-        self.fout.close()
-
-    def reverse_record(self, _context, _record):
-        for field in _record.get_fields():
-            addr = _record.address + field.type.offset
-            if field.type.is_string():
-                maxlen = len(field.type)
-                value = field.get_value_for_field(maxlen+10)
-                self.fout.write("0x%x,%d,%s\n" % (addr, maxlen, value))
+        # bulk extraction of all strings of the heap
+        heap = self._memory_handler.get_mapping_for_address(_context._heap_start)
+        table = stringtable.StringTable.build(diff.get_mapping_content(heap), heap.start,
+                                              _context._structures_addresses, _context._structures_sizes)
+        table.save(_context.dumpname, _context._heap_start)
+        log.debug('[+] %d strings, %d distinct values in heap 0x%x', len(table), len(table.values),
+                  _context._heap_start)
+        # strings in records
+        with open(_context.get_filename_cache_strings(), 'w') as fout:
+            for address, length, value in table.iter_records_strings():
+                fout.write("0x%x,%d,%s\n" % (address, length, value))
+        return
@@ -10,16 +10,20 @@ import struct
 import os
 import re
 import Levenshtein  # seqmatcher ?
-import networkx
 import numpy
 
 from haystack.reverse import config
+from haystack.reverse import context
+from haystack.reverse import disjointset
+from haystack.reverse import fieldtypes
+from haystack.reverse import graphwriter
 import haystack.reverse.matchers
 from haystack.utils import xrange
 from haystack.reverse import searchers
 from haystack.reverse import utils
 from haystack.reverse import structure
 from haystack.reverse.heuristics import dsa
+from haystack.reverse.heuristics import minhash
 from haystack.reverse.heuristics import model
 import time
 
@@ -31,6 +35,64 @@ creating signature for record to compare them.
 
 log = logging.getLogger('signature')
 
+# size buckets with less distinct signatures are compared exhaustively
+LSH_MIN_BUCKET_SIZE = 64
+
+
+def exact_classes(keys):
+    """
+    Group identical keys, like signatures texts or (size, signature text).
+
+    :return: list of classes, a class is the list of indexes of identical keys.
+            The first index of a class is its representative.
+    """
+    classes = {}
+    for i, key in enumerate(keys):
+        if key not in classes:
+            classes[key] = []
+        classes[key].append(i)
+    return sorted(classes.values())
+
+
+def expand_similarities(classes, pairs):
+    """
+    Expand similar pairs of class representatives to pairs of members.
+    Identical members are similar to their representative, the representatives
+    similar pairs link the classes together. That is enough to build the chains,
+    without listing every pair of members.
+
+    :param classes: the exact classes
+    :param pairs: similar pairs of indexes in classes
+    :return: list of similar pairs of members indexes
+    """
+    similarities = [(classes[i][0], classes[j][0]) for i, j in pairs]
+    for members in classes:
+        similarities.extend((members[0], member) for member in members[1:])
+    return similarities
+
+
+def compare_size_bucket(job):
+    """
+    Compare the signatures of a size bucket.
+    Module level function, so that it can run in a worker process.
+
+    :param job: (size, records identifiers, signatures texts, exhaustive)
+    :return: size, number of signatures, of distinct signatures, of comparisons,
+            list of similar pairs of records identifiers, time spent
+    """
+    size, records, texts, exhaustive = job
+    t0 = time.time()
+    # compare only one representative of identical signatures
+    classes = exact_classes(texts)
+    representatives = [texts[members[0]] for members in classes]
+    nb = len(representatives)
+    if exhaustive or nb < LSH_MIN_BUCKET_SIZE:
+        pairs, nb_comparisons = minhash.exhaustive_pairs(representatives), nb * (nb - 1) // 2
+    else:
+        pairs, nb_comparisons = minhash.similar_pairs(representatives)
+    similarities = [(records[i], records[j]) for i, j in expand_similarities(classes, pairs)]
+    return size, len(texts), nb, nb_comparisons, similarities, time.time() - t0
+
 
 class TypeReverser(model.AbstractReverser):
     """
@@ -40,16 +102,29 @@ class TypeReverser(model.AbstractReverser):
     Abstract Reverser, that do not go to the record level (except to get a signature).
 
     1. Look at all structures type signatures.
-    2. Compare all signatures together (Levensthein)
-    3. group similar structures together, in a graph
-
+    2. Compare all signatures of the same size together (Levensthein)
+       Large size buckets only compare candidates pairs proposed by MinHash LSH,
+       unless exhaustive is True.
+       Size buckets are independent, they are dispatched to a pool of worker
+       processes, largest first, if processes > 1.
+    3. group similar structures together, in a disjoint-set
+
+    If a typelibrary.TypeLibrary is given, records with a signature known in the
+    library are named first and skip the comparisons. The new types are added to
+    the library under their generated names, unconfirmed, and the library is
+    saved at the end.
     """
     REVERSE_LEVEL = 300
 
-    def __init__(self, memory_handler):
+    def __init__(self, memory_handler, exhaustive=False, processes=1, library=None):
         super(TypeReverser, self).__init__(memory_handler)
         self._signatures = None
         self._similarities = None
+        self._exhaustive = exhaustive
+        self._processes = processes
+        self._library = library
+        # type name: (record type, members addresses)
+        self._record_types = {}
         try:
             import pkgutil
             self._words = pkgutil.get_data(__name__, config.WORDS_FOR_REVERSE_TYPES_FILE)
@@ -77,6 +152,8 @@ class TypeReverser(model.AbstractReverser):
             self.reverse_context(_context)
             # save the context
             _context.save()
+        if self._library is not None:
+            self._library.save()
         # closing statements
         total = self._nb_from_cache + self._nb_reversed
         ts = time.time() - self._t0
@@ -88,9 +165,14 @@ class TypeReverser(model.AbstractReverser):
         """
         Go over each record and call the reversing process.
         """
+        process_context = self._memory_handler.get_reverse_context()
         signatures = self._gather_signatures(_context)
+        if self._library is not None:
+            signatures = self._rename_known_records(process_context, _context, signatures)
         similarities = self._chain_similarities(signatures)
-        self._rename_similar_records(self._memory_handler.get_reverse_context(), _context, similarities)
+        names = self._rename_similar_records(process_context, _context, similarities)
+        if self._library is not None:
+            self._update_library(_context, similarities, names)
         for _record in _context.listStructures():
             # do the changes.
             self.reverse_record(_context, _record)
@@ -111,30 +193,56 @@ class TypeReverser(model.AbstractReverser):
         return signatures
 
     def _chain_similarities(self, signatures):
-        import Levenshtein
-        similarities = []
-        for i, (size1, addr1, el1) in enumerate(signatures[:-1]):
-            log.debug("Comparing signatures with %s", el1)
-            for size2, addr2, el2 in signatures[i + 1:]:
-                # if abs(size1 - size2) > 4*self._word_size:
-                #     continue
-                # RULE - records with different size are not similar
-                if size2 != size1:
-                    break
-                lev = Levenshtein.ratio(el1, el2)  # seqmatcher ?
-                if lev > 0.75:
-                    similarities.append((addr1, addr2))
-                    # we do not need the signature.
+        nb_similarities = 0
+        nb_comparisons = 0
+        # records are identified by their index in signatures
+        chains = disjointset.DisjointSet(len(signatures))
+        # RULE - records with different size are not similar
+        jobs = []
+        start = 0
+        for size, bucket in itertools.groupby(signatures, key=lambda x: x[0]):
+            texts = [text for _, _, text in bucket]
+            end = start + len(texts)
+            if len(texts) > 1:
+                jobs.append((size, range(start, end), texts, self._exhaustive))
+            start = end
+        # largest buckets first, they dominate the runtime
+        jobs.sort(key=lambda job: len(job[1]), reverse=True)
+        timings = []
+        for i, res in enumerate(self._compare_size_buckets(jobs)):
+            size, nb_signatures, nb_distinct, nb, pairs, ts = res
+            log.debug("[%d/%d] Size %d: %d signatures, %d distinct, %d comparisons, %d similar couples in %2.2fs",
+                      i + 1, len(jobs), size, nb_signatures, nb_distinct, nb, len(pairs), ts)
+            nb_comparisons += nb
+            nb_similarities += len(pairs)
+            # chain the records as the pairs come
+            chains.union_pairs(pairs)
+            timings.append((ts, size, nb_signatures))
         # proposition to the user
-        log.debug('\t[-] Signatures done. %d similar couples.' % len(similarities))
-        graph = networkx.Graph()
-        graph.add_edges_from(similarities)
-        subgraphs = networkx.algorithms.components.connected.connected_component_subgraphs(graph)
-        chains = [g.nodes() for g in subgraphs]
+        log.debug('\t[-] Signatures done. %d similar couples in %d comparisons.', nb_similarities, nb_comparisons)
+        for ts, size, nb_signatures in sorted(timings, reverse=True)[:5]:
+            log.info('\t[-] Size %d: %d signatures compared in %2.2fs', size, nb_signatures, ts)
+        chains = [[signatures[i][1] for i in group] for group in chains.groups(min_size=2)]
         for c in chains:
             log.debug(c)
         return chains
 
+    def _compare_size_buckets(self, jobs):
+        """Yields the results of compare_size_bucket for each job, as they complete"""
+        if self._processes <= 1 or len(jobs) < 2:
+            for job in jobs:
+                yield compare_size_bucket(job)
+            return
+        import multiprocessing
+        pool = multiprocessing.Pool(self._processes)
+        try:
+            for res in pool.imap_unordered(compare_size_bucket, jobs):
+                yield res
+        finally:
+            pool.close()
+            pool.join()
+        return
+
     def _make_original_type_name(self):
         # refill the pool if empty
         if len(self._NAMES) == 0:
@@ -142,22 +250,75 @@ class TypeReverser(model.AbstractReverser):
             self._NAMES = [''.join(x) for x in itertools.permutations(self._words.split('\n')[:-1], self._NAMES_plen)]
         return self._NAMES.pop()
 
+    def _make_new_type_name(self):
+        """Returns a generated name, that is not a type of the library"""
+        name = self._make_original_type_name()
+        while self._library is not None and self._library.has_name(name):
+            name = self._make_original_type_name()
+        return name
+
     def _rename_similar_records(self, process_context, heap_context, chains):
         """ Fix the name of each structure to a generic word/type name """
+        names = []
         for chain in chains:
-            name = self._make_original_type_name()
+            name = self._make_new_type_name()
             log.debug('\t[-] fix type of chain size:%d with name name:%s' % (len(chain), name))
-            for addr in chain:  # chain is a list of addresses
-                addr = int(addr)
-                # FIXME - use a proper renaming tool
-                instance = heap_context.get_record_for_address(addr)
-                instance.name = name
-                ctypes_type = process_context.get_reversed_type(name)
-                if ctypes_type is None:  # make type
-                    ctypes_type = structure.ReversedType.create(process_context, name)
-                ctypes_type.addInstance(instance)
-                instance.set_ctype(ctypes_type)
-                # FIXME - does that even work ?
+            self._rename_records(process_context, heap_context, name, chain)
+            names.append(name)
+        return names
+
+    def _get_record_type(self, process_context, name, _record):
+        """Returns the record type of that name and its members, made from the fields of this record if new"""
+        if name not in self._record_types:
+            record_type = fieldtypes.RecordType(name, len(_record), _record.record_type.get_fields())
+            members = []
+            # the members list is filled as the records are renamed
+            process_context.add_reversed_type(record_type, members)
+            self._record_types[name] = (record_type, members)
+        return self._record_types[name]
+
+    def _rename_records(self, process_context, heap_context, name, addresses):
+        """Set the record type of that name on the records, like DoubleLinkedListReverser"""
+        for addr in addresses:  # chain is a list of addresses
+            addr = int(addr)
+            instance = heap_context.get_record_for_address(addr)
+            record_type, members = self._get_record_type(process_context, name, instance)
+            if len(instance) != len(record_type):
+                log.warning('Record 0x%x is not of the size of type %s', addr, name)
+                continue
+            instance.set_record_type(record_type, True)
+            instance._dirty = True
+            members.append(addr)
+        return
+
+    def _rename_known_records(self, process_context, heap_context, signatures):
+        """
+        Name the records with a signature known in the library.
+
+        :return: the signatures of unknown records
+        """
+        known = {}
+        unknown = []
+        for size, addr, text in signatures:
+            name = self._library.lookup(size, text)
+            if name is None:
+                unknown.append((size, addr, text))
+                continue
+            if name not in known:
+                known[name] = []
+            known[name].append(addr)
+        for name, addresses in known.items():
+            self._rename_records(process_context, heap_context, name, addresses)
+        log.info('\t[-] %d/%d records named from the type library', len(signatures) - len(unknown), len(signatures))
+        return unknown
+
+    def _update_library(self, heap_context, chains, names):
+        """Add the signatures of the new types to the library"""
+        nb = len(self._library)
+        for chain, name in zip(chains, names):
+            for addr in chain:
+                self._library.add_record(heap_context.get_record_for_address(addr), name, confirmed=False)
+        log.debug('\t[-] %d new signatures in the type library', len(self._library) - nb)
         return
 
     def persist(self, _context):
@@ -197,8 +358,11 @@ class CommonTypeReverser(model.AbstractReverser):
         self._members_by_context = {}
         process_context = self._memory_handler.get_reverse_context()
         # organise the list
-        for record_addr in self._members:
-            heap_context = process_context.get_context_for_address(record_addr)
+        context_ids = process_context.get_context_ids_for_addresses(self._members)
+        if (context_ids == context.NO_CONTEXT).any():
+            raise ValueError('Members are not all in a heap')
+        for record_addr, context_id in zip(self._members, context_ids.tolist()):
+            heap_context = process_context.get_context_for_id(context_id)
             if heap_context not in self._members_by_context:
                 self._members_by_context[heap_context] = []
             self._members_by_context[heap_context].append(record_addr)
@@ -251,6 +415,7 @@ class SignatureGroupMaker:
         # get text signature for Counter to parse
         # need to force resolve of allocators
         self._signatures = []
+        self._sizes = []
         # FIXME DELETE - OBSOLETE, now workflow is part of api.reverse
         decoder = dsa.FieldReverser(self._context.memory_handler)
         for addr in map(long, self._structures_addresses):
@@ -259,27 +424,31 @@ class SignatureGroupMaker:
             ## record.decodeFields()  # can be long
             decoder.analyze_fields(record)
             # get the signature for the record
-            self._signatures.append((addr, self._context.get_record_for_address(addr).get_signature_text()))
+            self._signatures.append((addr, record.get_signature_text()))
+            self._sizes.append(len(record))
         return
 
     def make(self):
         self._init_signatures()
         #
         # FIXME DELETE - DUPLICATE, signature.TypeReverser
-        self._similarities = []
-        for i, x1 in enumerate(self._signatures[:-1]):
-            for x2 in self._signatures[i + 1:]:
-                addr1, el1 = x1
-                addr2, el2 = x2
+        # compare only one representative of identical signatures
+        classes = exact_classes([(self._sizes[i], el) for i, (addr, el) in enumerate(self._signatures)])
+        pairs = []
+        for i, members1 in enumerate(classes[:-1]):
+            el1 = self._signatures[members1[0]][1]
+            for j, members2 in enumerate(classes[i + 1:], i + 1):
+                el2 = self._signatures[members2[0]][1]
                 lev = Levenshtein.ratio(el1, el2)  # seqmatcher ?
                 if lev > 0.75:
-                    #self._similarities.append( ((addr1,el1),(addr2,el2)) )
-                    self._similarities.append((addr1, addr2))
+                    pairs.append((i, j))
                     # we do not need the signature.
+        self._similarities = [(self._signatures[i][0], self._signatures[j][0])
+                              for i, j in expand_similarities(classes, pairs)]
         # check for chains
         # TODO      we need a group maker with an iterator to push group
         # proposition to the user
-        log.debug('\t[-] Signatures done.')
+        log.debug('\t[-] Signatures done. %d signatures, %d distinct.', len(self._signatures), len(classes))
         return
 
     def persist(self):
@@ -312,65 +481,84 @@ class SignatureGroupMaker:
 
 class StructureSizeCache:
 
-    """Loads allocators, get their signature (and size) and sort them in
-    fast files dictionaries."""
+    """Loads allocators addresses, and group them by size in a single index file.
+
+    The index is one int64 array, memory-mapped when loaded:
+        [nb_sizes, nb_addresses, sizes[nb_sizes], starts[nb_sizes + 1], addresses[nb_addresses]]
+    addresses are sorted by size, then by address. The allocators of sizes[i]
+    are addresses[starts[i]:starts[i+1]].
+    """
 
     def __init__(self, ctx):
         self._context = ctx
         self._sizes = None
+        self._starts = None
+        self._addresses = None
+        self._size_to_index = None
+
+    def _get_filename(self):
+        return config.get_cache_filename(config.CACHE_SIGNATURE_SIZES_INDEX,
+                                         self._context.dumpname, self._context._heap_start)
 
     def _loadCache(self):
-        outdir = config.get_cache_filename(
-            config.CACHE_SIGNATURE_SIZES_DIR,
-            self._context.dumpname)
-        fdone = os.path.sep.join(
-            [outdir, config.CACHE_SIGNATURE_SIZES_DIR_TAG])
-        if not os.access(fdone, os.R_OK):
+        index = utils.int_array_cache(self._get_filename(), mmap_mode='r')
+        if index is None or len(index) < 2:
             return False
-        for myfile in os.listdir(outdir):
-            try:
-                # FIXME: not sure its -
-                # and what that section is about in general.
-                addr = int(myfile.split('-')[1], 16)
-            except IndexError as e:
-                continue  # ignore file
+        nb_sizes, nb_addresses = int(index[0]), int(index[1])
+        if len(index) != 3 + 2 * nb_sizes + nb_addresses:
+            log.warning('Corrupted size index for %s', self._context)
+            return False
+        if nb_addresses != len(self._context._structures_addresses):
+            log.debug('Stale size index for %s', self._context)
+            return False
+        self._set_index(index, nb_sizes)
+        return True
+
+    def _set_index(self, index, nb_sizes):
+        self._sizes = index[2:2 + nb_sizes]
+        self._starts = index[2 + nb_sizes:3 + 2 * nb_sizes]
+        self._addresses = index[3 + 2 * nb_sizes:]
+        self._size_to_index = dict((size, i) for i, size in enumerate(self._sizes.tolist()))
+        return
 
     def cacheSizes(self):
-        """Find the number of different sizes, and creates that much numpyarray"""
-        # if not os.access
-        outdir = config.get_cache_filename(
-            config.CACHE_SIGNATURE_SIZES_DIR,
-            self._context.dumpname)
-        config.create_cache_folder(outdir)
-        #
-        sizes = map(int, set(self._context._malloc_sizes))
-        arrays = dict([(s, []) for s in sizes])
-        # sort all addr in all sizes..
-        [arrays[self._context._malloc_sizes[i]].append(
-            long(addr)) for i, addr in enumerate(self._context._malloc_addresses)]
-        # saving all sizes dictionary in files...
-        for size, lst in arrays.items():
-            fout = os.path.sep.join([outdir, 'size.%0.4x' % size])
-            arrays[size] = utils.int_array_save(fout, lst)
-        # saved all sizes dictionaries.
-        # tag it as done
-        open(
-            os.path.sep.join([outdir, config.CACHE_SIGNATURE_SIZES_DIR_TAG]), 'w')
-        self._sizes = arrays
+        """Sort the allocators by size, and save the index of each size"""
+        if self._loadCache():
+            return
+        config.create_cache_folder(self._context.dumpname)
+        addresses = numpy.asarray(self._context._structures_addresses, dtype=numpy.int64)
+        sizes = numpy.asarray(self._context._structures_sizes, dtype=numpy.int64)
+        # stable, so addresses stay sorted within a size
+        order = numpy.argsort(sizes, kind='mergesort')
+        sorted_sizes = sizes[order]
+        unique_sizes, starts = numpy.unique(sorted_sizes, return_index=True)
+        nb_sizes = len(unique_sizes)
+        index = numpy.concatenate([numpy.array([nb_sizes, len(addresses)], dtype=numpy.int64),
+                                   unique_sizes, starts, numpy.array([len(addresses)], dtype=numpy.int64),
+                                   addresses[order]]).astype(numpy.int64)
+        utils.int_array_save(self._get_filename(), index)
+        log.debug('Saved size index of %d allocators in %d sizes', len(addresses), nb_sizes)
+        self._set_index(index, nb_sizes)
         return
 
     def getStructuresOfSize(self, size):
         if self._sizes is None:
             self.cacheSizes()
-        if size not in self._sizes:
-            return []
-        return numpy.asarray(self._sizes[size])
+        i = self._size_to_index.get(size)
+        if i is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return self._addresses[self._starts[i]:self._starts[i + 1]]
+
+    def getSizes(self):
+        if self._sizes is None:
+            self.cacheSizes()
+        return self._sizes
 
     def __iter__(self):
         if self._sizes is None:
             self.cacheSizes()
-        for size in self._sizes.keys():
-            yield (size, numpy.asarray(self._sizes[size]))
+        for i, size in enumerate(self._sizes.tolist()):
+            yield (size, self._addresses[self._starts[i]:self._starts[i + 1]])
 
 
 class SignatureMaker(searchers.AbstractSearcher):
@@ -569,15 +757,12 @@ def buildStructureGroup(context, sizeCache, optsize=None):
         log.debug(
             '\t[-] Sort %d structs of size %d in groups' %
             (len(lst), size))
-        graph = networkx.Graph()
+        # add all structs. Should spawn isolated chains
+        indexes = dict((addr, i) for i, addr in enumerate(lst))
+        groups = disjointset.DisjointSet(len(lst))
         # add similarities as linked structs
-        graph.add_edges_from(sgm.getGroups())
-        # add all structs all nodes . Should spwan isolated graphs
-        graph.add_nodes_from(lst)
-        subgraphs = networkx.algorithms.components.connected.connected_component_subgraphs(
-            graph)
-        # print 'subgraphs', len(subgraphs)
-        chains = [g.nodes() for g in subgraphs]
+        groups.union_pairs((indexes[addr1], indexes[addr2]) for addr1, addr2 in sgm.getGroups())
+        chains = [[lst[i] for i in group] for group in groups.groups()]
         # TODO, do not forget this does only gives out structs with similarities.
         # lonely structs are not printed here...
         yield chains
@@ -603,7 +788,8 @@ def graphStructureGroups(context, chains, originAddr=None):
     # TODO change generic fn
     chains.sort()
     decoder = dsa.FieldReverser(context.memory_handler)
-    graph = networkx.DiGraph()
+    sources = []
+    targets = []
     for chain in chains:
         log.debug('\t[-] chain len:%d' % len(chain))
         if originAddr is not None:
@@ -614,20 +800,19 @@ def graphStructureGroups(context, chains, originAddr=None):
             ## record.decodeFields()  # can be long
             decoder.analyze_fields(record)
             print(context.get_record_for_address(addr).to_string())
-            targets = set()
             _record = context.get_record_for_address(addr)
             pointer_fields = [f for f in _record.get_fields() if f.is_pointer()]
             for f in pointer_fields:
                 addr_child = f.get_value_for_field(_record)
                 child = context.get_record_at_address(addr)
-                targets.add(('%x' % addr, '%x' % child.address))
-            graph.add_edges_from(targets)
+                sources.append(addr)
+                targets.append(child.address)
         print('#', '-' * 78)
-    networkx.readwrite.gexf.write_gexf(
-        graph,
+    graphwriter.write_gexf(
         config.get_cache_filename(
             config.CACHE_GRAPH,
-            context.dumpname))
+            context.dumpname),
+        [], sources, targets)
 
 
 
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Incremental reversing of a dump, from the results of a previous dump of the same process.
+
+The allocations of the new dump are matched with the allocations of the previous dump
+by address, size and content hash. The reversed records of unchanged allocations are
+copied from the previous records cache, with their record type and reverse level, and
+their record types are registered in the process context.
+A reused record with a pointer to a new or changed allocation is set back to the
+reverse level of dsa.TextFieldCorrection, as its pointer fields are out of date.
+The heuristics pipeline then only reverses the new and changed allocations, and the
+pointer fields of these records.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+
+import numpy
+
+from haystack.mappings import folder
+from haystack.reverse import config
+from haystack.reverse import context
+from haystack.reverse import diff
+from haystack.reverse import structure
+from haystack.reverse import utils
+from haystack.reverse.heuristics import dsa
+from haystack.reverse.heuristics import model
+
+log = logging.getLogger('incremental')
+
+
+def allocations_hashes(memory_handler, addresses, sizes):
+    """
+    Returns the int64 hash of the content of each allocation.
+
+    :param memory_handler: the memory handler of the allocations
+    :param addresses: sorted allocations addresses
+    :param sizes: allocations sizes
+    """
+    addresses = numpy.asarray(addresses, dtype=numpy.int64)
+    sizes = numpy.asarray(sizes, dtype=numpy.int64)
+    digests = []
+    mapping = content = None
+    for address, size in zip(addresses.tolist(), sizes.tolist()):
+        if mapping is None or not (mapping.start <= address and address + size <= mapping.end):
+            mapping = memory_handler.get_mapping_for_address(address)
+            content = diff.get_mapping_content(mapping)
+        offset = address - mapping.start
+        digests.append(hashlib.md5(content[offset:offset + size]).digest()[:8])
+    return numpy.frombuffer(b''.join(digests), dtype=numpy.int64).copy()
+
+
+def match_allocations(addresses, sizes, hashes, previous_addresses, previous_sizes, previous_hashes):
+    """
+    Matches allocations with the allocations of the previous dump.
+
+    :param previous_addresses: sorted allocations addresses in the previous dump
+    :return: two boolean arrays, True for the allocations with an allocation at the same address
+        in the previous dump, and True for the allocations with the same address, size and content hash.
+    """
+    addresses = numpy.asarray(addresses, dtype=numpy.int64)
+    previous_addresses = numpy.asarray(previous_addresses, dtype=numpy.int64)
+    if len(previous_addresses) == 0:
+        return numpy.zeros(len(addresses), dtype=bool), numpy.zeros(len(addresses), dtype=bool)
+    index = numpy.searchsorted(previous_addresses, addresses)
+    index[index == len(previous_addresses)] = 0
+    known = previous_addresses[index] == addresses
+    unchanged = known & (numpy.asarray(previous_sizes, dtype=numpy.int64)[index] == sizes)
+    unchanged &= numpy.asarray(previous_hashes, dtype=numpy.int64)[index] == hashes
+    return known, unchanged
+
+
+def _get_ranges_index(starts, sizes, values):
+    """Returns the index of the range containing each value, or -1. starts is sorted."""
+    values = numpy.asarray(values, dtype=numpy.int64)
+    index = numpy.searchsorted(starts, values, side='right') - 1
+    inside = index >= 0
+    inside[inside] = values[inside] < starts[index[inside]] + sizes[index[inside]]
+    index[~inside] = -1
+    return index
+
+
+def records_pointing_to(records_addresses, records_sizes, pointers_addresses, pointers_values,
+                        allocations_addresses, allocations_sizes):
+    """
+    Returns the records holding a pointer to one of the allocations.
+
+    :param records_addresses: sorted records addresses
+    :param records_sizes: records sizes
+    :param pointers_addresses: the addresses of the pointers
+    :param pointers_values: the values of the pointers
+    :param allocations_addresses: sorted allocations addresses
+    :param allocations_sizes: allocations sizes
+    :return: the sorted addresses of the records
+    """
+    records_addresses = numpy.asarray(records_addresses, dtype=numpy.int64)
+    records_sizes = numpy.asarray(records_sizes, dtype=numpy.int64)
+    allocations_addresses = numpy.asarray(allocations_addresses, dtype=numpy.int64)
+    allocations_sizes = numpy.asarray(allocations_sizes, dtype=numpy.int64)
+    if len(records_addresses) == 0 or len(allocations_addresses) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    records_index = _get_ranges_index(records_addresses, records_sizes, pointers_addresses)
+    pointing = records_index != -1
+    pointing &= _get_ranges_index(allocations_addresses, allocations_sizes, pointers_values) != -1
+    return numpy.unique(records_addresses[records_index[pointing]])
+
+
+def get_allocations_hashes(heap_context):
+    """Returns the content hashes of the allocations of a heap context, from cache if possible"""
+    fname = heap_context.get_filename_cache_allocations_hashes()
+    hashes = utils.int_array_cache(fname)
+    if hashes is None or len(hashes) != len(heap_context._structures_addresses):
+        hashes = allocations_hashes(heap_context.memory_handler,
+                                    heap_context._structures_addresses,
+                                    heap_context._structures_sizes)
+        hashes = utils.int_array_save(fname, hashes)
+    return hashes
+
+
+class IncrementalReverser(model.AbstractReverser):
+    """
+    Reuses the reversed records of a previous dump of the same process,
+    for the allocations that did not change.
+
+    :param previous_dumpname: the previous dump, already reversed
+    """
+
+    def __init__(self, _memory_handler, previous_dumpname):
+        super(IncrementalReverser, self).__init__(_memory_handler)
+        self._previous_dumpname = os.path.abspath(previous_dumpname)
+        self._previous_memory_handler = None
+        self._nb_allocations = 0
+        self._nb_unchanged = 0
+        self._nb_new = 0
+        self._nb_reused = 0
+        self._nb_stale = 0
+        # addresses and sizes of the reused records, per heap
+        self._reused = {}
+        # addresses and sizes of the new and changed allocations
+        self._changed = []
+
+    def _get_previous_cache_filename(self, typ, heap_addr):
+        return config.get_cache_filename(typ, self._previous_dumpname, heap_addr)
+
+    def _get_previous_hashes(self, heap_addr, addresses, sizes):
+        fname = self._get_previous_cache_filename(config.CACHE_MALLOC_CHUNKS_HASHES, heap_addr)
+        hashes = utils.int_array_cache(fname)
+        if hashes is None or len(hashes) != len(addresses):
+            # the previous dump was reversed without the incremental mode
+            if self._previous_memory_handler is None:
+                log.info('[+] Loading previous dump %s', self._previous_dumpname)
+                self._previous_memory_handler = folder.load(self._previous_dumpname)
+            hashes = allocations_hashes(self._previous_memory_handler, addresses, sizes)
+            hashes = utils.int_array_save(fname, hashes)
+        return hashes
+
+    def reverse_context(self, _context):
+        heap_addr = _context._heap_start
+        addresses = numpy.asarray(_context._structures_addresses, dtype=numpy.int64)
+        sizes = numpy.asarray(_context._structures_sizes, dtype=numpy.int64)
+        self._nb_allocations += len(addresses)
+        # saved for the next incremental run
+        hashes = get_allocations_hashes(_context)
+        previous_addresses = utils.int_array_cache(
+            self._get_previous_cache_filename(config.CACHE_MALLOC_CHUNKS_ADDRS, heap_addr))
+        previous_sizes = utils.int_array_cache(
+            self._get_previous_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, heap_addr))
+        if previous_addresses is None or previous_sizes is None:
+            log.info('[+] Heap 0x%x was not reversed in %s', heap_addr, self._previous_dumpname)
+            self._nb_new += len(addresses)
+            self._changed.append((addresses, sizes))
+            return
+        previous_hashes = self._get_previous_hashes(heap_addr, previous_addresses, previous_sizes)
+        known, unchanged = match_allocations(addresses, sizes, hashes,
+                                             previous_addresses, previous_sizes, previous_hashes)
+        self._nb_unchanged += int(unchanged.sum())
+        self._nb_new += len(addresses) - int(known.sum())
+        self._changed.append((addresses[~unchanged], sizes[~unchanged]))
+        # copy the records cache files of unchanged allocations
+        previous_folder = config.get_record_cache_folder_name(self._previous_dumpname)
+        reused = numpy.zeros(len(addresses), dtype=bool)
+        for i in numpy.flatnonzero(unchanged).tolist():
+            address = int(addresses[i])
+            fname = structure.make_filename_from_addr(_context, address)
+            if os.access(fname, os.F_OK):
+                # already reversed in this dump
+                continue
+            previous_fname = os.path.sep.join([previous_folder, os.path.basename(fname)])
+            if not os.access(previous_fname, os.F_OK):
+                continue
+            shutil.copyfile(previous_fname, fname)
+            reused[i] = True
+        nb_reused = int(reused.sum())
+        self._nb_reused += nb_reused
+        self._reused[heap_addr] = (addresses[reused], sizes[reused])
+        # records will be reloaded from cache
+        _context._structures = None
+        self._register_record_types(_context, addresses[reused])
+        log.info('[+] Heap 0x%x: %d/%d allocations unchanged, %d records reused',
+                 heap_addr, int(unchanged.sum()), len(addresses), nb_reused)
+        return
+
+    def _register_record_types(self, _context, addresses):
+        """Register the record types of the reused records in the process context, like DoubleLinkedListReverser"""
+        process_context = self._memory_handler.get_reverse_context()
+        record_types = {}
+        for address in addresses.tolist():
+            _record = _context.get_record_for_address(address)
+            record_type = _record.record_type
+            if record_type.type_name == str(_record):
+                # the default type of the record
+                continue
+            if record_type.type_name not in record_types:
+                members = []
+                process_context.add_reversed_type(record_type, members)
+                record_types[record_type.type_name] = members
+            record_types[record_type.type_name].append(address)
+        return
+
+    def reverse(self):
+        super(IncrementalReverser, self).reverse()
+        # pointees can be in any heap
+        self._reset_stale_records()
+        return
+
+    def _reset_stale_records(self):
+        """Set back the reverse level of the reused records pointing to new or changed allocations"""
+        if len(self._changed) == 0:
+            return
+        changed_addresses = numpy.concatenate([a for a, _ in self._changed])
+        changed_sizes = numpy.concatenate([s for _, s in self._changed])
+        order = numpy.argsort(changed_addresses)
+        changed_addresses, changed_sizes = changed_addresses[order], changed_sizes[order]
+        # the pointers are reversed again, from the fields of the record bytes
+        reverse_level = dsa.TextFieldCorrection.REVERSE_LEVEL
+        for heap_addr, (addresses, sizes) in self._reused.items():
+            _context = context.get_context_for_address(self._memory_handler, heap_addr)
+            stale = records_pointing_to(addresses, sizes, _context._pointers_offsets, _context._pointers_values,
+                                        changed_addresses, changed_sizes)
+            for address in stale.tolist():
+                _record = _context.get_record_for_address(address)
+                if _record.get_reverse_level() > reverse_level:
+                    _record.set_reverse_level(reverse_level)
+                    _record.saveme(_context)
+            self._nb_stale += len(stale)
+            _context.save()
+            log.info('[+] Heap 0x%x: %d reused records point to new or changed allocations',
+                     heap_addr, len(stale))
+        return
+
+    def get_statistics(self):
+        """
+        Returns the work skipped by the incremental mode.
+
+        :return: dict with the number of allocations, unchanged, new and changed allocations,
+            of records reused from the previous dump, and of reused records to reverse again
+        """
+        nb_changed = self._nb_allocations - self._nb_unchanged - self._nb_new
+        res = {'allocations': self._nb_allocations,
+               'unchanged': self._nb_unchanged,
+               'new': self._nb_new,
+               'changed': nb_changed,
+               'reused': self._nb_reused,
+               'stale': self._nb_stale}
+        return res
@@ -19,6 +19,8 @@ import numbers
 import os
 from future.builtins import range
 
+import numpy
+
 from haystack.mappings import folder
 from haystack.reverse import config
 from haystack.reverse import utils
@@ -35,6 +37,10 @@ __status__ = "Production"
 
 log = logging.getLogger('pattern')
 
+# rolling hash constants, for windowHashes
+_HASH_BASE = numpy.uint64(0x100000001b3)
+_HASH_MIX = numpy.uint64(0xbf58476d1ce4e5b9)
+
 
 class Dummy(object):
     pass
@@ -93,6 +99,29 @@ def findPattern(sequence, elSize=1, minNbGroup=2):
     elif sequence == '':
         return []
 
+    if elSize == 1 and minNbGroup >= 2:
+        best = _findBestRepeatRuns(sequence, minNbGroup)
+    else:
+        best = _findBestRepeat(sequence, elSize, minNbGroup)
+    if best is None:
+        return [(1, sequence)]
+    nb, value = best
+
+    i = sequence.find(value * nb)
+    left = sequence[:i]
+    right = sequence[i + len(value) * nb:]
+    log.debug('left %d:%s' % (len(left), left))
+    log.debug('right %d:%s' % (len(right), right))
+    ret = findPattern(left, elSize, minNbGroup)
+    ret2 = findPattern(right, elSize, minNbGroup)
+    return ret + [(nb, value)] + ret2
+
+
+def _findBestRepeat(sequence, elSize, minNbGroup):
+    """
+    Returns the best repeated pattern (nb, value), or None.
+    Counts all substrings of all lengths, roughly cubic.
+    """
     patterns = []
     for seqlen in range(elSize, 1 + (len(sequence) // 2)):
         seqs = [
@@ -123,7 +152,7 @@ def findPattern(sequence, elSize=1, minNbGroup=2):
                 nb -= 1  # try with a smaller number of repetition
     #
     if len(patterns) == 0:
-        return [(1, sequence)]
+        return None
 
     patterns = sorted(set(patterns))
     best = patterns[-1]  # higher wins
@@ -133,15 +162,58 @@ def findPattern(sequence, elSize=1, minNbGroup=2):
     # for p in patterns:
     #  sequence2 = sequence.replace( p[3]*p[2], ' (%s){%d} '%(p[3],p[2]) )
     #  print p, sequence2
+    return best[2], best[3]
+
+
+def _sequenceCodes(sequence):
+    """Returns a numpy array of the elements codes of a str or bytes sequence"""
+    if isinstance(sequence, bytes):
+        return numpy.frombuffer(sequence, dtype=numpy.uint8)
+    return numpy.frombuffer(sequence.encode('utf-32-le'), dtype=numpy.uint32)
 
-    i = sequence.find(best[3] * best[2])
-    left = sequence[:i]
-    right = sequence[i + best[0]:]
-    log.debug('left %d:%s' % (len(left), left))
-    log.debug('right %d:%s' % (len(right), right))
-    ret = findPattern(left, elSize, minNbGroup)
-    ret2 = findPattern(right, elSize, minNbGroup)
-    return ret + [(best[2], best[3])] + ret2
+
+def _findBestRepeatRuns(sequence, minNbGroup):
+    """
+    Returns the same best repeated pattern as _findBestRepeat, for elSize == 1.
+
+    For each period p, the positions where sequence[i] == sequence[i+p] form runs.
+    A run of length r starting at j makes sequence[j:j+r+p] periodic, so it holds
+    (r // p + 1) repetitions of a pattern of length p.
+    The best pattern covers the longest text, then starts at the highest offset,
+    then has the highest number of repetitions. That is a linear pass per period,
+    instead of counting all substrings.
+    """
+    codes = _sequenceCodes(sequence)
+    best_len = 0
+    periods = []
+    for p in range(1, 1 + (len(codes) // 2)):
+        eq = numpy.concatenate(([0], (codes[:-p] == codes[p:]).view(numpy.int8), [0]))
+        delta = numpy.diff(eq)
+        starts = numpy.flatnonzero(delta == 1)
+        if len(starts) == 0:
+            continue
+        lengths = numpy.flatnonzero(delta == -1) - starts
+        nbs = lengths // p + 1
+        ok = nbs >= minNbGroup
+        if not ok.any():
+            continue
+        best_len = max(best_len, int(nbs[ok].max()) * p)
+        periods.append((p, starts[ok], lengths[ok]))
+    if best_len == 0:
+        return None
+    # highest offset of a pattern covering best_len, then shortest period
+    best_ind = -1
+    best_p = 0
+    for p, starts, lengths in periods:
+        if best_len % p != 0 or best_len // p < minNbGroup:
+            continue
+        valid = lengths + p >= best_len
+        if not valid.any():
+            continue
+        ind = int((starts[valid] + lengths[valid]).max()) + p - best_len
+        if ind > best_ind:
+            best_ind, best_p = ind, p
+    return best_len // best_p, sequence[best_ind:best_ind + best_p]
 
 
 class PatternEncoder:
@@ -402,6 +474,47 @@ class SequencesMaker:
         return
 
 
+def windowHashes(sequence, size):
+    """
+    Returns the rolling hashes of all windows of <size> intervals in the sequence.
+    hashes[i] is the hash of sequence[i:i+size], as a uint64 array.
+    Same windows have the same hash. Different windows collide with a 2**-64 probability.
+
+    That replaces SequencesMaker tuples sets for large signatures.
+    """
+    values = numpy.asarray(sequence, dtype=numpy.int64).view(numpy.uint64)
+    nb = len(values) - size + 1
+    if nb <= 0:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    # mix the values, so that close intervals values do not make close hashes
+    with numpy.errstate(over='ignore'):
+        mixed = (values ^ (values >> numpy.uint64(31))) * _HASH_MIX
+        mixed ^= mixed >> numpy.uint64(29)
+        hashes = numpy.zeros(nb, dtype=numpy.uint64)
+        for i in range(size):
+            hashes *= _HASH_BASE
+            hashes += mixed[i:i + nb]
+    return hashes
+
+
+def _sortedUnique(values):
+    """Sorted unique values, with a plain sort"""
+    values = numpy.sort(values)
+    if len(values) < 2:
+        return values
+    keep = numpy.ones(len(values), dtype=bool)
+    keep[1:] = values[1:] != values[:-1]
+    return values[keep]
+
+
+def _sortedContains(sorted_values, values):
+    """Returns a boolean array, True for each value in sorted_values"""
+    if len(sorted_values) == 0:
+        return numpy.zeros(len(values), dtype=bool)
+    ind = numpy.minimum(numpy.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[ind] == values
+
+
 class PinnedPointers:
 
     '''
@@ -642,84 +755,67 @@ class PinnedPointersMapper:
         return
 
     def _findCommonSequences(self):
+        """
+        Returns the sorted array of hashes of the sequences of <length> intervals
+        found in all signatures.
+        """
         log.info('Looking for common sequence of length %d' % self.length)
         common = None
-        # make len(sig) sub sequences of size <length> ( in .sets )
+        # hash all sub sequences of size <length>
         for sig in self.signatures:
-            self.signatures_sequences[sig] = SequencesMaker(
-                sig.sig,
-                self.length,
-                False)
+            self.signatures_sequences[sig] = windowHashes(sig.sig, self.length)
             if common is None:
-                common = set(self.signatures_sequences[sig].sets[self.length])
+                common = _sortedUnique(self.signatures_sequences[sig])
             else:
-                common &= self.signatures_sequences[sig].sets[self.length]
+                common = common[_sortedContains(numpy.sort(self.signatures_sequences[sig]), common)]
         log.info(
             'Common sequence of length %d: %d seqs' %
             (self.length, len(common)))
         return common
 
     def _mapToSignature(self, sig):
-        # LOL. difflib.SequenceMatcher.
-
         # maintenant il faut mapper le common set sur l'array original,
-        # a) on peut iter(sig) jusqu'a trouver une sequence non common.
-        # b) reduce previous slices to 1 bigger sequence.
         # On peut aggreger les offsets, tant que la sequence start:start+<length> est dans common.
         # on recupere un 'petit' nombre de sequence assez larges, censees etre
         # communes.
+        # A run of common sequences [start, stop) makes one aggregated sequence,
+        # covering the intervals [start:stop+length-1].
+        # The sequence at stop is not common. But there CAN be another common slice
+        # starting between stop and stop+length.
+        # (1,2,3,4) is common , (1,2,3,4,6) is NOT common because of the 1, (2,3,4,6) is common.
+        # so Yes, we can have recovering Sequences
+        # A run of common sequences up to the end of the signature is not saved.
         sig_aggregated_seqs = []
         sig_uncommon_slice_offset = []
-        start = 0
-        stop = 0
-        i = 0
         length = self.length
-        seqs_sig1 = self.signatures_sequences[sig]
+        hashes = self.signatures_sequences[sig]
         common = self.common
-        # all subsequences, offset by offset
-        enum_seqs_sig = enumerate(seqs_sig1)
-        try:
-            while i < len(seqs_sig1):  # we wont have a StopIteration...
-                for i, subseq in enum_seqs_sig:
-                    if subseq in common:
-                        start = i
-                        #log.debug('Saving a Uncommon slice %d-%d'%(stop,start))
-                        sig_uncommon_slice_offset.append((stop, start))
-                        break
-                    del subseq
-                # enum is on first valid sequence of <length> intervals
-                #log.debug('Found next valid sequence at interval offset %d/%d/%d'%(i,len(sig.sig), len(seqs_sig1) ))
-                for i, subseq in enum_seqs_sig:
-                    if subseq in common:
-                        del subseq
-                        continue
-                    # the last interval in the tuple of <length> intervals is
-                    # not common
-                    else:
-                        # so we need to aggregate from [start:stop+length]
-                        # there CAN be another common slice starting between stop and stop+length.
-                        # (1,2,3,4) is common , (1,2,3,4,6) is NOT common because of the 1, (2,3,4,6) is common.
-                        # next valid slice is at start+1
-                        # so Yes, we can have recovering Sequences
-                        stop = i  # end aggregation slice
-                        seqStop = stop + length - 1
-                        # we should also pin it in sig2, sig3, and relate to
-                        # that...
-                        pp = savePinned(
-                            self.cacheValues2,
-                            sig,
-                            start,
-                            seqStop -
-                            start,
-                            self.word_size)
-                        sig_aggregated_seqs.append(pp)  # save a big sequence
-                        #log.debug('Saving an aggregated sequence %d-%d'%(start, stop))
-                        del subseq
-                        break  # goto search next common
-                # find next valid interval
-            # wait for end of enum
-        except StopIteration as e:
-            pass
+        if len(hashes) < 2:
+            is_common = numpy.zeros(0, dtype=bool)
+        else:
+            is_common = _sortedContains(common, hashes)
+        delta = numpy.diff(numpy.concatenate(([0], is_common.view(numpy.int8), [0])))
+        starts = numpy.flatnonzero(delta == 1).tolist()
+        stops = numpy.flatnonzero(delta == -1).tolist()
+        stop = 0
+        for start, next_stop in zip(starts, stops):
+            #log.debug('Saving a Uncommon slice %d-%d'%(stop,start))
+            sig_uncommon_slice_offset.append((stop, start))
+            stop = next_stop
+            if stop == len(hashes):
+                break
+            seqStop = stop + length - 1
+            # we should also pin it in sig2, sig3, and relate to
+            # that...
+            pp = savePinned(
+                self.cacheValues2,
+                sig,
+                start,
+                seqStop -
+                start,
+                self.word_size)
+            sig_aggregated_seqs.append(pp)  # save a big sequence
+            #log.debug('Saving an aggregated sequence %d-%d'%(start, stop))
         # done
         # log.debug('%s'%sig1_uncommon_slice_offset)
         log.info(
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Queries on the records of an already reversed dump, from its cache files only.
+
+No ProcessContext or HeapContext is made, and the heaps are not searched.
+A query reads:
+    - the memory-mapped allocations addresses and sizes of each heap
+    - the pickle of the queried records
+    - the memory-mapped predecessors index, for predecessors
+    - the single memory mapping hosting the record, for its bytes
+
+A folder dump is loaded with load_folder_dump, which does not index the
+memory pages of all mappings.
+"""
+
+import bisect
+import logging
+import os
+import pickle
+
+import numpy
+
+from haystack import target
+from haystack.mappings import base
+from haystack.mappings import file
+from haystack.mappings import folder
+from haystack.reverse import config
+from haystack.reverse import graphindex
+from haystack.reverse import growth
+from haystack.reverse import structure
+from haystack.reverse import utils
+
+log = logging.getLogger('query')
+
+# record address of an address out of any record
+NO_RECORD = -1
+
+
+def _as_uint64(addresses):
+    """Returns the addresses as an uint64 array. Addresses out of 64 bits are 0, out of any record."""
+    try:
+        return numpy.asarray(addresses, dtype=numpy.uint64)
+    except OverflowError:
+        return numpy.array([address if 0 <= address < 2**64 else 0 for address in addresses], dtype=numpy.uint64)
+
+
+def _as_uint64_array(array):
+    """Returns an int64 array as uint64, without copy"""
+    if array.dtype == numpy.int64:
+        return array.view(numpy.uint64)
+    return array.astype(numpy.uint64)
+
+
+class FolderDumpMemoryHandler(base.MemoryHandler):
+    """
+    The memory handler of a folder dump, finding the mapping of an address
+    with a binary search on the sorted mappings. base.MemoryHandler indexes
+    every memory page of the dump when it is made, which takes longer than
+    a query on a multi-GB dump.
+    """
+
+    # replaces the pages index made by base.MemoryHandler.__init__
+    def _MemoryHandler__optim_get_mapping_for_address(self):
+        self._mappings_starts = [m.start for m in self._mappings]
+        return
+
+    def get_mapping_for_address(self, vaddr):
+        i = bisect.bisect_right(self._mappings_starts, vaddr) - 1
+        if i >= 0 and vaddr < self._mappings[i].end:
+            return self._mappings[i]
+        return False
+
+
+def load_folder_dump(dumpname, bits=None, os_name=None):
+    """
+    Returns the FolderDumpMemoryHandler of a folder dump, like the
+    folder.VeryLazyProcessMemoryDumpLoader. The mappings files are opened on first read.
+    """
+    loader = folder.ProcessMemoryDumpLoader(dumpname, bits=bits, os_name=os_name)
+    loader._load_metadata()
+    mappings = []
+    for mmap_fname, start, end, permissions, offset, major_device, minor_device, inode, pathname in loader.metalines:
+        fname = os.path.sep.join([loader.dumpname, mmap_fname])
+        mappings.append(file.FilenameBackedMemoryMapping(fname, start, end, permissions, offset, major_device,
+                                                         minor_device, inode, pathname=pathname))
+    _target = target.TargetPlatform(mappings, cpu_bits=bits, os_name=os_name)
+    memory_handler = FolderDumpMemoryHandler(mappings, _target, loader.dumpname)
+    memory_handler.reset_mappings()
+    return memory_handler
+
+
+class RecordQuery(object):
+    """
+    Read-only access to the cached records of a reversed dump.
+
+    :param memory_handler: the memory handler of the reversed dump. Its mappings are only
+        read for the bytes of a record.
+    :raises IOError: if the dump was not reversed
+    """
+
+    def __init__(self, memory_handler):
+        self._memory_handler = memory_handler
+        self.dumpname = memory_handler.get_name()
+        try:
+            self._heaps = growth.list_heaps(self.dumpname)
+        except OSError as e:
+            raise IOError('%s was not reversed: %s' % (self.dumpname, e))
+        if len(self._heaps) == 0:
+            raise IOError('%s was not reversed' % self.dumpname)
+        self._allocations = {}
+        self._predecessors_index = None
+
+    def _get_allocations(self, heap_addr):
+        if heap_addr not in self._allocations:
+            addresses = utils.int_array_cache(
+                config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_ADDRS, self.dumpname, heap_addr), mmap_mode='r')
+            sizes = utils.int_array_cache(
+                config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, self.dumpname, heap_addr), mmap_mode='r')
+            if addresses is None or sizes is None:
+                raise IOError('No allocations cache for heap 0x%x' % heap_addr)
+            # compared unsigned, like the queried addresses
+            self._allocations[heap_addr] = (_as_uint64_array(addresses), _as_uint64_array(sizes))
+        return self._allocations[heap_addr]
+
+    def get_records_addresses_at_addresses(self, addresses):
+        """
+        Returns the address and size of the allocated record containing each address,
+        NO_RECORD and 0 for addresses out of any record.
+
+        :param addresses: list or numpy array of addresses, of up to 64 bits
+        :return: two int64 arrays
+        """
+        addresses = _as_uint64(addresses)
+        res_addresses = numpy.full(len(addresses), NO_RECORD, dtype=numpy.int64)
+        res_sizes = numpy.zeros(len(addresses), dtype=numpy.int64)
+        # allocations of a heap are after the heap address
+        for heap_addr in self._heaps:
+            todo = numpy.flatnonzero((res_addresses == NO_RECORD) & (addresses >= heap_addr))
+            if len(todo) == 0:
+                continue
+            allocations, sizes = self._get_allocations(heap_addr)
+            if len(allocations) == 0:
+                continue
+            index = numpy.searchsorted(allocations, addresses[todo], side='right') - 1
+            inside = index >= 0
+            inside[inside] = addresses[todo][inside] < allocations[index[inside]] + sizes[index[inside]]
+            res_addresses[todo[inside]] = allocations[index[inside]]
+            res_sizes[todo[inside]] = sizes[index[inside]]
+        return res_addresses, res_sizes
+
+    def get_record_address_at_address(self, address):
+        """
+        Returns the address and size of the allocated record containing this address.
+
+        :raises ValueError: if no record contains this address
+        """
+        record_addresses, sizes = self.get_records_addresses_at_addresses([address])
+        if record_addresses[0] == NO_RECORD:
+            raise ValueError('No record at address 0x%x' % address)
+        return int(record_addresses[0]), int(sizes[0])
+
+    def get_heap_address_for_record(self, record_address):
+        """
+        Returns the address of the heap allocating the record at this address.
+
+        :raises ValueError: if no heap allocated a record at this address
+        """
+        for heap_addr in self._heaps:
+            if record_address < heap_addr:
+                continue
+            allocations, _ = self._get_allocations(heap_addr)
+            i = int(numpy.searchsorted(allocations, record_address))
+            if i < len(allocations) and allocations[i] == record_address:
+                return heap_addr
+        raise ValueError('No record at address 0x%x' % record_address)
+
+    def get_record_bytes(self, address):
+        """Returns the bytes of the record containing this address"""
+        record_address, size = self.get_record_address_at_address(address)
+        mapping = self._memory_handler.get_mapping_for_address(record_address)
+        return mapping.read_bytes(record_address, size)
+
+    def iter_records_bytes(self, addresses):
+        """
+        Yields the address of the record containing each address and its bytes,
+        or NO_RECORD and None, in the order of addresses.
+        """
+        record_addresses, sizes = self.get_records_addresses_at_addresses(addresses)
+        mapping = None
+        for record_address, size in zip(record_addresses.tolist(), sizes.tolist()):
+            if record_address == NO_RECORD:
+                yield NO_RECORD, None
+                continue
+            if mapping is None or not (mapping.start <= record_address < mapping.end):
+                mapping = self._memory_handler.get_mapping_for_address(record_address)
+            yield record_address, mapping.read_bytes(record_address, size)
+        return
+
+    def get_record(self, record_address):
+        """
+        Returns the cached structure.AnonymousRecord at this address.
+
+        :raises IOError: if the record is not in the records cache
+        """
+        fname = os.path.sep.join([config.get_record_cache_folder_name(self.dumpname), 'struct_%x' % record_address])
+        try:
+            with open(fname, 'rb') as fin:
+                _record = pickle.load(fin)
+        except (EOFError, ValueError) as e:
+            raise IOError('Could not load %s: %s' % (fname, e))
+        if not isinstance(_record, structure.AnonymousRecord):
+            raise IOError('not a AnonymousRecord in cache. %s' % fname)
+        _record.set_memory_handler(self._memory_handler)
+        _record._dirty = False
+        return _record
+
+    def get_record_at_address(self, address):
+        """Returns the cached record containing this address"""
+        record_address, size = self.get_record_address_at_address(address)
+        return self.get_record(record_address)
+
+    def get_predecessors(self, _record):
+        """
+        Returns the cached records pointing to this record.
+
+        :raises IOError: if there is no predecessors index
+        """
+        if self._predecessors_index is None:
+            self._predecessors_index = graphindex.PredecessorIndex(self.dumpname)
+        addresses = self._predecessors_index.get_predecessors(_record.address)
+        return [self.get_record(int(address)) for address in addresses]
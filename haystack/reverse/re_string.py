@@ -7,8 +7,11 @@
 import encodings
 import logging
 import numbers
+import re
 import string
 
+import numpy
+
 """
 This module holds some basic utils function.
 """
@@ -54,15 +57,15 @@ _py_encodings = set(encodings.aliases.aliases.values())
 #  except IOError: # TODO delete bz2 and gzip
 #  except TypeError: # TODO delete hex_codec
 #  except ValueError: # TODO delete uu_encode
-_py_encodings.remove('mbcs')
-_py_encodings.remove('hex_codec')
-_py_encodings.remove('uu_codec')
-_py_encodings.remove('bz2_codec')
-_py_encodings.remove('zlib_codec')
-_py_encodings.remove('base64_codec')
-_py_encodings.remove('tactis')
-_py_encodings.remove('rot_13')
-_py_encodings.remove('quopri_codec')
+_py_encodings.discard('mbcs')
+_py_encodings.discard('hex_codec')
+_py_encodings.discard('uu_codec')
+_py_encodings.discard('bz2_codec')
+_py_encodings.discard('zlib_codec')
+_py_encodings.discard('base64_codec')
+_py_encodings.discard('tactis')
+_py_encodings.discard('rot_13')
+_py_encodings.discard('quopri_codec')
 
 # perf test, string.printable is limited to ascii anyway
 # ...
@@ -79,6 +82,95 @@ _py_encodings = set(['ascii',
                      ])
 
 
+# byte classes of the encodings pre-classifier
+_BYTE_NUL, _BYTE_PRINTABLE, _BYTE_CONTROL, _BYTE_HIGH, _BYTE_INVALID_UTF8 = range(5)
+_BYTE_CLASSES = numpy.full(256, _BYTE_CONTROL, dtype=numpy.int64)
+_BYTE_CLASSES[0] = _BYTE_NUL
+_BYTE_CLASSES[[ord(c) for c in string.printable if c not in '\x0b\x0c']] = _BYTE_PRINTABLE
+_BYTE_CLASSES[0x80:] = _BYTE_HIGH
+_BYTE_CLASSES[[0xc0, 0xc1]] = _BYTE_INVALID_UTF8
+_BYTE_CLASSES[0xf5:] = _BYTE_INVALID_UTF8
+
+
+# bytes that never appear in utf-8
+_INVALID_UTF8 = re.compile(b'[\\xc0\\xc1\\xf5-\\xff]')
+_HIGH = re.compile(b'[\\x80-\\xff]')
+
+
+def _is_plausible_wide(bytesarray, width):
+    """
+    Returns False if bytesarray can not decode to a string in a wide encoding of width bytes.
+    A printable character has all its bytes but the first one at zero.
+    """
+    if len(bytesarray) == 0 or len(bytesarray) % width != 0:
+        return False
+    if bytesarray[1:width] == b'\x00' * (width - 1):
+        return True
+    # testEncoding cuts the string after the first 'width' consecutive NUL characters
+    terminator = b'\x00' * (width * width)
+    end = bytesarray.find(terminator)
+    while end != -1 and end % width != 0:
+        end = bytesarray.find(terminator, end + 1)
+    nb_chars = len(bytesarray) // width if end == -1 else end // width + 1
+    # at most that many characters have zero high bytes
+    nb_zero_high = bytesarray[1:nb_chars * width:width].count(b'\x00')
+    # half of the characters at least should be printable.
+    # surrogate pairs make two non printable code units count as one character.
+    return 2 * nb_zero_high >= nb_chars - nb_zero_high
+
+
+def _guess(bytesarray, has_high, has_invalid_utf8):
+    res = []
+    if not has_high:
+        # all single byte encodings decode to the same string
+        res.append('utf_8')
+    else:
+        if not has_invalid_utf8:
+            res.append('utf_8')
+        # latin_1 and iso8859_15 only differ on non printable characters
+        res.append('latin_1')
+    if _is_plausible_wide(bytesarray, 2):
+        res.append('utf_16le')
+    if _is_plausible_wide(bytesarray, 4):
+        res.append('utf_32le')
+    return res
+
+
+def guess_encodings(bytesarray):
+    """
+    Returns the plausible encodings of a byte array, without decoding it.
+    testAllEncodings only tries these encodings.
+    The other encodings of _py_encodings can not make a better string.
+
+    :param bytesarray: bytes
+    :return: list of encodings
+    """
+    has_high = _HIGH.search(bytesarray) is not None
+    has_invalid_utf8 = has_high and _INVALID_UTF8.search(bytesarray) is not None
+    return _guess(bytesarray, has_high, has_invalid_utf8)
+
+
+def guess_encodings_batch(bytesarrays):
+    """
+    Returns the plausible encodings of many byte arrays.
+    The byte classes histogram is counted for all arrays at once.
+
+    :param bytesarrays: list of bytes
+    :return: list of lists of encodings
+    """
+    if len(bytesarrays) == 0:
+        return []
+    lengths = numpy.array([len(b) for b in bytesarrays], dtype=numpy.int64)
+    classes = _BYTE_CLASSES[numpy.frombuffer(b''.join(bytesarrays), dtype=numpy.uint8)]
+    # one row per array, one column per byte class
+    owners = numpy.repeat(numpy.arange(len(bytesarrays)), lengths)
+    counts = numpy.bincount(owners * 5 + classes, minlength=5 * len(bytesarrays)).reshape(-1, 5)
+    has_invalid_utf8 = counts[:, _BYTE_INVALID_UTF8] > 0
+    has_high = has_invalid_utf8 | (counts[:, _BYTE_HIGH] > 0)
+    return [_guess(b, high, invalid) for b, high, invalid in zip(bytesarrays, has_high.tolist(),
+                                                                  has_invalid_utf8.tolist())]
+
+
 def _py3_byte_compat(c):
     if isinstance(c, numbers.Number):
         assert(0 <= c < 256)
@@ -203,9 +295,11 @@ def find_ascii(bytes, offset, size):
     return -1, -1
 
 
-def try_decode_string(bytesarray, longerThan=3):
+def try_decode_string(bytesarray, longerThan=3, codecs=None):
     ''' try to read string. Null terminated or not
     TODO , maybe check for \x00 in index 0 for utf16 and utf32.
+
+    :param codecs: the encodings to try on a NULL terminated bytesarray, see guess_encodings
     '''
     if len(bytesarray) <= longerThan:
         return False
@@ -220,7 +314,7 @@ def try_decode_string(bytesarray, longerThan=3):
         readable = bytesarray[:i + 1]
         ustrings = testAllEncodings(bytesarray[:i + 1])
     else:
-        ustrings = testAllEncodings(bytesarray)
+        ustrings = testAllEncodings(bytesarray, codecs)
     # all cases
     ustrings = [(l, enc, ustr) for l, enc, ustr in ustrings if l > longerThan]
     if len(ustrings) == 0:
@@ -229,7 +323,7 @@ def try_decode_string(bytesarray, longerThan=3):
         valid_strings = []
         i = 0
         for size, codec, chars in ustrings:
-            log.debug('%s %s' % (codec, repr(chars)))
+            log.debug('%s %r', codec, chars)
             skip = False
             first = None
             # check not printable chars ( us ascii... )
@@ -251,9 +345,9 @@ def try_decode_string(bytesarray, longerThan=3):
                     # else: valid string, but shorter, non null terminated
                     # FIXME this is BUGGY, utf-16 can also considers single
                     # bytes.
-                    sizemultiplier = len(b'\x20'.encode(codec))
+                    sizemultiplier = len('\x20'.encode(codec))
                     slen = sizemultiplier * i
-                    log.debug('shorten at %d - %s' % (slen, chars[:i]))
+                    log.debug('shorten at %d - %s', slen, chars[:i])
                     valid_strings.append((slen, codec, chars[:i]))
                     break
             if skip:
@@ -266,7 +360,7 @@ def try_decode_string(bytesarray, longerThan=3):
                         (codec, repr(
                             bytesarray[1])))
                     continue
-            log.debug('valid entry %s' % chars)
+            log.debug('valid entry %s', chars)
             valid_strings.append((size, codec, chars))
         if len(valid_strings) > 0:
             valid_strings.sort(reverse=True)
@@ -274,7 +368,23 @@ def try_decode_string(bytesarray, longerThan=3):
         return False
 
 
-def startsWithNulTerminatedString(bytesarray, longerThan=3):
+def try_decode_strings(bytesarrays, longerThan=3):
+    '''
+    try_decode_string on many byte arrays, with a batch encodings classification.
+
+    :return: list of try_decode_string results
+    '''
+    guesses = guess_encodings_batch(bytesarrays)
+    res = []
+    for bytesarray, codecs in zip(bytesarrays, guesses):
+        if bytesarray.find(b'\x00') == -1:
+            # try_decode_string decodes a shorter array
+            codecs = None
+        res.append(try_decode_string(bytesarray, longerThan, codecs))
+    return res
+
+
+def startsWithNulTerminatedString(bytesarray, longerThan=3, codecs=None):
     ''' if there is no \x00 termination, its not a string
     that means that if we have a bad pointer in the middle of a string,
     the first part will not be understood as a string'''
@@ -282,7 +392,7 @@ def startsWithNulTerminatedString(bytesarray, longerThan=3):
     if i == -1:
         return False
     else:
-        ustrings = testAllEncodings(bytesarray)
+        ustrings = testAllEncodings(bytesarray, codecs)
         ustrings = [(l, enc, ustr)
                     for l, enc, ustr in ustrings if l > longerThan]
         if len(ustrings) == 0:
@@ -299,7 +409,7 @@ def startsWithNulTerminatedString(bytesarray, longerThan=3):
                 size = ustring[0]
                 codec = ustring[1]
                 chars = ustring[2]
-                log.debug('%s %s' % (codec, repr(chars)))
+                log.debug('%s %r', codec, chars)
                 # check not printable
                 notPrintable = []
                 for i, c in enumerate(chars):
@@ -320,14 +430,23 @@ def startsWithNulTerminatedString(bytesarray, longerThan=3):
 # AnonymousStruct_48_182351808_1:
 
 
-def testAllEncodings(bytesarray):
+def testAllEncodings(bytesarray, codecs=None):
+    '''
+    Decode bytesarray with all plausible encodings.
+
+    :param codecs: the encodings to try, guess_encodings(bytesarray) by default.
+        Use _py_encodings to try all encodings.
+    :return: sorted list of (length, codec, string)
+    '''
+    if codecs is None:
+        codecs = guess_encodings(bytesarray)
     res = []
-    for codec in _py_encodings:
+    for codec in codecs:
         length, my_str = testEncoding(bytesarray, codec)
         if length != -1:
             res.append((length, codec, my_str))
     res.sort(reverse=True)
-    log.debug('%d valid decodes: \n%s' % (len(res), str(res)))
+    log.debug('%d valid decodes: \n%s', len(res), res)
     return res
 
 
@@ -352,9 +471,7 @@ def testEncoding(bytesarray, encoding):
     try:
         ustr = bytesarray.decode(encoding)
     except UnicodeDecodeError:
-        log.debug(
-            'UnicodeDecodeError: %s did not decode that len: %d' %
-            (encoding, len(bytesarray)))
+        log.debug('UnicodeDecodeError: %s did not decode that len: %d', encoding, len(bytesarray))
         # print repr(bytesarray)
         return -1, None
     except Exception as e:
@@ -362,7 +479,7 @@ def testEncoding(bytesarray, encoding):
         raise e
     i = ustr.find('\x00'*sizemultiplier)
     if i == -1:
-        log.debug('%s was ok - but no NULL' % encoding)
+        log.debug('%s was ok - but no NULL', encoding)
         end = len(ustr)
         # return -1, None
     else:
@@ -370,5 +487,5 @@ def testEncoding(bytesarray, encoding):
         end = i + 1
 
     slen = sizemultiplier * end
-    log.debug('%s is ok - with len %d' % (encoding, slen))
+    log.debug('%s is ok - with len %d', encoding, slen)
     return slen, ustr[:end]
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Columnar metadata of the records of a heap.
+
+The record table has one row per allocation, aligned with the allocations
+addresses, and is saved next to the records cache:
+    - <heap>.records.table: int64 array of shape (7, n), with a row for the
+      address, the size, the reverse level, the layout id, the signature hash,
+      the type id and the dirty flag of each record
+    - <heap>.records.table.layouts: the signature text of each layout id, one per line
+    - <heap>.records.table.types: the type name of each type id, one per line
+
+A row is updated each time its record is saved to, or loaded from, the records
+cache. Rows of records that were neither saved nor loaded since the table was
+made are dirty: their values are unknown and the record has to be loaded to
+know them.
+"""
+
+import hashlib
+import logging
+
+import numpy
+
+from haystack.reverse import utils
+
+log = logging.getLogger('recordtable')
+
+ADDRESS, SIZE, REVERSE_LEVEL, LAYOUT_ID, SIGNATURE_HASH, TYPE_ID, DIRTY = range(7)
+NB_COLUMNS = 7
+
+# layout id or type id of an unknown layout, or of a record with its default name
+NO_ID = -1
+
+
+def signature_hash(signature_text):
+    """Returns the int64 hash of a record signature text, stable across heaps and dumps"""
+    digest = hashlib.md5(signature_text.encode('utf-8')).digest()[:8]
+    return int(numpy.frombuffer(digest, dtype=numpy.int64)[0])
+
+
+def _load_lines(filename):
+    with open(filename) as fin:
+        return [line.rstrip('\n') for line in fin]
+
+
+def _save_lines(filename, lines):
+    with open(filename, 'w') as fout:
+        fout.write(''.join('%s\n' % line for line in lines))
+
+
+class RecordTable(object):
+    """
+    The columnar metadata table of the records of a heap.
+
+    :param table: int64 array of shape (NB_COLUMNS, n), sorted by address
+    :param layouts: the signature texts of the layout ids
+    :param type_names: the type names of the type ids
+    """
+
+    def __init__(self, table, layouts, type_names):
+        self.table = table
+        self.layouts = layouts
+        self.type_names = type_names
+        self._layouts_index = dict((layout, i) for i, layout in enumerate(layouts))
+        self._types_index = dict((name, i) for i, name in enumerate(type_names))
+        self._modified = False
+
+    @classmethod
+    def make(cls, addresses, sizes):
+        """Make a table of dirty rows for these allocations"""
+        table = numpy.zeros((NB_COLUMNS, len(addresses)), dtype=numpy.int64)
+        table[ADDRESS] = addresses
+        table[SIZE] = sizes
+        table[LAYOUT_ID] = NO_ID
+        table[TYPE_ID] = NO_ID
+        table[DIRTY] = 1
+        res = cls(table, [], [])
+        res._modified = True
+        return res
+
+    @classmethod
+    def load(cls, heap_context):
+        """Load the record table of a heap context. Raises IOError if there is none."""
+        table = utils.int_array_cache(heap_context.get_filename_cache_record_table())
+        if table is None:
+            raise IOError('No record table for heap 0x%x' % heap_context._heap_start)
+        if table.shape[1] != len(heap_context._structures_addresses):
+            raise IOError('Stale record table for heap 0x%x' % heap_context._heap_start)
+        layouts = _load_lines(heap_context.get_filename_cache_record_table_layouts())
+        type_names = _load_lines(heap_context.get_filename_cache_record_table_types())
+        return cls(numpy.array(table), layouts, type_names)
+
+    def save(self, heap_context):
+        """Save the table, if it changed"""
+        if not self._modified:
+            return
+        _save_lines(heap_context.get_filename_cache_record_table_layouts(), self.layouts)
+        _save_lines(heap_context.get_filename_cache_record_table_types(), self.type_names)
+        utils.int_array_save(heap_context.get_filename_cache_record_table(), self.table)
+        self._modified = False
+        log.debug('Saved record table for heap 0x%x, %d dirty rows', heap_context._heap_start, self.get_dirty_count())
+        return
+
+    def __len__(self):
+        return self.table.shape[1]
+
+    def _get_index(self, address):
+        i = int(numpy.searchsorted(self.table[ADDRESS], address))
+        if i == len(self) or self.table[ADDRESS][i] != address:
+            return None
+        return i
+
+    def _get_layout_id(self, layout):
+        layout_id = self._layouts_index.get(layout)
+        if layout_id is None:
+            layout_id = self._layouts_index[layout] = len(self.layouts)
+            self.layouts.append(layout)
+        return layout_id
+
+    def _get_type_id(self, type_name):
+        type_id = self._types_index.get(type_name)
+        if type_id is None:
+            type_id = self._types_index[type_name] = len(self.type_names)
+            self.type_names.append(type_name)
+        return type_id
+
+    def update(self, _record):
+        """Update the row of a record, as it is in the records cache"""
+        i = self._get_index(_record.address)
+        if i is None:
+            log.debug('Record 0x%x is not an allocation', _record.address)
+            return
+        self._update_row(i, _record)
+        return
+
+    def update_loaded(self, _record):
+        """
+        Update the row of a record loaded from the records cache.
+        A clean row with the same size, reverse level and type is the row of
+        the saved record, its signature is not computed again.
+        """
+        i = self._get_index(_record.address)
+        if i is None:
+            return
+        row = self.table[:, i]
+        type_name = _record.record_type.type_name
+        if row[TYPE_ID] == NO_ID:
+            same_type = type_name == str(_record)
+        else:
+            same_type = type_name == self.type_names[row[TYPE_ID]]
+        if (row[DIRTY] == 0 and row[SIZE] == len(_record) and row[REVERSE_LEVEL] == _record.get_reverse_level()
+                and same_type):
+            return
+        self._update_row(i, _record)
+        return
+
+    def _update_row(self, i, _record):
+        signature = _record.get_signature_text()
+        type_name = _record.record_type.type_name
+        row = [len(_record), _record.get_reverse_level(), self._get_layout_id(signature), signature_hash(signature),
+               NO_ID if type_name == str(_record) else self._get_type_id(type_name), 0]
+        if self.table[SIZE:, i].tolist() == row:
+            return
+        self.table[SIZE:, i] = row
+        self._modified = True
+        return
+
+    def set_dirty(self, address):
+        """Flag the row of a record whose saved values are out of date, or whose pickle was removed"""
+        i = self._get_index(address)
+        if i is not None and self.table[DIRTY, i] == 0:
+            self.table[DIRTY, i] = 1
+            self._modified = True
+        return
+
+    def get_dirty_count(self):
+        return int(self.table[DIRTY].sum())
+
+    def select(self, max_reverse_level=None, sizes=None, type_id=None, layout_id=None, with_dirty=True):
+        """
+        Returns the sorted addresses of the records matching all criteria.
+        The values of dirty rows are unknown, they are selected if with_dirty is True.
+
+        :param max_reverse_level: records with a reverse level strictly lower
+        :param sizes: a size or a list of sizes
+        :param type_id: an id of type_names, or NO_ID
+        :param layout_id: an id of layouts
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        if max_reverse_level is not None:
+            mask &= self.table[REVERSE_LEVEL] < max_reverse_level
+        if sizes is not None:
+            mask &= numpy.isin(self.table[SIZE], sizes)
+        if type_id is not None:
+            mask &= self.table[TYPE_ID] == type_id
+        if layout_id is not None:
+            mask &= self.table[LAYOUT_ID] == layout_id
+        dirty = self.table[DIRTY] != 0
+        if with_dirty:
+            mask |= dirty
+        else:
+            mask &= ~dirty
+        return self.table[ADDRESS][mask]
+
+    def count_per_layout(self):
+        """Returns the layouts signature texts and the number of records with each layout"""
+        layout_ids = self.table[LAYOUT_ID][self.table[DIRTY] == 0]
+        counts = numpy.bincount(layout_ids[layout_ids != NO_ID], minlength=len(self.layouts))
+        return list(self.layouts), counts
+
+
+def get_record_table(heap_context):
+    """Returns the record table of a heap context, or a new table of dirty rows"""
+    try:
+        return RecordTable.load(heap_context)
+    except IOError as e:
+        log.debug('%s, making a new one', e)
+    return RecordTable.make(heap_context._structures_addresses, heap_context._structures_sizes)
+
+
+def update_dirty_rows(heap_context):
+    """
+    Load the records of the dirty rows of the record table of a heap context,
+    and save the table. Rows of records missing from the records cache stay dirty.
+    """
+    table = heap_context.get_record_table()
+    addresses = table.table[ADDRESS][table.table[DIRTY] != 0]
+    for address in addresses.tolist():
+        try:
+            _record = heap_context.get_record_for_address(address)
+        except KeyError as e:
+            log.debug('No record 0x%x in the records cache', address)
+            continue
+        table.update_loaded(_record)
+    table.save(heap_context)
+    log.debug('%d dirty rows left in heap 0x%x', table.get_dirty_count(), heap_context._heap_start)
+    return
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Bulk extraction of the strings of a heap.
+
+The heap content is scanned once with byte regexes for ASCII and UTF-16LE runs
+of printable characters. Hits are mapped to the allocated records containing
+them with a searchsorted join on the allocations addresses.
+
+The strings table of a heap is columnar:
+    - <heap>.strings.table: int64 array of shape (5, n), with a row for the
+      address, the record address (-1 out of any allocation), the length in bytes,
+      the encoding and the string id of each hit
+    - <heap>.strings.values: the deduplicated values, utf-8 encoded, one after the other
+    - <heap>.strings.values.offsets: the offsets of each value in the values file
+"""
+
+import logging
+import re
+
+import numpy
+
+from haystack.reverse import config
+from haystack.reverse import utils
+
+log = logging.getLogger('stringtable')
+
+ENCODING_ASCII = 0
+ENCODING_UTF16LE = 1
+ENCODINGS = ['ascii', 'utf-16le']
+
+# minimum number of characters in a string
+MIN_LENGTH = 4
+
+_PRINTABLE = b'[\\x20-\\x7e\\t\\n\\r]'
+
+NO_RECORD = -1
+
+ADDRESS, RECORD, LENGTH, ENCODING, STRING_ID = range(5)
+
+
+def _make_regexes(min_length):
+    ascii_re = re.compile(b'%s{%d,}' % (_PRINTABLE, min_length))
+    utf16_re = re.compile(b'(?:%s\\x00){%d,}' % (_PRINTABLE, min_length))
+    return ascii_re, utf16_re
+
+
+def _find(regex, content):
+    starts = []
+    ends = []
+    for m in regex.finditer(content):
+        starts.append(m.start())
+        ends.append(m.end())
+    return numpy.array(starts, dtype=numpy.int64), numpy.array(ends, dtype=numpy.int64)
+
+
+def scan_strings(content, base_address=0, min_length=MIN_LENGTH):
+    """
+    Finds the ASCII and UTF-16LE strings in a buffer.
+
+    :param content: bytes-like buffer, like a memory-mapped heap
+    :param base_address: the address of the first byte
+    :return: int64 arrays of addresses, lengths in bytes and encodings, sorted by address
+    """
+    ascii_re, utf16_re = _make_regexes(min_length)
+    ascii_starts, ascii_ends = _find(ascii_re, content)
+    utf16_starts, utf16_ends = _find(utf16_re, content)
+    if len(ascii_starts) > 0 and len(utf16_starts) > 0:
+        # the first character of a UTF-16 run also ends the preceding ASCII run, cut it
+        index = numpy.searchsorted(utf16_starts, ascii_ends, side='left') - 1
+        inside = (index >= 0) & (utf16_starts[index] > ascii_starts)
+        ascii_ends = numpy.where(inside, utf16_starts[index], ascii_ends)
+        keep = (ascii_ends - ascii_starts) >= min_length
+        ascii_starts = ascii_starts[keep]
+        ascii_ends = ascii_ends[keep]
+    starts = numpy.concatenate((ascii_starts, utf16_starts))
+    lengths = numpy.concatenate((ascii_ends - ascii_starts, utf16_ends - utf16_starts))
+    encodings = numpy.concatenate((numpy.full(len(ascii_starts), ENCODING_ASCII, dtype=numpy.int64),
+                                   numpy.full(len(utf16_starts), ENCODING_UTF16LE, dtype=numpy.int64)))
+    order = numpy.argsort(starts, kind='mergesort')
+    return starts[order] + base_address, lengths[order], encodings[order]
+
+
+def owning_records(addresses, allocations_addresses, allocations_sizes):
+    """
+    Returns the address of the allocated record containing each address, or NO_RECORD.
+
+    :param allocations_addresses: sorted allocations addresses
+    """
+    addresses = numpy.asarray(addresses, dtype=numpy.int64)
+    allocations_addresses = numpy.asarray(allocations_addresses, dtype=numpy.int64)
+    allocations_sizes = numpy.asarray(allocations_sizes, dtype=numpy.int64)
+    res = numpy.full(len(addresses), NO_RECORD, dtype=numpy.int64)
+    if len(allocations_addresses) == 0:
+        return res
+    index = numpy.searchsorted(allocations_addresses, addresses, side='right') - 1
+    inside = index >= 0
+    inside[inside] = addresses[inside] < allocations_addresses[index[inside]] + allocations_sizes[index[inside]]
+    res[inside] = allocations_addresses[index[inside]]
+    return res
+
+
+class StringTable(object):
+    """
+    The columnar strings table of a heap, and its values dictionary.
+    """
+
+    def __init__(self, table, values):
+        self.table = table
+        self.values = values
+
+    @classmethod
+    def build(cls, content, base_address, allocations_addresses, allocations_sizes, min_length=MIN_LENGTH):
+        """Scan a heap content and make its strings table"""
+        addresses, lengths, encodings = scan_strings(content, base_address, min_length)
+        records = owning_records(addresses, allocations_addresses, allocations_sizes)
+        # deduplicate values
+        values = []
+        ids = {}
+        string_ids = numpy.empty(len(addresses), dtype=numpy.int64)
+        for i, (address, length, encoding) in enumerate(zip(addresses.tolist(), lengths.tolist(),
+                                                            encodings.tolist())):
+            offset = address - base_address
+            value = bytes(content[offset:offset + length]).decode(ENCODINGS[encoding])
+            string_id = ids.get(value)
+            if string_id is None:
+                string_id = ids[value] = len(values)
+                values.append(value)
+            string_ids[i] = string_id
+        table = numpy.vstack((addresses, records, lengths, encodings, string_ids))
+        return cls(table, values)
+
+    def __len__(self):
+        return self.table.shape[1]
+
+    def save(self, dumpname, heap_addr):
+        encoded = [value.encode('utf-8') for value in self.values]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(value) for value in encoded])
+        utils.int_array_save(config.get_cache_filename(config.CACHE_STRINGS_TABLE, dumpname, heap_addr), self.table)
+        utils.int_array_save(config.get_cache_filename(config.CACHE_STRINGS_VALUES_OFFSETS, dumpname, heap_addr),
+                             offsets)
+        with open(config.get_cache_filename(config.CACHE_STRINGS_VALUES, dumpname, heap_addr), 'wb') as fout:
+            fout.write(b''.join(encoded))
+        return
+
+    @classmethod
+    def load(cls, dumpname, heap_addr):
+        """Load the strings table of a heap. Raises IOError if there is none."""
+        table = utils.int_array_cache(config.get_cache_filename(config.CACHE_STRINGS_TABLE, dumpname, heap_addr))
+        offsets = utils.int_array_cache(
+            config.get_cache_filename(config.CACHE_STRINGS_VALUES_OFFSETS, dumpname, heap_addr))
+        if table is None or offsets is None:
+            raise IOError('No strings table for heap 0x%x' % heap_addr)
+        with open(config.get_cache_filename(config.CACHE_STRINGS_VALUES, dumpname, heap_addr), 'rb') as fin:
+            data = fin.read()
+        values = [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+        return cls(table, values)
+
+    def get_strings_for_record(self, record_address):
+        """Returns the list of (address, value) of the strings in a record"""
+        # hits are sorted by address, the hits of a record follow its address
+        start = int(numpy.searchsorted(self.table[ADDRESS], record_address))
+        end = start
+        while end < len(self) and self.table[RECORD, end] == record_address:
+            end += 1
+        return [(int(self.table[ADDRESS, i]), self.values[self.table[STRING_ID, i]]) for i in range(start, end)]
+
+    def iter_records_strings(self):
+        """Yields the address, length in bytes and value of the strings in records, by address"""
+        for i in numpy.flatnonzero(self.table[RECORD] != NO_RECORD).tolist():
+            yield int(self.table[ADDRESS, i]), int(self.table[LENGTH, i]), self.values[self.table[STRING_ID, i]]
+        return
+
+    def get_addresses_for_value(self, value):
+        """Returns the addresses of all hits of a string value"""
+        if value not in self.values:
+            return []
+        string_id = self.values.index(value)
+        return self.table[ADDRESS][self.table[STRING_ID] == string_id].tolist()
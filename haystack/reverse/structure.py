@@ -109,6 +109,7 @@ class CacheWrapper:
         if not os.access(self._fname, os.F_OK):
             raise ValueError("%s does not exists" % self._fname)
         self._memory_handler = _context.memory_handler
+        self._context = _context
         self.obj = None
 
     def __getattr__(self, *args):
@@ -131,6 +132,10 @@ class CacheWrapper:
         except (EOFError, ValueError) as e:
             log.error('Could not load %s - removing it %s', self._fname, e)
             os.remove(self._fname)
+            # the record will be reversed again
+            record_table = self._context.get_record_table()
+            record_table.set_dirty(self.address)
+            record_table.save(self._context)
             raise e  # bad file removed
         if not isinstance(p, AnonymousRecord):
             raise EOFError("not a AnonymousRecord in cache. %s", p.__class__)
@@ -138,6 +143,8 @@ class CacheWrapper:
             raise TypeError("Why is a cache wrapper pickled?")
         p.set_memory_handler(self._memory_handler)
         p._dirty = False
+        # the loaded record is the saved record
+        self._context.get_record_table().update_loaded(p)
         CacheWrapper.refs[self.address] = p
         self.obj = weakref.ref(p)
         return
@@ -333,10 +340,13 @@ class AnonymousRecord(object):
             log.debug('saving to %s', fname)
             with open(fname, 'wb') as fout:
                 pickle.dump(self, fout)
+            # keep the record table in sync with the records cache
+            _context.get_record_table().update(self)
         except pickle.PickleError as e:
             # self.struct must be cleaned.
             log.error("Pickling error, file %s removed", fname)
             os.remove(fname)
+            _context.get_record_table().set_dirty(self.address)
             raise e
         except TypeError as e:
             log.error(e)
@@ -350,6 +360,7 @@ class AnonymousRecord(object):
         except KeyboardInterrupt as e:
             # clean it, its stale
             os.remove(fname)
+            _context.get_record_table().set_dirty(self.address)
             log.warning('removing %s' % fname)
             ex = sys.exc_info()
             raise ex[1](None).with_traceback(ex[2])
@@ -369,6 +380,9 @@ class AnonymousRecord(object):
         return self._reverse_level
 
     def set_reverse_level(self, level):
+        if level != self._reverse_level:
+            # the record has to be saved again
+            self._dirty = True
         self._reverse_level = level
 
     def to_string(self):
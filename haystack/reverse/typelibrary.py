@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Persistent library of type signatures, shared between dumps.
+
+A library entry is a type name for a record size and signature text.
+Reversing the same binary again, the records with a known signature are
+named instantly, and do not go through the similarity comparisons.
+
+Names generated by the reversers are stored unconfirmed. They keep the
+same records under the same name across dumps, until the user renames or
+confirms them with haystack-reverse-types.
+
+The library folder holds:
+    - types.entries: pickled list of TypeEntry
+    - types.hashes.npy: sorted signature hashes and their entry index
+    - types.sizes.npy: sorted record sizes and their entry index
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+import Levenshtein
+import numpy
+
+from haystack.reverse import config
+from haystack.reverse import utils
+
+log = logging.getLogger('typelibrary')
+
+
+def signature_hash(size, signature_text):
+    """Returns a int64 hash of a record size and signature text"""
+    digest = hashlib.md5(('%d:%s' % (size, signature_text)).encode('latin1', 'replace')).digest()
+    return int(numpy.frombuffer(digest[:8], dtype=numpy.int64)[0])
+
+
+class TypeEntry(object):
+    """A type name for a record size and signature"""
+    # entries saved before the confirmation were generated names
+    confirmed = False
+
+    def __init__(self, name, size, signature_text, layout=None, confirmed=False):
+        self.name = name
+        self.size = size
+        self.signature_text = signature_text
+        # list of fields signatures, (field type, size)
+        self.layout = layout
+        # number of runs that found this type
+        self.count = 1
+        # the name was given by the user
+        self.confirmed = confirmed
+
+    def get_hash(self):
+        return signature_hash(self.size, self.signature_text)
+
+    def __repr__(self):
+        return '<TypeEntry %s size:%d %s>' % (self.name, self.size, self.signature_text)
+
+
+class TypeLibrary(object):
+    """
+    A library of type signatures, indexed by signature hash and by size.
+
+    :param folder: the library folder, see config.get_type_library_folder
+    """
+
+    def __init__(self, folder=None):
+        self._folder = config.get_type_library_folder(folder)
+        self._entries = []
+        self._hashes = numpy.zeros((2, 0), dtype=numpy.int64)
+        self._sizes = numpy.zeros((2, 0), dtype=numpy.int64)
+        # entries added since the index was built, by hash
+        self._new = {}
+        # the type names, made on demand
+        self._names = None
+        self._load()
+
+    def _get_filename(self, typ):
+        return os.path.sep.join([self._folder, typ])
+
+    def _load(self):
+        fname = self._get_filename(config.TYPE_LIBRARY_ENTRIES)
+        if not os.access(fname, os.R_OK):
+            log.debug('No type library in %s', self._folder)
+            return
+        with open(fname, 'rb') as fin:
+            self._entries = pickle.load(fin)
+        hashes = utils.int_array_cache(self._get_filename(config.TYPE_LIBRARY_HASH_INDEX))
+        sizes = utils.int_array_cache(self._get_filename(config.TYPE_LIBRARY_SIZE_INDEX))
+        if hashes is None or sizes is None or hashes.shape[1] != len(self._entries):
+            log.warning('Rebuilding the type library index of %s', self._folder)
+            self._build_index()
+        else:
+            self._hashes = hashes
+            self._sizes = sizes
+        log.debug('Loaded %d types from %s', len(self._entries), self._folder)
+        return
+
+    def _build_index(self):
+        ids = numpy.arange(len(self._entries), dtype=numpy.int64)
+        hashes = numpy.array([e.get_hash() for e in self._entries], dtype=numpy.int64)
+        sizes = numpy.array([e.size for e in self._entries], dtype=numpy.int64)
+        order = numpy.argsort(hashes, kind='mergesort')
+        self._hashes = numpy.vstack((hashes[order], ids[order]))
+        order = numpy.argsort(sizes, kind='mergesort')
+        self._sizes = numpy.vstack((sizes[order], ids[order]))
+        self._new = {}
+        return
+
+    def save(self):
+        """Write the library to its folder"""
+        if not os.path.isdir(self._folder):
+            os.makedirs(self._folder)
+        self._build_index()
+        with open(self._get_filename(config.TYPE_LIBRARY_ENTRIES), 'wb') as fout:
+            pickle.dump(self._entries, fout)
+        utils.int_array_save(self._get_filename(config.TYPE_LIBRARY_HASH_INDEX), self._hashes)
+        utils.int_array_save(self._get_filename(config.TYPE_LIBRARY_SIZE_INDEX), self._sizes)
+        log.info('[+] Saved %d types in library %s', len(self._entries), self._folder)
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_entry(self, size, signature_text):
+        _hash = signature_hash(size, signature_text)
+        if _hash in self._new:
+            return self._new[_hash]
+        start = numpy.searchsorted(self._hashes[0], _hash, side='left')
+        end = numpy.searchsorted(self._hashes[0], _hash, side='right')
+        for i in self._hashes[1][start:end]:
+            entry = self._entries[i]
+            if entry.size == size and entry.signature_text == signature_text:
+                return entry
+        return None
+
+    def get_entries_for_size(self, size):
+        """Returns the entries of types of that size"""
+        start = numpy.searchsorted(self._sizes[0], size, side='left')
+        end = numpy.searchsorted(self._sizes[0], size, side='right')
+        entries = [self._entries[i] for i in self._sizes[1][start:end]]
+        entries.extend(e for e in self._new.values() if e.size == size)
+        return entries
+
+    def lookup(self, size, signature_text, fuzzy=False, threshold=0.75):
+        """
+        Returns the type name of a record signature, or None.
+
+        :param fuzzy: if there is no exact match, look for the most similar
+            signature of the same size, with a Levenshtein ratio above threshold
+        """
+        entry = self._get_entry(size, signature_text)
+        if entry is not None:
+            return entry.name
+        if not fuzzy:
+            return None
+        best = None
+        best_ratio = threshold
+        for entry in self.get_entries_for_size(size):
+            ratio = Levenshtein.ratio(signature_text, entry.signature_text)
+            if ratio > best_ratio:
+                best, best_ratio = entry, ratio
+        if best is None:
+            return None
+        return best.name
+
+    def add(self, name, size, signature_text, layout=None, confirmed=False):
+        """
+        Add a type to the library. If the signature is already known, the known name is kept,
+        unless it is unconfirmed and this name is confirmed.
+
+        :param confirmed: the name was given by the user, not generated
+        :return: the type name in the library
+        """
+        entry = self._get_entry(size, signature_text)
+        if entry is not None:
+            entry.count += 1
+            if confirmed and not entry.confirmed:
+                entry.name = name
+                entry.confirmed = True
+                self._names = None
+            return entry.name
+        entry = TypeEntry(name, size, signature_text, layout, confirmed)
+        self._names = None
+        self._entries.append(entry)
+        self._new[entry.get_hash()] = entry
+        return name
+
+    def add_record(self, _record, name=None, confirmed=False):
+        """Add the type of a record to the library, under its record type name by default"""
+        if name is None:
+            name = _record.record_type.type_name
+        return self.add(name, len(_record), _record.get_signature_text(), _record.get_signature(), confirmed)
+
+    def get_entries(self):
+        return list(self._entries)
+
+    def has_name(self, name):
+        if self._names is None:
+            self._names = set(entry.name for entry in self._entries)
+        return name in self._names
+
+    def rename(self, name, new_name):
+        """
+        Rename and confirm the entries of a type.
+
+        :return: the number of renamed entries
+        """
+        nb = 0
+        self._names = None
+        for entry in self._entries:
+            if entry.name == name:
+                entry.name = new_name
+                entry.confirmed = True
+                nb += 1
+        return nb
+
+    def confirm(self, name):
+        """
+        Confirm the generated name of the entries of a type.
+
+        :return: the number of confirmed entries
+        """
+        return self.rename(name, name)
+
+
+def list_cmdline(opts):
+    library = TypeLibrary(opts.library)
+    for entry in sorted(library.get_entries(), key=lambda e: (not e.confirmed, e.name, e.size)):
+        if opts.unconfirmed and entry.confirmed:
+            continue
+        print('%-40s %6d %6d %s %s' % (entry.name, entry.size, entry.count, 'C' if entry.confirmed else ' ',
+                                       entry.signature_text))
+    return
+
+
+def rename_cmdline(opts):
+    library = TypeLibrary(opts.library)
+    nb = library.rename(opts.name, opts.new_name)
+    if nb == 0:
+        raise ValueError('No type %s in the library' % opts.name)
+    library.save()
+    return
+
+
+def confirm_cmdline(opts):
+    library = TypeLibrary(opts.library)
+    for name in opts.names:
+        if library.confirm(name) == 0:
+            raise ValueError('No type %s in the library' % name)
+    library.save()
+    return
+
+
+def argparser():
+    rootparser = argparse.ArgumentParser(
+        prog='haystack-reverse-types',
+        description='List, rename and confirm the types of the type signatures library.')
+    rootparser.add_argument('--debug', action='store_true', help='Debug mode on.')
+    rootparser.add_argument('--library', default=None,
+                            help='The type library folder. Defaults to $%s or %s.' % (
+                                config.TYPE_LIBRARY_ENV, config.TYPE_LIBRARY_DEFAULT_FOLDER))
+    subparsers = rootparser.add_subparsers(title='commands')
+    list_parser = subparsers.add_parser('list', help='List the types: name, size, count, confirmed and signature.')
+    list_parser.add_argument('--unconfirmed', action='store_true', help='Only list the generated names.')
+    list_parser.set_defaults(func=list_cmdline)
+    rename_parser = subparsers.add_parser('rename', help='Rename a type, and confirm it.')
+    rename_parser.add_argument('name', help='The type name in the library.')
+    rename_parser.add_argument('new_name', help='The new type name.')
+    rename_parser.set_defaults(func=rename_cmdline)
+    confirm_parser = subparsers.add_parser('confirm', help='Confirm generated type names.')
+    confirm_parser.add_argument('names', nargs='+', help='The type names in the library.')
+    confirm_parser.set_defaults(func=confirm_cmdline)
+    return rootparser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparser()
+    opts = parser.parse_args(argv)
+    if not hasattr(opts, 'func'):
+        parser.error('a command is required')
+    level = logging.INFO
+    if opts.debug:
+        level = logging.DEBUG
+    logging.basicConfig(level=level)
+    try:
+        opts.func(opts)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -22,10 +22,12 @@ import haystack.reverse.matchers
 log = logging.getLogger('utils')
 
 
-def int_array_cache(filename):
-    if os.access(filename, os.F_OK):
-        # f = open(filename, 'r')
-        return numpy.load(filename)
+def int_array_cache(filename, mmap_mode=None):
+    # numpy.save appends a .npy extension to the filename
+    for fname in [filename, filename + '.npy']:
+        if os.access(fname, os.F_OK):
+            # f = open(filename, 'r')
+            return numpy.load(fname, mmap_mode=mmap_mode)
     # print 'int_array_cache'
     return None
 
@@ -37,6 +39,43 @@ def int_array_save(filename, lst):
     return my_array
 
 
+class ArrayBuilder(object):
+    """
+    Append-only int64 array.
+    Values are buffered in a small list and packed in numpy chunks,
+    so that large arrays do not cost a python int per value.
+    """
+
+    def __init__(self, chunk_size=0x10000):
+        self._chunk_size = chunk_size
+        self._chunks = []
+        self._buffer = []
+        self._len = 0
+
+    def append(self, value):
+        self._buffer.append(value)
+        self._len += 1
+        if len(self._buffer) >= self._chunk_size:
+            self._pack()
+
+    def _pack(self):
+        if len(self._buffer) > 0:
+            self._chunks.append(numpy.asarray(self._buffer, dtype=numpy.int64))
+            self._buffer = []
+
+    def to_array(self, start=0, end=None):
+        """Returns a numpy.array copy of the values in [start:end]"""
+        self._pack()
+        if len(self._chunks) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        if len(self._chunks) > 1:
+            self._chunks = [numpy.concatenate(self._chunks)]
+        return self._chunks[0][start:end].copy()
+
+    def __len__(self):
+        return self._len
+
+
 def closestFloorValueNumpy(val, lst):
     ''' return the closest previous value to where val should be in lst (or val)
      please use numpy.array for lst
@@ -96,11 +135,11 @@ def dequeue(addrs, start, end):
     return addrs, ret
 
 
-def get_cache_heap_pointers(ctx, enumerator):
+def get_cache_heap_pointers(ctx, enumerator=None):
     """
     Cache or return Heap pointers values in enumerator .
-    :param dumpfilename:
-    :param heap_addr: the heap address for the cache filename
+    :param ctx: the HeapContext, for the cache filename
+    :param enumerator: defaults to the allocated pointers enumerator of ctx, only made if there is no cache
     :return:
     """
     heap_addrs_fname = ctx.get_filename_cache_pointers_addresses()
@@ -109,6 +148,8 @@ def get_cache_heap_pointers(ctx, enumerator):
     heap_values = int_array_cache(heap_values_fname)
     if heap_addrs is None or heap_values is None:
         log.info('[+] Making new cache - heap pointers')
+        if enumerator is None:
+            enumerator = ctx.get_allocated_pointers_enumerator()
         heap_enum = enumerator.search()
         if len(heap_enum) > 0:
             heap_addrs, heap_values = zip(*heap_enum)  # WTF
@@ -119,18 +160,17 @@ def get_cache_heap_pointers(ctx, enumerator):
         int_array_save(heap_addrs_fname, heap_addrs)
         int_array_save(heap_values_fname, heap_values)
     else:
-        log.debug('[+] Loading from cache %d pointers %d unique', len(heap_values), len(set(heap_values)))
+        log.debug('[+] Loading from cache %d pointers', len(heap_values))
     return heap_addrs, heap_values
 
 
-def cache_get_user_allocations(ctx, heap_walker):
+def cache_get_user_allocations(ctx, heap_walker=None):
     """
     cache the user allocations, which are the allocated chunks
         records addrs and sizes.
 
-    :param dumpfilename:
-    :param memory_handler:
-    :param heapwalker:
+    :param ctx: the HeapContext, for the cache filename
+    :param heap_walker: defaults to the heap walker of ctx, only opened if there is no cache
     :return:
     """
     f_addrs = ctx.get_filename_cache_allocations_addresses()
@@ -149,6 +189,8 @@ def cache_get_user_allocations(ctx, heap_walker):
         # in case of a pointer ( bad allocation ) out of a mmapping space.
         # But that is not possible, because we are reporting factual reference to existing address space.
         # OK. heap.start should be deleted from the cache name.
+        if heap_walker is None:
+            heap_walker = ctx.get_heap_walker()
         allocations = sorted(heap_walker.get_user_allocations())
         if len(allocations) == 0:
             return [],[]
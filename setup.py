@@ -71,6 +71,9 @@ setup(name="haystack-reverse",
               'haystack-reverse-show = haystack.reverse.cli:reverse_show',
               'haystack-reverse-parents = haystack.reverse.cli:reverse_parents',
               'haystack-reverse-hex = haystack.reverse.cli:reverse_hex',
+              'haystack-reverse-growth = haystack.reverse.growth:main',
+              'haystack-reverse-types = haystack.reverse.typelibrary:main',
+              'haystack-reverse-daemon = haystack.reverse.daemon:main',
           ]
       },
       # reverse: numpy is a dependency for reverse.
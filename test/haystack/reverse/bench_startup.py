@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Startup timings of the reverse commands, on a generated reversed dump.
+
+The generated dump is a haystack folder dump of heaps of HEAP_SIZE bytes,
+memory-mapped by the folder loader. The heaps files are sparse, so a multi-GB
+dump takes little disk space. The reverse cache holds the allocations of
+every heap, the pointers of every heap and the predecessors index of all
+allocations, each allocation pointing to the next one, and the pickles of
+the queried records and of their predecessor.
+
+Each command runs in a new python process, as from the command line, and
+its wall time is compared to the target.
+
+The startup of the reverse context is timed in this process: the
+HeapContext of every heap is loaded from its cache by a new ProcessContext.
+The generated heaps are zeros, so their heap walkers are given by a
+BenchFinder, which reads the first page of a heap when opening its walker.
+
+    python -m test.haystack.reverse.bench_startup --size-gb 4 /tmp/bench.dump
+
+The page cache is not dropped between runs, the first run of each command
+is the coldest.
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+import numpy
+
+from haystack.mappings import folder
+from haystack.reverse import config
+from haystack.reverse import context
+from haystack.reverse import graphindex
+from haystack.reverse import structure
+from haystack.reverse import utils
+from test.haystack.reverse import fakes
+
+log = logging.getLogger('bench_startup')
+
+# under folder.MAX_MAPPING_SIZE_FOR_MMAP
+HEAP_SIZE = 0x1000000
+HEAPS_START = 0x7f0000000000
+ALLOCATION_SIZE = 0x100
+# seconds
+TARGET = 1.0
+
+QUERY_COMMANDS = {
+    'hex': 'reverse_hex',
+    'show': 'reverse_show',
+    'parents': 'reverse_parents',
+}
+
+
+def make_dump(dumpname, size, heap_size=HEAP_SIZE, allocation_size=ALLOCATION_SIZE, nb_queries=3, seed=0):
+    """
+    Make a reversed folder dump of heaps of that total size in bytes.
+
+    :return: the addresses to query, inside records
+    """
+    heaps = max(1, size // heap_size)
+    os.mkdir(dumpname)
+    memory_handler = fakes.FakeMemoryHandler(dumpname, [])
+    config.create_cache_folder(dumpname)
+    config.create_record_cache_folder(dumpname)
+    lines = []
+    sources = []
+    targets = []
+    heaps_allocations = []
+    for i in range(heaps):
+        start = HEAPS_START + i * 2 * heap_size
+        end = start + heap_size
+        lines.append('0x%x 0x%x rw-p 0x0 00:00 0 %s' % (start, end, '[heap]' if i == 0 else ''))
+        with open(os.path.sep.join([dumpname, '0x%x-0x%x' % (start, end)]), 'wb') as fout:
+            fout.truncate(heap_size)
+        addresses = numpy.arange(start, end, allocation_size, dtype=numpy.int64)
+        sizes = numpy.full(len(addresses), allocation_size, dtype=numpy.int64)
+        utils.int_array_save(config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_ADDRS, dumpname, start), addresses)
+        utils.int_array_save(config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, dumpname, start), sizes)
+        utils.int_array_save(config.get_cache_filename(config.CACHE_HEAP_ADDRS, dumpname, start), addresses[:-1])
+        utils.int_array_save(config.get_cache_filename(config.CACHE_HEAP_VALUES, dumpname, start), addresses[1:])
+        sources.append(addresses[:-1])
+        targets.append(addresses[1:])
+        heaps_allocations.append(addresses)
+    with open(os.path.sep.join([dumpname, 'mappings']), 'w') as fout:
+        fout.write(''.join('%s\n' % line for line in lines))
+    graphindex.save_predecessors_index(dumpname, numpy.concatenate(sources), numpy.concatenate(targets))
+    # the queried records, and their predecessor
+    random = numpy.random.RandomState(seed)
+    queries = []
+    for _ in range(nb_queries):
+        addresses = heaps_allocations[random.randint(heaps)]
+        i = random.randint(1, len(addresses))
+        for address in addresses[i - 1:i + 1].tolist():
+            _record = structure.AnonymousRecord(memory_handler, address, allocation_size)
+            fname = os.path.sep.join([config.get_record_cache_folder_name(dumpname), 'struct_%x' % address])
+            with open(fname, 'wb') as fout:
+                pickle.dump(_record, fout)
+        queries.append(int(addresses[i]) + 8)
+    return queries
+
+
+def run_command(command, dumpname, addresses):
+    """Returns the wall time and the output of a query command, in a new process"""
+    code = 'import sys; from haystack.reverse import cli; sys.argv[0] = "%s"; cli.%s()' % (
+        command, QUERY_COMMANDS[command])
+    argv = [sys.executable, '-c', code, '--osname', 'linux', '--bits', '64', '--json',
+            'dir://%s' % os.path.abspath(dumpname)] + ['0x%x' % address for address in addresses]
+    t0 = time.time()
+    output = subprocess.check_output(argv)
+    return time.time() - t0, output.decode('utf-8')
+
+
+def time_queries(dumpname, addresses, repeat=3):
+    """Returns the command, the wall times of each run and the last output of each query command"""
+    res = []
+    for command in sorted(QUERY_COMMANDS):
+        runs = [run_command(command, dumpname, addresses) for _ in range(repeat)]
+        res.append((command, [ts for ts, _ in runs], runs[-1][1]))
+    return res
+
+
+class BenchWalker(fakes.FakeWalker):
+    """The walker of a generated heap, on its mapping like the libc heap walkers"""
+
+    def __init__(self, heap_mapping):
+        super(BenchWalker, self).__init__(heap_mapping.start)
+        self._heap_mapping = heap_mapping
+
+
+class BenchFinder(fakes.FakeFinder):
+    """Opens the walkers of the generated heaps, reading the first page of the heap like a heap walker"""
+
+    def get_heap_walker(self, mapping):
+        mapping.read_bytes(mapping.start, 0x1000)
+        return super(BenchFinder, self).get_heap_walker(mapping)
+
+
+def time_contexts(dumpname, repeat=3):
+    """
+    Returns the wall times of loading the HeapContext of every heap from its cache,
+    and the number of heap walkers opened by each run.
+    """
+    memory_handler = folder.load(dumpname, bits=64, os_name='linux')
+    heaps = memory_handler.get_mappings()
+    memory_handler._heap_finder = BenchFinder([BenchWalker(heap_mapping) for heap_mapping in heaps])
+    # make the contexts caches
+    for ctx in context.ProcessContext(memory_handler).list_contextes():
+        ctx.save()
+    times = []
+    opened = []
+    for _ in range(repeat):
+        memory_handler.reset_mappings()
+        memory_handler._heap_finder.nb_opened = 0
+        t0 = time.time()
+        contexts = context.ProcessContext(memory_handler).list_contextes()
+        times.append(time.time() - t0)
+        opened.append(memory_handler._heap_finder.nb_opened)
+        assert len(contexts) == len(heaps)
+    return times, opened
+
+
+def _get_size_on_disk(dumpname):
+    size = 0
+    for dirpath, _, filenames in os.walk(dumpname):
+        for fname in filenames:
+            size += os.stat(os.path.sep.join([dirpath, fname])).st_blocks * 512
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_startup', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('dumpname', help='The generated dump folder, made if it does not exist.')
+    parser.add_argument('--size-gb', type=float, default=4, help='The size of the heaps of the dump.')
+    parser.add_argument('--heap-size', type=int, default=HEAP_SIZE, help='The size of each heap.')
+    parser.add_argument('--allocation-size', type=int, default=ALLOCATION_SIZE, help='The size of each allocation.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs of each command.')
+    opts = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if os.path.exists(opts.dumpname):
+        raise SystemExit('%s exists' % opts.dumpname)
+    t0 = time.time()
+    size = int(opts.size_gb * 2**30)
+    addresses = make_dump(opts.dumpname, size, opts.heap_size, opts.allocation_size)
+    log.info('Made a dump of %d heaps, %0.1f GB, %0.1f MB on disk in %0.0fs', size // opts.heap_size, opts.size_gb,
+             _get_size_on_disk(opts.dumpname) / 2.**20, time.time() - t0)
+    print('command  first    min  median  target %0.1fs' % TARGET)
+    for command, runs, output in time_queries(opts.dumpname, addresses, opts.repeat):
+        found = [json.loads(line)['record'] is not None for line in output.splitlines()]
+        if not all(found):
+            raise SystemExit('%s: %d/%d records not found' % (command, found.count(False), len(found)))
+        print('%-7s %6.3f %6.3f %7.3f  %s' % (command, runs[0], min(runs), numpy.median(runs),
+                                              'ok' if runs[0] < TARGET else 'over'))
+    runs, opened = time_contexts(opts.dumpname, opts.repeat)
+    print('contexts %6.3f %6.3f %7.3f  %d walkers opened' % (runs[0], min(runs), numpy.median(runs), opened[0]))
+    return
+
+
+if __name__ == '__main__':
+    main()
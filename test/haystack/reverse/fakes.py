@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Fake memory handlers, heap contexts and records for the haystack.reverse tests."""
+
+import pickle
+
+import numpy
+
+from haystack import target
+from haystack.abc import interfaces
+from haystack.reverse import config
+from haystack.reverse import graphindex
+from haystack.reverse import recordtable
+from haystack.reverse import structure
+from haystack.reverse import utils
+
+
+class FakeMapping(object):
+    def __init__(self, start, content):
+        self.start = start
+        self.end = start + len(content)
+        self._content = content
+
+    def __len__(self):
+        return self.end - self.start
+
+    def read_bytes(self, address, size):
+        offset = address - self.start
+        return self._content[offset:offset + size]
+
+
+class FakeWalker(interfaces.IHeapWalker):
+    """A heap with one allocation of 0x10 bytes, at offset 0x10"""
+
+    def __init__(self, heap_address):
+        self.heap_address = heap_address
+        self.nb_walks = 0
+
+    def get_heap_address(self):
+        return self.heap_address
+
+    def get_user_allocations(self):
+        self.nb_walks += 1
+        return [(self.heap_address + 0x10, 0x10)]
+
+
+class FakeFinder(object):
+    def __init__(self, walkers):
+        self.walkers = walkers
+        self.nb_opened = 0
+
+    def list_heap_walkers(self):
+        return self.walkers
+
+    def get_heap_walker(self, mapping):
+        self.nb_opened += 1
+        for walker in self.walkers:
+            if walker.get_heap_address() == mapping.start:
+                return walker
+        raise ValueError('mapping not used as a heap')
+
+
+class FakeMemoryHandler(interfaces.IMemoryHandler):
+    """
+    Fake memoryhandler for the tests.
+
+    :param dumpname: the dump folder
+    :param mappings: the FakeMapping of the dump
+    :param walkers: the heap walkers of the heap finder
+    :param process_context: the reverse context, if it can be used
+    """
+
+    def __init__(self, dumpname, mappings, walkers=(), process_context=None):
+        self.dumpname = dumpname
+        self.mappings = mappings
+        self.finder = FakeFinder(list(walkers))
+        self.process_context = process_context
+        self.target = target.TargetPlatform.make_target_linux_64()
+
+    def get_name(self):
+        return self.dumpname
+
+    def get_target_platform(self):
+        return self.target
+
+    def get_heap_finder(self):
+        return self.finder
+
+    def get_mapping_for_address(self, address):
+        for m in self.mappings:
+            if m.start <= address < m.end:
+                return m
+        return None
+
+    def get_reverse_context(self):
+        if self.process_context is None:
+            raise AssertionError('the reverse context should not be used')
+        return self.process_context
+
+
+class FakeProcessContext(object):
+    """The reversed types, and the heap contexts by heap address"""
+
+    def __init__(self, heap_contexts=()):
+        self.heap_contexts = sorted(heap_contexts, key=lambda ctx: ctx._heap_start)
+        self.reversed_types = {}
+
+    def add_reversed_type(self, typename, t):
+        self.reversed_types[typename] = t
+
+    def get_context_for_address(self, address):
+        for ctx in reversed(self.heap_contexts):
+            if ctx._heap_start <= address:
+                return ctx
+        raise ValueError('No heap context for 0x%x' % address)
+
+
+class FakeHeapContext(object):
+    """
+    A heap context of records, on the cache files of a dump folder.
+    The record table is made on first use.
+
+    :param addresses: the allocations addresses, defaults to the records addresses
+    :param sizes: the allocations sizes, defaults to the records sizes
+    :param records: the records of get_record_for_address
+    :param pointers_addresses: the addresses of the heap pointers
+    :param pointers_values: the values of the heap pointers
+    """
+
+    def __init__(self, dumpname, addresses=None, sizes=None, records=(), heap_start=0x1000,
+                 pointers_addresses=(), pointers_values=()):
+        self.dumpname = dumpname
+        self._heap_start = heap_start
+        self.records = dict((_record.address, _record) for _record in records)
+        if addresses is None:
+            addresses = sorted(self.records)
+            sizes = [len(self.records[address]) for address in addresses]
+        self._structures_addresses = numpy.array(addresses, dtype=numpy.int64)
+        self._structures_sizes = numpy.array(sizes, dtype=numpy.int64)
+        self._pointers_offsets = numpy.array(pointers_addresses, dtype=numpy.int64)
+        self._pointers_values = numpy.array(pointers_values, dtype=numpy.int64)
+        self._record_table = None
+        # addresses of the records given by get_record_for_address
+        self.loaded = []
+        self.nb_save = 0
+
+    def get_filename_cache_record_table(self):
+        return config.get_cache_filename(config.CACHE_RECORD_TABLE, self.dumpname, self._heap_start)
+
+    def get_filename_cache_record_table_layouts(self):
+        return config.get_cache_filename(config.CACHE_RECORD_TABLE_LAYOUTS, self.dumpname, self._heap_start)
+
+    def get_filename_cache_record_table_types(self):
+        return config.get_cache_filename(config.CACHE_RECORD_TABLE_TYPES, self.dumpname, self._heap_start)
+
+    def get_folder_cache_structures(self):
+        return config.get_record_cache_folder_name(self.dumpname)
+
+    def get_record_table(self):
+        if self._record_table is None:
+            self._record_table = recordtable.RecordTable.make(self._structures_addresses, self._structures_sizes)
+        return self._record_table
+
+    def get_record_for_address(self, address):
+        self.loaded.append(address)
+        return self.records[address]
+
+    def listStructures(self):
+        return [self.records[address] for address in sorted(self.records)]
+
+    def save(self):
+        self.nb_save += 1
+
+
+class FakeRecordType(object):
+    def __init__(self, type_name):
+        self.type_name = type_name
+
+
+class FakeRecord(object):
+    """A record of a size, reverse level, signature text and type name"""
+
+    def __init__(self, address, size, level, signature, type_name=None):
+        self.address = address
+        self._size = size
+        self._level = level
+        self._signature = signature
+        if type_name is None:
+            type_name = str(self)
+        self.record_type = FakeRecordType(type_name)
+
+    def __len__(self):
+        return self._size
+
+    def __str__(self):
+        return 'struct_%x' % self.address
+
+    def get_reverse_level(self):
+        return self._level
+
+    def get_signature_text(self):
+        self.nb_signatures = getattr(self, 'nb_signatures', 0) + 1
+        return self._signature
+
+
+def make_reversed_dump(dumpname):
+    """
+    Returns a memory handler on a reversed dump with two heaps.
+    Records 0x1010 and 0x8000 point to 0x1040
+    """
+    content = bytes(bytearray(range(256))) * 16
+    memory_handler = FakeMemoryHandler(dumpname, [FakeMapping(0x1000, content), FakeMapping(0x8000, content)])
+    config.create_cache_folder(dumpname)
+    config.create_record_cache_folder(dumpname)
+    heaps = {0x1000: ([0x1010, 0x1040], [0x20, 0x10]), 0x8000: ([0x8000], [0x100])}
+    for heap_addr, (addresses, sizes) in heaps.items():
+        utils.int_array_save(config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_ADDRS, dumpname, heap_addr),
+                             addresses)
+        utils.int_array_save(config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, dumpname, heap_addr),
+                             sizes)
+        for address, size in zip(addresses, sizes):
+            _record = structure.AnonymousRecord(memory_handler, address, size)
+            fname = '%s/struct_%x' % (config.get_record_cache_folder_name(dumpname), address)
+            with open(fname, 'wb') as fout:
+                pickle.dump(_record, fout)
+    graphindex.save_predecessors_index(dumpname, [0x1010, 0x8000, 0x8000], [0x1040, 0x1040, 0x1010])
+    return memory_handler
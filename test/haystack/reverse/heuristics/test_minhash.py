@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.heuristics.minhash ."""
+
+import logging
+import random
+import unittest
+
+from haystack.reverse.heuristics import minhash
+
+log = logging.getLogger('test_minhash')
+
+
+def make_signatures(nb_types=20, nb_instances=15, seed=3):
+    """Random families of signature texts, with a few fields changed in each instance"""
+    rng = random.Random(seed)
+    fields = ['P4', 'i4', 'u4', 'z8', 'z4', 'T12', 'I4', 'u8', 'z16', 'a32']
+    texts = []
+    for _ in range(nb_types):
+        base = [rng.choice(fields) for _ in range(rng.randint(4, 20))]
+        for _ in range(nb_instances):
+            sig = list(base)
+            for _ in range(rng.randint(0, 2)):
+                sig[rng.randrange(len(sig))] = rng.choice(fields)
+            texts.append(''.join(sig))
+    return texts
+
+
+class TestMinHash(unittest.TestCase):
+
+    def test_shingles(self):
+        self.assertEqual(len(minhash.shingles('P4i4P4i4', 2)), 2)
+        self.assertEqual(len(minhash.shingles('z12', 2)), 1)
+        self.assertEqual(len(minhash.shingles('', 2)), 1)
+
+    def test_identical(self):
+        lsh = minhash.MinHashLSH()
+        texts = ['P4i4u4z12', 'T8z8P4P4i4', 'P4i4u4z12']
+        self.assertEqual(minhash.verify_pairs(texts, lsh.candidate_pairs(texts)).tolist(), [[0, 2]])
+
+    def test_large_bucket(self):
+        # identical texts are chained, not paired all together
+        lsh = minhash.MinHashLSH(max_bucket_size=4)
+        candidates = lsh.candidate_pairs(['P4i4u4z12'] * 100)
+        self.assertLessEqual(len(candidates), 4 * 100)
+        self.assertTrue(all(i < j for i, j in candidates))
+
+    def test_evaluate(self):
+        texts = make_signatures()
+        res = minhash.evaluate(texts)
+        self.assertEqual(res['comparisons'], len(texts) * (len(texts) - 1) // 2)
+        self.assertLess(res['candidates'], res['comparisons'])
+        self.assertEqual(res['found'], len(minhash.similar_pairs(texts)[0]))
+        self.assertGreater(res['recall'], 0.9)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
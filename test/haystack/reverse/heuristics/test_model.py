@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for haystack.reverse.heuristics.model."""
+
+import logging
+import unittest
+
+from haystack.reverse import recordtable
+from haystack.reverse.heuristics import model
+from test.haystack.reverse import fakes
+
+log = logging.getLogger('test_model')
+
+
+def make_heap_context(levels, table_levels):
+    """Records levels, the record table may be out of date"""
+    records = [fakes.FakeRecord(address, 16, level, 'u16') for address, level in levels.items()]
+    ctx = fakes.FakeHeapContext('test', records=records)
+    table = ctx.get_record_table()
+    addresses = sorted(levels)
+    for address, level in table_levels.items():
+        i = addresses.index(address)
+        table.table[recordtable.REVERSE_LEVEL, i] = level
+        table.table[recordtable.DIRTY, i] = 0
+    return ctx
+
+
+class Reverser(model.AbstractReverser):
+    REVERSE_LEVEL = 20
+
+
+class TestAbstractReverser(unittest.TestCase):
+
+    def test_iterate_records(self):
+        memory_handler = fakes.FakeMemoryHandler('test', [])
+        # 0x1000 is done, 0x1010 is to do, 0x1020 is not in sync
+        # 0x1030 is dirty and done, 0x1040 is dirty and to do
+        levels = {0x1000: 20, 0x1010: 10, 0x1020: 30, 0x1030: 40, 0x1040: 0}
+        ctx = make_heap_context(levels, {0x1000: 20, 0x1010: 10, 0x1020: 10})
+        reverser = Reverser(memory_handler)
+        records = list(reverser._iterate_records(ctx))
+        self.assertEqual([r.address for r in records], [0x1010, 0x1040])
+        # finished records are not loaded
+        self.assertEqual(ctx.loaded, [0x1010, 0x1020, 0x1030, 0x1040])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
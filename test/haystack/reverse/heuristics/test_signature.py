@@ -7,12 +7,20 @@
 from __future__ import print_function
 
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 
 from haystack.mappings import folder
 
+from haystack.reverse import config
 from haystack.reverse import context
+from haystack.reverse import fieldtypes
+from haystack.reverse import structure
+from haystack.reverse import typelibrary
 from haystack.reverse.heuristics import signature, dsa, reversers, pointertypes
+from test.haystack.reverse import fakes
 from test.testfiles import zeus_856_svchost_exe
 
 log = logging.getLogger("test_reversers")
@@ -65,6 +73,164 @@ class TestTypeReverser(unittest.TestCase):
         #code.interact(local=locals())
 
 
+class TestExactClasses(unittest.TestCase):
+
+    def test_exact_classes(self):
+        texts = ['P4i4', 'z8', 'P4i4', 'u8', 'z8', 'P4i4']
+        classes = signature.exact_classes(texts)
+        self.assertEqual(classes, [[0, 2, 5], [1, 4], [3]])
+
+    def test_expand_similarities(self):
+        classes = [[0, 2, 5], [1, 4], [3]]
+        # representatives of class 0 and class 2 are similar
+        pairs = signature.expand_similarities(classes, [(0, 2)])
+        self.assertEqual(sorted(pairs), [(0, 2), (0, 3), (0, 5), (1, 4)])
+
+
+class TestCompareSizeBucket(unittest.TestCase):
+
+    def test_compare_size_bucket(self):
+        addresses = [0x10, 0x20, 0x30, 0x40]
+        texts = ['P4i4u4z12', 'P4i4u4z12', 'P4i4u4z16', 'T24']
+        size, nb, nb_distinct, nb_comparisons, pairs, ts = signature.compare_size_bucket(
+            (24, addresses, texts, False))
+        self.assertEqual((size, nb, nb_distinct, nb_comparisons), (24, 4, 3, 3))
+        self.assertEqual(sorted(pairs), [(0x10, 0x20), (0x10, 0x30)])
+
+    def test_process_pool(self):
+        buckets = [(8, [0x10, 0x20], ['P4P4', 'P4P4'], False),
+                   (16, [0x30, 0x40, 0x50], ['P4P4z8', 'P4P4z8', 'z16'], False)]
+        rev = signature.TypeReverser.__new__(signature.TypeReverser)
+        rev._processes = 1
+        serial = sorted(res[:5] for res in rev._compare_size_buckets(buckets))
+        rev._processes = 2
+        parallel = sorted(res[:5] for res in rev._compare_size_buckets(buckets))
+        self.assertEqual(serial, parallel)
+
+    def test_chain_similarities(self):
+        signatures = [(8, 0x10, 'P4P4'), (8, 0x20, 'P4P4'), (8, 0x30, 'z8'),
+                      (16, 0x40, 'P4P4z8'), (16, 0x50, 'P4P4z8'), (24, 0x60, 'z24')]
+        rev = signature.TypeReverser.__new__(signature.TypeReverser)
+        rev._processes = 1
+        rev._exhaustive = False
+        chains = rev._chain_similarities(signatures)
+        self.assertEqual(chains, [[0x10, 0x20], [0x40, 0x50]])
+
+
+
+
+class TestTypeReverserProcesses(unittest.TestCase):
+
+    def _reverse(self, processes):
+        """Returns the type names of the records after TypeReverser.reverse"""
+        pointer = fieldtypes.Field('ptr', 0, fieldtypes.POINTER, 8, False)
+        zeroes = fieldtypes.Field('zerroes', 8, fieldtypes.ZEROES, 8, False)
+        integer = fieldtypes.Field('int', 8, fieldtypes.SMALLINT, 8, False)
+        text = fieldtypes.Field('text', 0, fieldtypes.STRING, 16, False)
+        text_zeroes = fieldtypes.Field('zerroes', 16, fieldtypes.ZEROES, 8, False)
+        layouts = {0x1000: [pointer, zeroes], 0x1010: [pointer, zeroes], 0x1020: [pointer, integer],
+                   0x1030: [text], 0x1040: [text, text_zeroes], 0x1058: [text, text_zeroes],
+                   0x1070: [text, text_zeroes]}
+        records = []
+        walker = fakes.FakeWalker(0x1000)
+        memory_handler = fakes.FakeMemoryHandler('dump', [], walkers=[walker])
+        for address, fields in sorted(layouts.items()):
+            size = sum(len(f) for f in fields)
+            _record = structure.AnonymousRecord(memory_handler, address, size)
+            _record.set_record_type(fieldtypes.RecordType('struct_%x' % address, size, fields))
+            records.append(_record)
+        heap_context = fakes.FakeHeapContext('dump', records=records)
+        memory_handler.process_context = fakes.FakeProcessContext([heap_context])
+        rev = signature.TypeReverser(memory_handler, processes=processes)
+        rev.reverse()
+        self.assertEqual(heap_context.nb_save, 2)
+        return dict((_record.address, _record.record_type.type_name) for _record in records)
+
+    def test_reverse(self):
+        serial = self._reverse(1)
+        # the similar records of each size are renamed
+        self.assertEqual(serial[0x1000], serial[0x1010])
+        self.assertNotEqual(serial[0x1000], 'struct_1000')
+        self.assertEqual(len(set(serial[address] for address in [0x1040, 0x1058, 0x1070])), 1)
+        self.assertNotEqual(serial[0x1040], 'struct_1040')
+        self.assertEqual(serial[0x1020], 'struct_1020')
+        self.assertEqual(serial[0x1030], 'struct_1030')
+        self.assertEqual(self._reverse(2), serial)
+
+
+class TestTypeNames(unittest.TestCase):
+
+    def test_rename_records(self):
+        memory_handler = fakes.FakeMemoryHandler('dump', [])
+        fields = [fieldtypes.Field('ptr_0', 0, fieldtypes.POINTER, 8, False),
+                  fieldtypes.Field('zerroes_8', 8, fieldtypes.ZEROES, 8, False)]
+        records = [structure.AnonymousRecord(memory_handler, 0x1000, 16),
+                   structure.AnonymousRecord(memory_handler, 0x1010, 16),
+                   structure.AnonymousRecord(memory_handler, 0x1020, 24)]
+        records[0].set_record_type(fieldtypes.RecordType('struct_1000', 16, fields))
+        process_context = fakes.FakeProcessContext()
+        heap_context = fakes.FakeHeapContext('dump', records=records)
+        rev = signature.TypeReverser.__new__(signature.TypeReverser)
+        rev._record_types = {}
+        rev._rename_records(process_context, heap_context, 'list_entry', [0x1000, 0x1010])
+        # a second heap, or chain, with the same name
+        rev._rename_records(process_context, heap_context, 'list_entry', [0x1020])
+        self.assertEqual(len(process_context.reversed_types), 1)
+        record_type, members = list(process_context.reversed_types.items())[0]
+        self.assertEqual(record_type.type_name, 'list_entry')
+        self.assertEqual(members, [0x1000, 0x1010])
+        self.assertIs(records[1].record_type, record_type)
+        self.assertEqual(records[1].get_signature_text(), 'P8z8')
+        self.assertEqual(records[2].record_type.type_name, 'struct_1020')
+
+    def test_new_type_name(self):
+        folder = tempfile.mkdtemp()
+        try:
+            library = typelibrary.TypeLibrary(folder)
+            library.add('word2', 8, 'u4u4')
+            rev = signature.TypeReverser.__new__(signature.TypeReverser)
+            rev._NAMES = ['word1', 'word2', 'word3']
+            rev._library = library
+            # a generated name is not a type of the library
+            self.assertEqual(rev._make_new_type_name(), 'word3')
+            self.assertEqual(rev._make_new_type_name(), 'word1')
+        finally:
+            shutil.rmtree(folder)
+
+
+class TestStructureSizeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        self._context = fakes.FakeHeapContext(self.dumpname, [0x1010, 0x1020, 0x1040, 0x1050, 0x1080],
+                                              [16, 32, 16, 48, 16])
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_sizes(self):
+        cache = signature.StructureSizeCache(self._context)
+        self.assertEqual(list(cache.getStructuresOfSize(16)), [0x1010, 0x1040, 0x1080])
+        self.assertEqual(list(cache.getStructuresOfSize(48)), [0x1050])
+        self.assertEqual(list(cache.getStructuresOfSize(8)), [])
+        self.assertEqual([(size, list(addrs)) for size, addrs in cache],
+                         [(16, [0x1010, 0x1040, 0x1080]), (32, [0x1020]), (48, [0x1050])])
+        # reloaded from the index file
+        fname = config.get_cache_filename(config.CACHE_SIGNATURE_SIZES_INDEX, self.dumpname, 0x1000)
+        self.assertTrue(os.access(fname + '.npy', os.F_OK))
+        self.assertTrue(cache._loadCache())
+        cache = signature.StructureSizeCache(self._context)
+        self.assertEqual(list(cache.getSizes()), [16, 32, 48])
+        self.assertEqual(list(cache.getStructuresOfSize(32)), [0x1020])
+        # the allocations changed, the index is made again
+        self._context._structures_addresses = self._context._structures_addresses[:3]
+        self._context._structures_sizes = self._context._structures_sizes[:3]
+        self.assertFalse(cache._loadCache())
+        cache = signature.StructureSizeCache(self._context)
+        self.assertEqual(list(cache.getSizes()), [16, 32])
+        self.assertEqual(list(cache.getStructuresOfSize(16)), [0x1010, 0x1040])
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     # logging.getLogger("reversers").setLevel(logging.DEBUG)
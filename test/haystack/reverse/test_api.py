@@ -1,6 +1,9 @@
 from __future__ import print_function
 
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 
 from haystack.mappings import folder
@@ -42,6 +45,29 @@ class TestReverseApi(unittest.TestCase):
             print(p.to_string())
         pass
 
+class TestTypeLibraryOption(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_type_library(self):
+        env = os.environ.pop(config.TYPE_LIBRARY_ENV, None)
+        try:
+            # no library unless one is asked for
+            self.assertIsNone(api.get_type_library())
+            library = api.get_type_library(self.folder)
+            self.assertEqual(len(library), 0)
+            os.environ[config.TYPE_LIBRARY_ENV] = self.folder
+            self.assertIsNotNone(api.get_type_library())
+        finally:
+            os.environ.pop(config.TYPE_LIBRARY_ENV, None)
+            if env is not None:
+                os.environ[config.TYPE_LIBRARY_ENV] = env
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     # logging.getLogger("listmodel").setLevel(logging.DEBUG)
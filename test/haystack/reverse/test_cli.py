@@ -1,6 +1,11 @@
 from __future__ import print_function
 
+import argparse
+import io
+import json
 import logging
+import shutil
+import tempfile
 import unittest
 import sys
 try:
@@ -10,6 +15,7 @@ except ImportError:
 
 from haystack.reverse import cli
 from haystack.reverse import config
+from test.haystack.reverse import fakes
 
 log = logging.getLogger("test_reverse_cli")
 
@@ -54,6 +60,56 @@ class TestReverseBasic(unittest.TestCase):
             # not exception
 
 
+class TestQueryCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        self.memory_handler = fakes.make_reversed_dump(self.dumpname)
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def _run(self, func, addresses, lines=None, as_json=False):
+        fin = None
+        if lines is not None:
+            fin = io.StringIO(u''.join(u'%s\n' % line for line in lines))
+        args = argparse.Namespace(addresses=addresses, file=fin, json=as_json, socket=None)
+        with mock.patch.object(cli, '_make_memory_handler', return_value=self.memory_handler):
+            with mock.patch.object(sys, 'stdout', new_callable=io.StringIO) as stdout:
+                func(args)
+        return stdout.getvalue()
+
+    def test_iter_addresses(self):
+        fin = io.StringIO(u'0x10\n# comment\n\n0x20\n0x30\n')
+        args = argparse.Namespace(addresses=[0x1, 0x2], file=fin)
+        self.assertEqual(list(cli._iter_addresses(args, batch_size=2)), [[0x1, 0x2], [0x10, 0x20], [0x30]])
+        with mock.patch.object(sys, 'stdin', io.StringIO(u'0x40\n')):
+            args = argparse.Namespace(addresses=[], file=None)
+            self.assertEqual(list(cli._iter_addresses(args)), [[0x40]])
+
+    def test_hex(self):
+        # single address output is unchanged
+        self.assertEqual(self._run(cli.show_hex, [0x1044]), '%r\n' % bytes(bytearray(range(0x40, 0x50))))
+        out = self._run(cli.show_hex, [0x1044], lines=['0x9000'], as_json=True)
+        res = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(res[0], {'address': '0x1044', 'record': '0x1040', 'bytes': '404142434445464748494a4b4c4d4e4f'})
+        self.assertEqual(res[1], {'address': '0x9000', 'record': None, 'bytes': None})
+        out = self._run(cli.show_hex, [0xffff800000001000], as_json=True)
+        self.assertEqual(json.loads(out), {'address': '0xffff800000001000', 'record': None, 'bytes': None})
+
+    def test_show(self):
+        out = self._run(cli.reverse_show_cmdline, [0x1011, 0x9000])
+        self.assertIn('# 0x1011\n', out)
+        self.assertIn('struct_1010', out)
+        self.assertTrue(out.endswith('# 0x9000\nNone\n'))
+
+    def test_parents(self):
+        out = self._run(cli.show_predecessors_cmdline, [], lines=['0x1044', '0x8000'], as_json=True)
+        res = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(res[0]['parents'], ['0x1010', '0x8000'])
+        self.assertEqual(res[1]['parents'], [])
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     unittest.main(verbosity=2)
@@ -4,14 +4,21 @@
 """Tests haystack.utils ."""
 
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 
 from haystack.mappings import folder
 from haystack.reverse import config
 from haystack.reverse import context
 from haystack.reverse import fieldtypes
+from haystack.reverse import recordtable
 from haystack.reverse import structure
+from haystack.reverse import utils
 from test.haystack import SrcTests
+from test.haystack.reverse import bench_startup
+from test.haystack.reverse import fakes
 
 log = logging.getLogger('test_memory_mapping')
 
@@ -73,6 +80,148 @@ class TestMappingsWindows(SrcTests):
         self.assertEqual(heap_address,self.memory_handler.get_mapping_for_address(0x005c0000).start)
 
 
+class TestHeapRangeIndex(unittest.TestCase):
+
+    def test_get_ids(self):
+        # unsorted heaps
+        index = context.HeapRangeIndex([0x9000, 0x1000, 0x4000], [0xa000, 0x2000, 0x6000])
+        self.assertEqual(len(index), 3)
+        addresses = [0x0, 0x1000, 0x1fff, 0x2000, 0x5000, 0x9fff, 0xa000, 0xffffffffffff0000]
+        expected = [context.NO_CONTEXT, 1, 1, context.NO_CONTEXT, 2, 0, context.NO_CONTEXT, context.NO_CONTEXT]
+        self.assertEqual(index.get_ids(addresses).tolist(), expected)
+        self.assertEqual([index.get_id(addr) for addr in addresses], expected)
+
+    def test_empty(self):
+        index = context.HeapRangeIndex([], [])
+        self.assertEqual(index.get_ids([0x1000]).tolist(), [context.NO_CONTEXT])
+        self.assertEqual(index.get_id(0x1000), context.NO_CONTEXT)
+        self.assertEqual(index.get_ids([]).tolist(), [])
+
+
+def make_memory_handler(dumpname, walkers):
+    """Heaps of 0x1000 bytes"""
+    mappings = [fakes.FakeMapping(walker.get_heap_address(), bytes(0x1000)) for walker in walkers]
+    return fakes.FakeMemoryHandler(dumpname, mappings, walkers)
+
+
+def save_heap_pointers(dumpname, heap_address):
+    """cache the heap pointers, they are not searched"""
+    utils.int_array_save(config.get_cache_filename(config.CACHE_HEAP_ADDRS, dumpname, heap_address),
+                         [heap_address + 0x10])
+    utils.int_array_save(config.get_cache_filename(config.CACHE_HEAP_VALUES, dumpname, heap_address),
+                         [heap_address + 0x20])
+
+
+class TestHeapContextWalker(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        config.create_cache_folder(self.dumpname)
+        self.walker = fakes.FakeWalker(0x1000)
+        self.memory_handler = make_memory_handler(self.dumpname, [self.walker])
+        save_heap_pointers(self.dumpname, 0x1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_lazy_walker(self):
+        ctx = context.HeapContext(self.memory_handler, self.walker)
+        # allocations are not cached, the walker given at creation is used
+        self.assertEqual(self.walker.nb_walks, 1)
+        self.assertEqual(list(ctx._structures_addresses), [0x1010])
+        self.assertEqual(list(ctx._pointers_values), [0x1020])
+        self.assertEqual(self.memory_handler.finder.nb_opened, 0)
+        # everything is cached now, the walker is not opened
+        ctx.__setstate__(ctx.__getstate__())
+        ctx.memory_handler = self.memory_handler
+        ctx._init2()
+        self.assertEqual(self.walker.nb_walks, 1)
+        self.assertEqual(self.memory_handler.finder.nb_opened, 0)
+        self.assertEqual(list(ctx._structures_sizes), [0x10])
+        # opened once, on demand
+        self.assertIs(ctx.walker, self.walker)
+        self.assertIs(ctx.get_heap_walker(), self.walker)
+        self.assertEqual(self.memory_handler.finder.nb_opened, 1)
+
+    def test_lazy_record(self):
+        ctx = context.HeapContext(self.memory_handler, self.walker)
+        config.create_record_cache_folder(self.dumpname)
+        with open(structure.make_filename_from_addr(ctx, 0x1010), 'wb') as fout:
+            fout.write(b'not loaded')
+        _record = ctx.get_record_for_address(0x1010)
+        self.assertIsInstance(_record, structure.CacheWrapper)
+        # the records cache is not listed for one record
+        self.assertEqual(list(ctx._structures.keys()), [0x1010])
+        self.assertIs(ctx.get_record_for_address(0x1010), _record)
+
+    def test_removed_record_is_dirty(self):
+        ctx = context.HeapContext(self.memory_handler, self.walker)
+        config.create_record_cache_folder(self.dumpname)
+        table = ctx.get_record_table()
+        table.table[recordtable.REVERSE_LEVEL, 0] = 50
+        table.table[recordtable.DIRTY, 0] = 0
+        # a corrupt pickle is removed
+        with open(structure.make_filename_from_addr(ctx, 0x1010), 'wb') as fout:
+            pass
+        _record = ctx.get_record_for_address(0x1010)
+        with self.assertRaises(EOFError):
+            len(_record)
+        self.assertEqual(table.get_dirty_count(), 1)
+        # the record is selected to be reversed again
+        self.assertEqual(recordtable.RecordTable.load(ctx).select(max_reverse_level=10).tolist(), [0x1010])
+
+
+class TestContextStartup(unittest.TestCase):
+    """Loads the contexts of a generated folder dump of 4 heaps, as bench_startup"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.dumpname = os.path.sep.join([self.folder, 'dump'])
+        bench_startup.make_dump(self.dumpname, 0x40000, heap_size=0x10000, nb_queries=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_cache_load(self):
+        times, opened = bench_startup.time_contexts(self.dumpname, repeat=2)
+        self.assertEqual(len(times), 2)
+        # contexts loaded from the cache do not open the heap walkers
+        self.assertEqual(opened, [0, 0])
+
+
+class TestLazyProcessContext(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        self.walkers = [fakes.FakeWalker(0x1000), fakes.FakeWalker(0x8000)]
+        self.memory_handler = make_memory_handler(self.dumpname, self.walkers)
+        config.create_cache_folder(self.dumpname)
+        for walker in self.walkers:
+            save_heap_pointers(self.dumpname, walker.get_heap_address())
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_lazy_contextes(self):
+        process_context = context.ProcessContext(self.memory_handler)
+        self.assertEqual([w.nb_walks for w in self.walkers], [0, 0])
+        # only the heap hosting the address is made
+        ctx = process_context.get_context_for_address(0x8010)
+        self.assertEqual(ctx._heap_start, 0x8000)
+        self.assertEqual([w.nb_walks for w in self.walkers], [0, 1])
+        self.assertIs(process_context.get_context_for_address(0x8fff), ctx)
+        with self.assertRaises(ValueError):
+            process_context.get_context_for_address(0x2000)
+        self.assertEqual(process_context.get_context_ids_for_addresses([0x1010, 0x8010, 0x2000]).tolist(),
+                         [0, 1, context.NO_CONTEXT])
+        self.assertEqual([w.nb_walks for w in self.walkers], [0, 1])
+        # iteration makes them all
+        contextes = process_context.list_contextes()
+        self.assertEqual([c._heap_start for c in contextes], [0x1000, 0x8000])
+        self.assertIs(contextes[1], ctx)
+        self.assertEqual([w.nb_walks for w in self.walkers], [1, 1])
+
+
 class TestProcessContext(unittest.TestCase):
 
     @classmethod
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.csrgraph ."""
+
+import logging
+import unittest
+
+import networkx
+import numpy
+
+from haystack.reverse import csrgraph
+
+log = logging.getLogger('test_csrgraph')
+
+
+class TestCSRGraph(unittest.TestCase):
+
+    def setUp(self):
+        # a chain 1->2->3->4, a triangle 10->11->12->10, a copy 20->21->22->20,
+        # a pair 30->31 and an isolated node 40
+        sources = [1, 2, 3, 10, 11, 12, 20, 21, 22, 30, 1]
+        targets = [2, 3, 4, 11, 12, 10, 21, 22, 20, 31, 2]
+        self.graph = csrgraph.CSRGraph.from_edges(sources, targets, nodes=[40])
+
+    def test_build(self):
+        self.assertEqual(len(self.graph), 13)
+        # duplicated edge 1->2 removed
+        self.assertEqual(self.graph.number_of_edges(), 10)
+        self.assertEqual(list(self.graph.successors(1)), [2])
+        self.assertEqual(list(self.graph.predecessors(10)), [12])
+        self.assertEqual(list(self.graph.successors(40)), [])
+        with self.assertRaises(ValueError):
+            self.graph.successors(5)
+
+    def test_degrees(self):
+        indexes, degrees = self.graph.top_in_degree(1)
+        self.assertEqual(list(degrees), [1])
+        # ties are ranked by address
+        self.assertEqual(list(self.graph.nodes[indexes]), [2])
+        self.assertEqual(int(self.graph.out_degree().sum()), 10)
+        self.assertEqual(list(self.graph.nodes[self.graph.isolates()]), [40])
+
+    def test_connected_components(self):
+        components, sizes = self.graph.connected_components()
+        self.assertEqual(list(sizes), [4, 3, 3, 2, 1])
+        self.assertEqual(list(self.graph.nodes[self.graph.component_nodes(0)]), [1, 2, 3, 4])
+        self.assertEqual(components[self.graph.get_indexes([30])[0]], 3)
+
+    def test_connected_components_networkx(self):
+        rng = numpy.random.RandomState(42)
+        sources = rng.randint(0, 2000, 1500)
+        targets = rng.randint(0, 2000, 1500)
+        graph = csrgraph.CSRGraph.from_edges(sources, targets)
+        components, sizes = graph.connected_components()
+        nxgraph = networkx.Graph()
+        nxgraph.add_edges_from(zip(sources.tolist(), targets.tolist()))
+        expected = sorted((len(c) for c in networkx.connected_components(nxgraph)), reverse=True)
+        self.assertEqual(list(sizes), expected)
+
+    def test_neighbourhood(self):
+        root = self.graph.get_indexes([1])
+        reached, distance = self.graph.neighbourhood(root, 2)
+        self.assertEqual(list(self.graph.nodes[reached]), [1, 2, 3])
+        self.assertEqual(list(distance), [0, 1, 2])
+        sources, targets = self.graph.neighbourhood_edges(root, 2)
+        edges = sorted(zip(self.graph.nodes[sources].tolist(), self.graph.nodes[targets].tolist()))
+        self.assertEqual(edges, [(1, 2), (2, 3)])
+
+    def test_isomorphic_candidates(self):
+        groups = self.graph.isomorphic_candidates(min_size=3)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(sorted(groups[0]), [1, 2])
+        # the chain and the triangle are not candidates
+        hashes = self.graph.component_hashes()
+        self.assertEqual(hashes[1], hashes[2])
+        self.assertNotEqual(hashes[0], hashes[1])
+
+    def test_undirected_isomorphic_candidates(self):
+        # 4 nodes paths a->b->c->d, a->b<-c->d, and a->b->c<->d
+        sources = [1, 2, 3, 10, 12, 12, 20, 21, 22, 23]
+        targets = [2, 3, 4, 11, 11, 13, 21, 22, 23, 22]
+        graph = csrgraph.CSRGraph.from_edges(sources, targets)
+        nxgraph = networkx.DiGraph()
+        nxgraph.add_edges_from(zip(sources, targets))
+        paths = [networkx.Graph(nxgraph.subgraph(nodes)) for nodes in [[1, 2, 3, 4], [10, 11, 12, 13],
+                                                                       [20, 21, 22, 23]]]
+        self.assertTrue(networkx.is_isomorphic(paths[0], paths[1]))
+        self.assertTrue(networkx.is_isomorphic(paths[0], paths[2]))
+        self.assertEqual(graph.isomorphic_candidates(min_size=4), [])
+        groups = graph.isomorphic_candidates(min_size=4, directed=False)
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(sorted(groups[0]), [0, 1, 2])
+        hashes = graph.component_hashes(directed=False)
+        self.assertEqual(len(set(hashes.tolist())), 1)
+        # a triangle is not a path
+        graph = csrgraph.CSRGraph.from_edges(sources + [30, 31, 32, 32], targets + [31, 32, 30, 33])
+        self.assertEqual(len(graph.isomorphic_candidates(min_size=4, directed=False)[0]), 3)
+
+    def test_from_networkx(self):
+        digraph = networkx.DiGraph()
+        digraph.add_edges_from([('0x10', '0x20'), ('0x20', '0x30')])
+        digraph.add_node('0x40')
+        graph = csrgraph.CSRGraph.from_networkx(digraph)
+        self.assertEqual(len(graph), 4)
+        sources, targets = graph.neighbourhood_edges(graph.get_indexes([0x10]), 1)
+        self.assertEqual(graph.get_labels(targets), ['0x20'])
+        sub = graph.subgraph(graph.get_indexes([0x10, 0x20]))
+        self.assertEqual(sub.number_of_edges(), 1)
+        self.assertEqual(sub.get_labels([0, 1]), ['0x10', '0x20'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
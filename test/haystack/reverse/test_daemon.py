@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.daemon ."""
+
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from haystack.reverse import cli
+from haystack.reverse import stringtable
+from test.haystack.reverse import fakes
+
+# the daemon uses asyncio
+HAS_ASYNCIO = sys.version_info >= (3, 5)
+if HAS_ASYNCIO:
+    from haystack.reverse import daemon
+
+log = logging.getLogger('test_daemon')
+
+
+@unittest.skipIf(not HAS_ASYNCIO, 'the daemon requires Python 3.5')
+class TestQueryService(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        self.memory_handler = fakes.make_reversed_dump(self.dumpname)
+        content = bytearray(0x100)
+        content[0x44:0x4c] = b'a string'
+        table = stringtable.StringTable.build(bytes(content), 0x1000, [0x1010, 0x1040], [0x20, 0x10])
+        table.save(self.dumpname, 0x1000)
+        self.service = daemon.QueryService(self.memory_handler, cache_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_query(self):
+        res = self.service.query('hex', 0x1044)
+        self.assertEqual(res, {'record': '0x1040', 'bytes': '404142434445464748494a4b4c4d4e4f'})
+        res = self.service.query('show', 0x1011)
+        self.assertEqual(res['record'], '0x1010')
+        self.assertIn('struct_1010', res['text'])
+        self.assertEqual(self.service.query('parents', 0x1040)['parents'], ['0x1010', '0x8000'])
+        res = self.service.query('type', 0x8010)
+        self.assertEqual(res['record'], '0x8000')
+        self.assertEqual(res['size'], 0x100)
+        res = self.service.query('strings', 0x1040)
+        self.assertEqual(res['strings'], [{'address': '0x1044', 'value': 'a string'}])
+        self.assertIsNone(self.service.query('strings', 0x8000)['strings'])
+        self.assertEqual(self.service.query('hex', 0x9000), {'record': None, 'bytes': None})
+        with self.assertRaises(ValueError):
+            self.service.query('reverse', 0x1040)
+
+    def test_record_cache(self):
+        _record = self.service.get_record(0x1044)
+        self.assertIs(self.service.get_record(0x1040), _record)
+        self.service.get_record(0x1010)
+        self.service.get_record(0x8000)
+        self.assertEqual(len(self.service._records), 2)
+
+    def test_answer(self):
+        res = json.loads(self.service.answer(b'{"command": "parents", "address": "0x1044"}\n').decode('utf-8'))
+        self.assertEqual(res, {'address': '0x1044', 'record': '0x1040', 'parents': ['0x1010', '0x8000']})
+        for line in [b'not json', b'{"command": "show"}', b'{"command": "show", "address": "zz"}']:
+            res = json.loads(self.service.answer(line).decode('utf-8'))
+            self.assertIn('error', res)
+        res = json.loads(self.service.answer(b'{"command": "show", "address": "0xffffffffffffffff"}').decode('utf-8'))
+        self.assertIsNone(res['record'])
+
+    def test_answer_bytes(self):
+        # like json.loads before Python 3.6
+        def loads(s, _loads=json.loads):
+            if not isinstance(s, str):
+                raise TypeError('the JSON object must be str, not %r' % s.__class__.__name__)
+            return _loads(s)
+        with mock.patch.object(daemon.json, 'loads', side_effect=loads):
+            res = json.loads(self.service.answer(b'{"command": "hex", "address": "0x1044"}\n').decode('utf-8'))
+        self.assertEqual(res['record'], '0x1040')
+        res = json.loads(self.service.answer(b'\xff\n').decode('utf-8'))
+        self.assertIn('error', res)
+
+
+@unittest.skipIf(not HAS_ASYNCIO, 'the daemon requires Python 3.5')
+class TestQueryServer(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        self.socket_path = os.path.sep.join([self.dumpname, 'daemon.sock'])
+        service = daemon.QueryService(fakes.make_reversed_dump(self.dumpname))
+        self.server = daemon.QueryServer(service, self.socket_path)
+        self.thread = threading.Thread(target=self.server.run)
+        self.thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.socket_path))
+        shutil.rmtree(self.dumpname)
+
+    def test_socket_mode(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+    def test_refuse_start(self):
+        # a daemon is listening
+        server = daemon.QueryServer(self.server.service, self.socket_path)
+        with self.assertRaises(IOError):
+            server.run()
+        self.assertTrue(os.path.exists(self.socket_path))
+        # not a socket
+        fname = os.path.sep.join([self.dumpname, 'not_a_socket'])
+        with open(fname, 'w') as fout:
+            fout.write('keep me')
+        with self.assertRaises(IOError):
+            daemon.QueryServer(self.server.service, fname).run()
+        with open(fname) as fin:
+            self.assertEqual(fin.read(), 'keep me')
+
+    def test_stale_socket(self):
+        stale_path = os.path.sep.join([self.dumpname, 'stale.sock'])
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(stale_path)
+        stale.close()
+        daemon._remove_stale_socket(stale_path)
+        self.assertFalse(os.path.exists(stale_path))
+
+    def test_clients(self):
+        clients = [daemon.QueryClient(self.socket_path) for _ in range(2)]
+        try:
+            self.assertEqual(clients[0].query('hex', 0x1044)['record'], '0x1040')
+            self.assertEqual(clients[1].query('parents', 0x1044)['parents'], ['0x1010', '0x8000'])
+            self.assertEqual(clients[0].query('show', 0x9000)['record'], None)
+            with self.assertRaises(ValueError):
+                clients[1].query('reverse', 0x1044)
+            # the connection is still usable
+            self.assertEqual(clients[1].query('hex', 0xffffffffffffffff)['record'], None)
+        finally:
+            for client in clients:
+                client.close()
+
+    def test_cli_client(self):
+        args = argparse.Namespace(addresses=[0x1044, 0x9000], file=None, json=True, socket=self.socket_path)
+        with mock.patch.object(cli.cli, 'make_memory_handler', side_effect=AssertionError('no dump is loaded')):
+            with mock.patch.object(sys, 'stdout', new_callable=io.StringIO) as stdout:
+                cli.show_hex(args)
+        res = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(res[0], {'address': '0x1044', 'record': '0x1040', 'bytes': '404142434445464748494a4b4c4d4e4f'})
+        self.assertEqual(res[1], {'address': '0x9000', 'record': None, 'bytes': None})
+        # text output is the same as without the daemon
+        args = argparse.Namespace(addresses=[0x1044], file=None, json=False, socket=self.socket_path)
+        with mock.patch.object(sys, 'stdout', new_callable=io.StringIO) as stdout:
+            cli.show_predecessors_cmdline(args)
+        self.assertTrue(stdout.getvalue().startswith('#0x1010\n'))
+        self.assertIn('#0x8000\n', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.diff ."""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from haystack.reverse import diff
+
+log = logging.getLogger('test_diff')
+
+
+def cmp_reference(content1, content2, base_address=0):
+    """the addresses of all changed bytes, like cmp -l"""
+    res = [base_address + i for i, (a, b) in enumerate(zip(content1, content2)) if a != b]
+    common = min(len(content1), len(content2))
+    res.extend(base_address + i for i in range(common, max(len(content1), len(content2))))
+    return res
+
+
+def expand(starts, ends):
+    res = []
+    for start, end in zip(starts, ends):
+        res.extend(range(start, end))
+    return res
+
+
+class TestDiffContents(unittest.TestCase):
+
+    def test_no_changes(self):
+        content = numpy.arange(100, dtype=numpy.uint8)
+        starts, ends = diff.diff_contents(content, content.copy())
+        self.assertEqual(len(starts), 0)
+        self.assertEqual(len(ends), 0)
+
+    def test_ranges(self):
+        content1 = numpy.zeros(32, dtype=numpy.uint8)
+        content2 = content1.copy()
+        content2[0] = 1
+        content2[4:8] = 1
+        content2[31] = 1
+        starts, ends = diff.diff_contents(content1, content2, 0x1000)
+        self.assertEqual(list(starts), [0x1000, 0x1004, 0x101f])
+        self.assertEqual(list(ends), [0x1001, 0x1008, 0x1020])
+
+    def test_coalesce_across_chunks(self):
+        content1 = numpy.zeros(64, dtype=numpy.uint8)
+        content2 = content1.copy()
+        # a run over three chunks of 8 bytes
+        content2[6:20] = 1
+        content2[24] = 1
+        starts, ends = diff.diff_contents(content1, content2, 0, chunk_size=8)
+        self.assertEqual(list(starts), [6, 24])
+        self.assertEqual(list(ends), [20, 25])
+
+    def test_different_lengths(self):
+        content1 = numpy.zeros(16, dtype=numpy.uint8)
+        content2 = numpy.zeros(20, dtype=numpy.uint8)
+        content2[15] = 1
+        starts, ends = diff.diff_contents(content1, content2, 0, chunk_size=4)
+        # the changed last byte is coalesced with the tail
+        self.assertEqual(list(starts), [15])
+        self.assertEqual(list(ends), [20])
+        starts, ends = diff.diff_contents(content2, content1[:8], 0, chunk_size=4)
+        self.assertEqual(list(starts), [8])
+        self.assertEqual(list(ends), [20])
+
+    def test_random(self):
+        rng = numpy.random.RandomState(0)
+        for chunk_size in [1, 3, 64, 1000]:
+            content1 = rng.randint(0, 4, size=997).astype(numpy.uint8)
+            content2 = content1.copy()
+            changed = rng.randint(0, 997, size=200)
+            content2[changed] += 1
+            content2 = content2[:rng.randint(900, 997)]
+            starts, ends = diff.diff_contents(content1, content2, 0x100, chunk_size)
+            self.assertEqual(expand(starts, ends), cmp_reference(content1, content2, 0x100))
+            # coalesced
+            self.assertTrue((starts[1:] > ends[:-1]).all())
+
+
+class TestDiffFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, content):
+        filename = os.path.sep.join([self.folder, name])
+        with open(filename, 'wb') as fout:
+            fout.write(content)
+        return filename
+
+    def test_diff_files(self):
+        f1 = self._write('heap1', b'\x00' * 0x100 + b'ABCD' + b'\x00' * 0x100)
+        f2 = self._write('heap2', b'\x00' * 0x100 + b'AXYD' + b'\x00' * 0x100)
+        starts, ends = diff.diff_files(f1, f2, 0x8000)
+        self.assertEqual(list(starts), [0x8101])
+        self.assertEqual(list(ends), [0x8103])
+
+    def test_empty_file(self):
+        f1 = self._write('heap1', b'')
+        f2 = self._write('heap2', b'AB')
+        starts, ends = diff.diff_files(f1, f2)
+        self.assertEqual(list(starts), [0])
+        self.assertEqual(list(ends), [2])
+
+    def test_diff_mappings(self):
+        class FakeMapping(object):
+            def __init__(self, filename):
+                self._memdumpname = filename
+                self.start = 0x1000
+        f1 = self._write('heap1', b'ABCDEFGH')
+        f2 = self._write('heap2', b'AXCDEYYH')
+        starts, ends = diff.diff_mappings(FakeMapping(f1), FakeMapping(f2))
+        self.assertEqual(expand(starts, ends), [0x1001, 0x1005, 0x1006])
+
+
+class TestChangedRecords(unittest.TestCase):
+
+    def test_changed_records(self):
+        addresses = [0x100, 0x110, 0x120, 0x140]
+        sizes = [0x10, 0x10, 0x10, 0x10]
+        # a range over two records, a range in a gap, a range in the last one
+        starts = [0x10c, 0x134, 0x144, 0x14f]
+        ends = [0x114, 0x138, 0x146, 0x150]
+        indexes, counts = diff.changed_records(starts, ends, addresses, sizes)
+        self.assertEqual(list(indexes), [0, 1, 3])
+        self.assertEqual(list(counts), [4, 4, 3])
+
+    def test_empty(self):
+        indexes, counts = diff.changed_records([], [], [0x100], [0x10])
+        self.assertEqual(len(indexes), 0)
+        indexes, counts = diff.changed_records([0x100], [0x101], [], [])
+        self.assertEqual(len(counts), 0)
+
+    def test_random(self):
+        rng = numpy.random.RandomState(1)
+        sizes = rng.randint(1, 64, size=500)
+        gaps = rng.randint(0, 16, size=500)
+        addresses = 0x10000 + numpy.cumsum(sizes + gaps) - sizes
+        changed = numpy.zeros(addresses[-1] + sizes[-1] + 0x100, dtype=numpy.uint8)
+        changed[rng.randint(0x10000, len(changed), size=3000)] = 1
+        starts, ends = diff.diff_contents(numpy.zeros_like(changed), changed)
+        indexes, counts = diff.changed_records(starts, ends, addresses, sizes)
+        expected = [(i, changed[a:a + s].sum()) for i, (a, s) in enumerate(zip(addresses, sizes))
+                    if changed[a:a + s].sum() > 0]
+        self.assertEqual(list(zip(indexes, counts)), expected)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
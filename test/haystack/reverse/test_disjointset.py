@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.disjointset ."""
+
+import logging
+import random
+import unittest
+
+from haystack.reverse import disjointset
+
+log = logging.getLogger('test_disjointset')
+
+
+class TestDisjointSet(unittest.TestCase):
+
+    def test_union(self):
+        ds = disjointset.DisjointSet(6)
+        self.assertTrue(ds.union(0, 1))
+        self.assertTrue(ds.union(3, 1))
+        self.assertFalse(ds.union(0, 3))
+        self.assertTrue(ds.connected(0, 3))
+        self.assertFalse(ds.connected(0, 2))
+        self.assertEqual(ds.set_size(1), 3)
+        self.assertEqual(ds.groups(), [[0, 1, 3], [2], [4], [5]])
+        self.assertEqual(ds.groups(min_size=2), [[0, 1, 3]])
+
+    def test_add(self):
+        ds = disjointset.DisjointSet()
+        self.assertEqual(len(ds), 0)
+        self.assertEqual(ds.add(), 0)
+        self.assertEqual(ds.add(), 1)
+        self.assertEqual(ds.union_pairs([(0, 1), (1, 0)]), 1)
+        self.assertEqual(ds.groups(), [[0, 1]])
+
+    def test_random(self):
+        # compare with a naive labelling
+        rng = random.Random(1)
+        nb = 500
+        pairs = [(rng.randrange(nb), rng.randrange(nb)) for _ in range(300)]
+        ds = disjointset.DisjointSet(nb)
+        ds.union_pairs(pairs)
+        labels = list(range(nb))
+        for i, j in pairs:
+            old, new = labels[i], labels[j]
+            labels = [new if label == old else label for label in labels]
+        expected = {}
+        for i, label in enumerate(labels):
+            expected.setdefault(label, []).append(i)
+        self.assertEqual(ds.groups(), sorted(expected.values()))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.graphindex ."""
+
+import logging
+import shutil
+import tempfile
+import unittest
+
+from haystack.reverse import config
+from haystack.reverse import graphindex
+
+log = logging.getLogger('test_graphindex')
+
+
+class TestPredecessorIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        config.create_cache_folder(self.dumpname)
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_get_predecessors(self):
+        sources = [0x1000, 0x2000, 0x3000, 0x1000, 0x2000, 0x1000]
+        targets = [0x2000, 0x3000, 0x3000, 0x3000, 0x3000, 0x2000]
+        # one duplicated edge 0x1000->0x2000 and 0x2000->0x3000
+        nb = graphindex.save_predecessors_index(self.dumpname, sources, targets)
+        self.assertEqual(nb, 4)
+        index = graphindex.PredecessorIndex(self.dumpname)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(list(index.get_predecessors(0x3000)), [0x1000, 0x2000, 0x3000])
+        self.assertEqual(list(index.get_predecessors(0x2000)), [0x1000])
+        self.assertEqual(list(index.get_predecessors(0x1000)), [])
+        self.assertEqual(list(index.get_predecessors(0x4000)), [])
+        self.assertEqual(index.count_predecessors(0x3000), 3)
+
+    def test_empty(self):
+        graphindex.save_predecessors_index(self.dumpname, [], [])
+        index = graphindex.PredecessorIndex(self.dumpname)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(list(index.get_predecessors(0x1000)), [])
+
+    def test_missing(self):
+        with self.assertRaises(IOError):
+            graphindex.PredecessorIndex(self.dumpname)
+
+    def test_bad_lengths(self):
+        with self.assertRaises(ValueError):
+            graphindex.save_predecessors_index(self.dumpname, [1, 2], [1])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
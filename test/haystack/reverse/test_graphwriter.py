@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.graphwriter ."""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import networkx
+
+from haystack.reverse import graphwriter
+from haystack.reverse import utils
+
+log = logging.getLogger('test_graphwriter')
+
+
+class TestGraphWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.nodes = [0x1000, 0x2000, 0x1000, 0x3000]
+        self.heaps = graphwriter.NodeAttribute('heap', [0x100, 0x200, -1, -1], '0x%x')
+        self.weights = graphwriter.NodeAttribute('weight', [8, 16, 24, -1])
+        # one duplicated edge, one edge to an undeclared node
+        self.sources = [0x1000, 0x1000, 0x2000, 0x3000]
+        self.targets = [0x2000, 0x2000, 0x3000, 0x4000]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_graph(self, graph):
+        self.assertEqual(len(graph), 4)
+        self.assertEqual(graph.number_of_edges(), 3)
+        self.assertTrue(graph.has_edge('0x1000', '0x2000'))
+        self.assertTrue(graph.has_edge('0x3000', '0x4000'))
+        self.assertEqual(graph.nodes['0x1000']['heap'], '0x100')
+        # last valid value wins
+        self.assertEqual(graph.nodes['0x1000']['weight'], 24)
+        self.assertNotIn('weight', graph.nodes['0x3000'])
+
+    def test_write_gexf(self):
+        fname = os.path.join(self.tmpdir, 'graph.gexf')
+        nb_nodes, nb_edges = graphwriter.write_gexf(fname, self.nodes, self.sources, self.targets,
+                                                    [self.heaps, self.weights], chunk_size=2)
+        self.assertEqual((nb_nodes, nb_edges), (4, 3))
+        self._check_graph(networkx.read_gexf(fname))
+
+    def test_write_gexf_compressed(self):
+        fname = os.path.join(self.tmpdir, 'graph.gexf')
+        graphwriter.write_gexf(fname, self.nodes, self.sources, self.targets,
+                               [self.heaps, self.weights], compress=True)
+        self.assertFalse(os.access(fname, os.F_OK))
+        self._check_graph(networkx.read_gexf(fname + '.gz'))
+
+    def test_write_graphml(self):
+        fname = os.path.join(self.tmpdir, 'graph.graphml')
+        graphwriter.write_graphml(fname, self.nodes, self.sources, self.targets, [self.heaps, self.weights])
+        self._check_graph(networkx.read_graphml(fname))
+
+    def test_write_empty(self):
+        fname = os.path.join(self.tmpdir, 'graph.gexf')
+        self.assertEqual(graphwriter.write_gexf(fname, [], [], []), (0, 0))
+        self.assertEqual(len(networkx.read_gexf(fname)), 0)
+
+
+class TestArrayBuilder(unittest.TestCase):
+
+    def test_append(self):
+        builder = utils.ArrayBuilder(chunk_size=3)
+        for i in range(10):
+            builder.append(i)
+        self.assertEqual(len(builder), 10)
+        self.assertEqual(list(builder.to_array()), list(range(10)))
+        self.assertEqual(list(builder.to_array(4, 6)), [4, 5])
+        builder.append(10)
+        self.assertEqual(list(builder.to_array(8)), [8, 9, 10])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
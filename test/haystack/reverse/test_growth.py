@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.growth ."""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from haystack.reverse import config
+from haystack.reverse import growth
+from haystack.reverse import utils
+from test.haystack.reverse import fakes
+
+log = logging.getLogger('test_growth')
+
+
+def make_snapshot(dumpname, heaps):
+    """heaps: dict of heap address to list of (size, type name or None, or False for a dirty row)"""
+    config.create_cache_folder(dumpname)
+    for heap_addr, records in heaps.items():
+        sizes = [size for size, _ in records]
+        addresses = [heap_addr + 0x100 * i for i in range(len(records))]
+        utils.int_array_save(config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, dumpname, heap_addr), sizes)
+        heap_context = fakes.FakeHeapContext(dumpname, addresses, sizes, heap_start=heap_addr)
+        table = heap_context.get_record_table()
+        for address, (size, name) in zip(addresses, records):
+            if name is not False:
+                table.update(fakes.FakeRecord(address, size, 50, 'u%d' % size, name))
+        table.save(heap_context)
+
+
+class TestGrowth(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.dumps = [os.path.sep.join([self.folder, 'dump%d' % i]) for i in range(3)]
+        # list_node leaks, buffer is stable, a 24 bytes untyped allocation grows
+        make_snapshot(self.dumps[0], {0x1000: [(16, 'list_node'), (64, 'buffer'), (24, None)]})
+        make_snapshot(self.dumps[1], {0x1000: [(16, 'list_node'), (16, 'list_node'), (64, 'buffer')],
+                                      0x9000: [(24, None), (24, None)]})
+        make_snapshot(self.dumps[2], {0x1000: [(16, 'list_node'), (16, 'list_node'), (64, 'buffer')],
+                                      0x9000: [(16, 'list_node'), (24, None), (24, None), (24, None)]})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_list_heaps(self):
+        self.assertEqual(growth.list_heaps(self.dumps[1]), [0x1000, 0x9000])
+
+    def test_snapshot(self):
+        snapshot = growth.Snapshot(self.dumps[2])
+        self.assertEqual(len(snapshot), 7)
+        sizes, counts, totals = snapshot.count_per_size()
+        self.assertEqual(list(sizes), [16, 24, 64])
+        self.assertEqual(list(counts), [3, 3, 1])
+        self.assertEqual(list(totals), [48, 72, 64])
+        # the same type name in two heaps
+        names, counts, totals = snapshot.count_per_type()
+        self.assertEqual(names, ['buffer', 'list_node'])
+        self.assertEqual(list(counts), [1, 3])
+        self.assertEqual(list(totals), [64, 48])
+
+    def test_dirty_rows(self):
+        dumpname = os.path.sep.join([self.folder, 'dirty'])
+        make_snapshot(dumpname, {0x1000: [(16, 'list_node'), (16, False)]})
+        # a heap without a record table
+        utils.int_array_save(config.get_cache_filename(config.CACHE_MALLOC_CHUNKS_SIZES, dumpname, 0x9000), [16])
+        snapshot = growth.Snapshot(dumpname)
+        sizes, counts, totals = snapshot.count_per_size()
+        self.assertEqual(list(counts), [3])
+        names, counts, totals = snapshot.count_per_type()
+        self.assertEqual(names, ['list_node'])
+        self.assertEqual(list(counts), [1])
+
+    def test_ranking(self):
+        analysis = growth.GrowthAnalysis(self.dumps)
+        self.assertEqual(analysis.types, ['buffer', 'list_node'])
+        ranking = analysis.ranking('type', 'count')
+        self.assertEqual(ranking[0][0], 'list_node')
+        self.assertEqual(ranking[0][1], 2)
+        self.assertTrue(ranking[0][3])
+        self.assertEqual(ranking[0][4], [1, 2, 3])
+        self.assertEqual(ranking[1][:2], ('buffer', 0))
+        ranking = analysis.ranking('size', 'bytes', top=1)
+        self.assertEqual(len(ranking), 1)
+        self.assertEqual(ranking[0][0], 24)
+        self.assertEqual(ranking[0][4], [24, 48, 72])
+        self.assertAlmostEqual(ranking[0][2], 24.0)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            growth.GrowthAnalysis(self.dumps[:1])
+        analysis = growth.GrowthAnalysis(self.dumps)
+        with self.assertRaises(ValueError):
+            analysis.ranking('address')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.incremental ."""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from haystack.reverse import config
+from haystack.reverse import fieldtypes
+from haystack.reverse import incremental
+from haystack.reverse import structure
+from haystack.reverse.heuristics import dsa
+from haystack.reverse.heuristics import pointertypes
+from test.haystack.reverse import fakes
+
+log = logging.getLogger('test_incremental')
+
+
+class TestIncremental(unittest.TestCase):
+
+    def test_allocations_hashes(self):
+        content1 = b'A' * 16 + b'B' * 16 + b'C' * 16
+        content2 = b'A' * 16 + b'X' * 16 + b'C' * 16
+        handler1 = fakes.FakeMemoryHandler('dump1', [fakes.FakeMapping(0x1000, content1),
+                                                     fakes.FakeMapping(0x8000, b'D' * 16)])
+        handler2 = fakes.FakeMemoryHandler('dump2', [fakes.FakeMapping(0x1000, content2),
+                                                     fakes.FakeMapping(0x8000, b'D' * 16)])
+        addresses = [0x1000, 0x1010, 0x1020, 0x8000]
+        sizes = [16, 16, 16, 16]
+        hashes1 = incremental.allocations_hashes(handler1, addresses, sizes)
+        hashes2 = incremental.allocations_hashes(handler2, addresses, sizes)
+        self.assertEqual(hashes1.dtype, numpy.int64)
+        self.assertEqual(list(hashes1 == hashes2), [True, False, True, True])
+        # same content, different addresses
+        hashes = incremental.allocations_hashes(handler1, [0x1000, 0x1008], [8, 8])
+        self.assertEqual(hashes[0], hashes[1])
+
+    def test_match_allocations(self):
+        previous_addresses = [0x1000, 0x1010, 0x1020, 0x1040]
+        previous_sizes = [16, 16, 32, 16]
+        previous_hashes = [1, 2, 3, 4]
+        addresses = [0x1000, 0x1010, 0x1020, 0x1030, 0x2000]
+        sizes = [16, 16, 16, 16, 16]
+        hashes = [1, 5, 3, 4, 6]
+        known, unchanged = incremental.match_allocations(addresses, sizes, hashes,
+                                                         previous_addresses, previous_sizes, previous_hashes)
+        self.assertEqual(list(known), [True, True, True, False, False])
+        # changed content, changed size
+        self.assertEqual(list(unchanged), [True, False, False, False, False])
+
+    def test_match_no_previous(self):
+        known, unchanged = incremental.match_allocations([0x1000], [16], [1], [], [], [])
+        self.assertFalse(known.any())
+        self.assertFalse(unchanged.any())
+
+    def test_records_pointing_to(self):
+        records_addresses = [0x1000, 0x1020, 0x1040]
+        records_sizes = [0x20, 0x10, 0x10]
+        # 0x1008 -> 0x2004, 0x1020 -> 0x1000, 0x1048 -> 0x2010, 0x3000 -> 0x2000
+        pointers_addresses = [0x1008, 0x1020, 0x1048, 0x3000]
+        pointers_values = [0x2004, 0x1000, 0x2010, 0x2000]
+        res = incremental.records_pointing_to(records_addresses, records_sizes, pointers_addresses, pointers_values,
+                                              [0x2000], [0x10])
+        self.assertEqual(res.tolist(), [0x1000])
+        res = incremental.records_pointing_to(records_addresses, records_sizes, pointers_addresses, pointers_values,
+                                              [0x1000, 0x2000], [0x20, 0x20])
+        self.assertEqual(res.tolist(), [0x1000, 0x1020, 0x1040])
+        res = incremental.records_pointing_to(records_addresses, records_sizes, [], [], [0x2000], [0x10])
+        self.assertEqual(res.tolist(), [])
+
+
+class TestReusedRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        config.create_cache_folder(self.dumpname)
+        memory_handler = fakes.FakeMemoryHandler(self.dumpname, [])
+        fields = [fieldtypes.Field('ptr_0', 0, fieldtypes.POINTER, 8, False),
+                  fieldtypes.Field('zerroes_8', 8, fieldtypes.ZEROES, 8, False)]
+        self.records = [structure.AnonymousRecord(memory_handler, address, 16)
+                        for address in [0x1000, 0x1010, 0x1020, 0x1030]]
+        list_type = fieldtypes.RecordType('list_entry', 16, fields)
+        for _record in self.records[:3]:
+            _record.set_record_type(list_type, True)
+            _record.set_reverse_level(pointertypes.PointerFieldReverser.REVERSE_LEVEL)
+            _record._dirty = False
+        # 0x1000 points to the changed allocation 0x1030, 0x1010 to 0x1000
+        self.heap_context = fakes.FakeHeapContext(self.dumpname, records=self.records,
+                                                  pointers_addresses=[0x1000, 0x1010],
+                                                  pointers_values=[0x1030, 0x1000])
+        self.process_context = fakes.FakeProcessContext([self.heap_context])
+        memory_handler.process_context = self.process_context
+        self.reverser = incremental.IncrementalReverser(memory_handler, '/tmp/previous')
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_register_record_types(self):
+        self.reverser._register_record_types(self.heap_context, numpy.array([0x1000, 0x1010, 0x1030]))
+        self.assertEqual(len(self.process_context.reversed_types), 1)
+        record_type, members = list(self.process_context.reversed_types.items())[0]
+        self.assertEqual(record_type.type_name, 'list_entry')
+        # 0x1030 has its default type
+        self.assertEqual(members, [0x1000, 0x1010])
+
+    def test_reset_stale_records(self):
+        self.reverser._reused[0x1000] = (numpy.array([0x1000, 0x1010, 0x1020]), numpy.array([16, 16, 16]))
+        self.reverser._changed.append((numpy.array([0x1030]), numpy.array([16])))
+        self.reverser._reset_stale_records()
+        levels = [_record.get_reverse_level() for _record in self.records[:3]]
+        self.assertEqual(levels, [dsa.TextFieldCorrection.REVERSE_LEVEL,
+                                  pointertypes.PointerFieldReverser.REVERSE_LEVEL,
+                                  pointertypes.PointerFieldReverser.REVERSE_LEVEL])
+        # saved
+        self.assertEqual(os.listdir(config.get_record_cache_folder_name(self.dumpname)), ['struct_1000'])
+        table = self.heap_context.get_record_table()
+        self.assertEqual(table.select(with_dirty=False).tolist(), [0x1000])
+        self.assertEqual(self.reverser.get_statistics()['stale'], 1)
+        self.assertEqual(self.heap_context.nb_save, 1)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
@@ -383,6 +383,111 @@ class TestFunctions(unittest.TestCase):
         self.assertEqual(pattern.findPatternText(sig, 1, 5), sig_res)
 
 
+def findPatternNaive(sequence, minNbGroup=2):
+    """findPattern with the substrings counting algorithm, for elSize == 1"""
+    if sequence == '':
+        return []
+    best = pattern._findBestRepeat(sequence, 1, minNbGroup)
+    if best is None:
+        return [(1, sequence)]
+    nb, value = best
+    i = sequence.find(value * nb)
+    return (findPatternNaive(sequence[:i], minNbGroup) + [best] +
+            findPatternNaive(sequence[i + len(value) * nb:], minNbGroup))
+
+
+class TestFindPatternRuns(unittest.TestCase):
+
+    def test_random(self):
+        import random
+        rng = random.Random(1)
+        for alphabet in ['ab', 'abc', 'abcdef']:
+            for _ in range(100):
+                sig = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+                for minNbGroup in [2, 3]:
+                    self.assertEqual(pattern.findPattern(sig, 1, minNbGroup), findPatternNaive(sig, minNbGroup), sig)
+
+    def test_bytes(self):
+        sig = b'aaaaa1111bbbccda2a2a2a2a2b1cb1cb1cb1cabcdabcdabcdabcdpooiiiuuuuyyyyy'
+        self.assertEqual(pattern.findPattern(sig, 1), findPatternNaive(sig))
+
+    def test_benchmark(self):
+        import time
+        sig = 'P4' + 'I4u4z4P4' * 30 + 'u172z4' + 'I4T8z4I4z4' * 10 + 'u4z26336'
+        t0 = time.time()
+        naive = findPatternNaive(sig)
+        t1 = time.time()
+        runs = pattern.findPattern(sig, 1)
+        t2 = time.time()
+        self.assertEqual(runs, naive)
+        log.info('findPattern on %d chars: naive %2.3fs, runs %2.3fs', len(sig), t1 - t0, t2 - t1)
+        # a long signature
+        sig = 'P4' + 'I4u4z4P4' * 1000 + 'u172z4' + 'I4T8z4I4z4' * 500 + 'u4z26336'
+        t0 = time.time()
+        ret = pattern.findPattern(sig, 1)
+        log.info('findPattern on %d chars: runs %2.3fs', len(sig), time.time() - t0)
+        self.assertIn((1000, 'I4u4z4P4'), ret)
+
+
+class FakeSignature(object):
+    def __init__(self, sig):
+        self.sig = sig
+
+
+def mapToSignatureSets(seq, common, length):
+    """the tuple sets version of PinnedPointersMapper._mapToSignature"""
+    seqs = pattern.SequencesMaker(seq, length, False)
+    uncommon = []
+    aggregated = []
+    start = stop = i = 0
+    enum_seqs = enumerate(seqs)
+    while i < len(seqs):
+        for i, subseq in enum_seqs:
+            if subseq in common:
+                start = i
+                uncommon.append((stop, start))
+                break
+        for i, subseq in enum_seqs:
+            if subseq in common:
+                continue
+            stop = i
+            aggregated.append((start, stop + length - 1 - start))
+            break
+    return uncommon, aggregated
+
+
+class TestCommonSequences(unittest.TestCase):
+
+    def test_windowHashes(self):
+        seq = [8, 16, 8, 16, 8, 24]
+        hashes = pattern.windowHashes(seq, 2)
+        self.assertEqual(len(hashes), 5)
+        self.assertEqual(hashes[0], hashes[2])
+        self.assertNotEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes[3], hashes[4])
+        self.assertEqual(len(pattern.windowHashes(seq, 7)), 0)
+
+    def test_mapToSignature(self):
+        import random
+        rng = random.Random(2)
+        length = 3
+        for _ in range(50):
+            seqs = [[rng.choice([8, 16, 24]) for _ in range(rng.randint(length, 40))] for _ in range(2)]
+            mapper = pattern.PinnedPointersMapper(8, length)
+            sigs = [FakeSignature(seq) for seq in seqs]
+            for sig in sigs:
+                mapper.addSignature(sig)
+            mapper.common = mapper._findCommonSequences()
+            common = set(pattern.SequencesMaker(seqs[0], length, False).sets[length])
+            common &= pattern.SequencesMaker(seqs[1], length, False).sets[length]
+            self.assertEqual(len(mapper.common), len(common))
+            for sig in sigs:
+                uncommon, pps = mapper._mapToSignature(sig)
+                expected_uncommon, expected_pps = mapToSignatureSets(sig.sig, common, length)
+                self.assertEqual(uncommon, expected_uncommon)
+                self.assertEqual([(pp.offset, len(pp)) for pp in pps], expected_pps)
+
+
 class TestPatternEncoder(unittest.TestCase):
 
     def test_makePattern_1(self):
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.query ."""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from haystack.reverse import query
+from test.haystack.reverse import bench_startup
+from test.haystack.reverse import fakes
+
+log = logging.getLogger('test_query')
+
+
+class TestRecordQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        self.memory_handler = fakes.make_reversed_dump(self.dumpname)
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_not_reversed(self):
+        folder = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(IOError):
+                query.RecordQuery(fakes.FakeMemoryHandler(folder, []))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_record_address(self):
+        record_query = query.RecordQuery(self.memory_handler)
+        self.assertEqual(record_query.get_record_address_at_address(0x1010), (0x1010, 0x20))
+        self.assertEqual(record_query.get_record_address_at_address(0x102f), (0x1010, 0x20))
+        self.assertEqual(record_query.get_record_address_at_address(0x80ff), (0x8000, 0x100))
+        for address in [0x1000, 0x1030, 0x1050, 0x8100, 0x0]:
+            with self.assertRaises(ValueError):
+                record_query.get_record_address_at_address(address)
+        self.assertEqual(record_query.get_heap_address_for_record(0x1040), 0x1000)
+        self.assertEqual(record_query.get_heap_address_for_record(0x8000), 0x8000)
+        with self.assertRaises(ValueError):
+            record_query.get_heap_address_for_record(0x1044)
+
+    def test_records_addresses(self):
+        record_query = query.RecordQuery(self.memory_handler)
+        addresses, sizes = record_query.get_records_addresses_at_addresses([0x8010, 0x1000, 0x1044, 0x1011, 0x9000])
+        self.assertEqual(addresses.tolist(), [0x8000, query.NO_RECORD, 0x1040, 0x1010, query.NO_RECORD])
+        self.assertEqual(sizes.tolist(), [0x100, 0, 0x10, 0x20, 0])
+        # addresses of the kernel space, or out of 64 bits
+        addresses, sizes = record_query.get_records_addresses_at_addresses([0xffff800000001000, 0x1044, 2**64])
+        self.assertEqual(addresses.tolist(), [query.NO_RECORD, 0x1040, query.NO_RECORD])
+        with self.assertRaises(ValueError):
+            record_query.get_record_address_at_address(0xffffffffffffffff)
+        res = list(record_query.iter_records_bytes([0x1044, 0x9000]))
+        self.assertEqual(res, [(0x1040, bytes(bytearray(range(0x40, 0x50)))), (query.NO_RECORD, None)])
+
+    def test_record(self):
+        record_query = query.RecordQuery(self.memory_handler)
+        self.assertEqual(record_query.get_record_bytes(0x1044), bytes(bytearray(range(0x40, 0x50))))
+        _record = record_query.get_record_at_address(0x1018)
+        self.assertEqual(_record.address, 0x1010)
+        self.assertEqual(len(_record), 0x20)
+        self.assertEqual(_record.bytes, bytes(bytearray(range(0x10, 0x30))))
+        parents = record_query.get_predecessors(record_query.get_record(0x1040))
+        self.assertEqual([p.address for p in parents], [0x1010, 0x8000])
+        with self.assertRaises(IOError):
+            record_query.get_record(0x1020)
+
+
+class TestFolderDump(unittest.TestCase):
+    """Queries on a generated folder dump of 4 heaps, as bench_startup"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.dumpname = os.path.sep.join([self.folder, 'dump'])
+        self.addresses = bench_startup.make_dump(self.dumpname, 0x40000, heap_size=0x10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_mapping_for_address(self):
+        memory_handler = query.load_folder_dump(self.dumpname, bits=64, os_name='linux')
+        self.assertEqual(len(memory_handler.get_mappings()), 4)
+        for i in range(4):
+            start = bench_startup.HEAPS_START + i * 0x20000
+            self.assertEqual(memory_handler.get_mapping_for_address(start).start, start)
+            self.assertEqual(memory_handler.get_mapping_for_address(start + 0xffff).start, start)
+            self.assertFalse(memory_handler.get_mapping_for_address(start + 0x10000))
+        self.assertFalse(memory_handler.get_mapping_for_address(bench_startup.HEAPS_START - 1))
+        record_query = query.RecordQuery(memory_handler)
+        for address in self.addresses:
+            _record = record_query.get_record_at_address(address)
+            self.assertEqual(_record.address, address - 8)
+            self.assertEqual(_record.bytes, b'\x00' * bench_startup.ALLOCATION_SIZE)
+
+    def test_commands(self):
+        for command, runs, output in bench_startup.time_queries(self.dumpname, self.addresses, repeat=1):
+            res = [json.loads(line) for line in output.splitlines()]
+            self.assertEqual([r['record'] for r in res], ['0x%x' % (address - 8) for address in self.addresses])
+            if command == 'parents':
+                for r, address in zip(res, self.addresses):
+                    self.assertEqual(r['parents'], ['0x%x' % (address - 8 - bench_startup.ALLOCATION_SIZE)])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
@@ -5,6 +5,7 @@
 
 from __future__ import print_function
 import logging
+import random
 import unittest
 
 from haystack.reverse import re_string
@@ -199,6 +200,44 @@ class TestReString(unittest.TestCase):
                     self.test10) - 3))
 
 
+class TestGuessEncodings(unittest.TestCase):
+
+    def test_guess_encodings(self):
+        self.assertEqual(re_string.guess_encodings(b'hello world\x00'), ['utf_8'])
+        self.assertEqual(re_string.guess_encodings('h\xe9llo\x00'.encode('utf-8')), ['utf_8', 'latin_1'])
+        # 0xff is not utf-8
+        self.assertEqual(re_string.guess_encodings('h\xe9llo\x00\xff'.encode('latin-1')), ['latin_1'])
+        self.assertEqual(re_string.guess_encodings('wide!'.encode('utf-16le')), ['utf_8', 'utf_16le'])
+        self.assertEqual(re_string.guess_encodings('wide'.encode('utf-32le')), ['utf_8', 'utf_16le', 'utf_32le'])
+        # no printable characters in wide encodings
+        self.assertEqual(re_string.guess_encodings(b'\x1e\x1c\x8c\xd8\xcc\x01'), ['utf_8', 'latin_1'])
+
+    def test_guess_encodings_batch(self):
+        arrays = [b'hello world\x00', b'\x1e\x1c\x8c\xd8\xcc\x01', b'', 'wide'.encode('utf-16le')]
+        self.assertEqual(re_string.guess_encodings_batch(arrays), [re_string.guess_encodings(b) for b in arrays])
+        self.assertEqual(re_string.guess_encodings_batch([]), [])
+
+    def test_same_results(self):
+        """The encodings not guessed would not change the results"""
+        rng = random.Random(0)
+        alphabets = ['abcdefgh XYZ\t', 'abc\xe9fgh\u20ac XYZ', 'abc\U0001F600 XYZ']
+        arrays = [b'', b'\x00\x00\x00\x00', 'C:\\Windows\x00'.encode('utf-16le'), b'edrt\x00fguy\xf1\x07\x00']
+        for _ in range(2000):
+            text = ''.join(rng.choice(rng.choice(alphabets)) for _ in range(rng.randint(1, 30)))
+            encoding = rng.choice(['utf-8', 'utf-16le', 'utf-32le', 'latin-1'])
+            b = text.encode(encoding, 'replace')
+            if rng.random() < 0.3:
+                b = bytes(bytearray(rng.randint(0, 255) for _ in range(len(b))))
+            b += b'\x00' * rng.randint(0, 8) + bytes(bytearray(rng.randint(0, 255) for _ in range(rng.randint(0, 8))))
+            arrays.append(b)
+        results = re_string.try_decode_strings(arrays)
+        for b, result in zip(arrays, results):
+            codecs = re_string._py_encodings if b.find(b'\x00') != -1 else None
+            self.assertEqual(result, re_string.try_decode_string(b, codecs=codecs))
+            self.assertEqual(re_string.startsWithNulTerminatedString(b),
+                             re_string.startsWithNulTerminatedString(b, codecs=re_string._py_encodings))
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     # logging.getLogger("re_string").setLevel(level=logging.DEBUG)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.recordtable ."""
+
+import logging
+import shutil
+import tempfile
+import unittest
+
+from haystack.reverse import config
+from haystack.reverse import recordtable
+from test.haystack.reverse import fakes
+
+log = logging.getLogger('test_recordtable')
+
+
+class TestRecordTable(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        config.create_cache_folder(self.dumpname)
+        self.heap_context = fakes.FakeHeapContext(self.dumpname, [0x1000, 0x1020, 0x1040, 0x1080], [32, 32, 64, 16])
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_update_select(self):
+        table = recordtable.get_record_table(self.heap_context)
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.get_dirty_count(), 4)
+        # dirty rows are always selected
+        self.assertEqual(table.select(max_reverse_level=10).tolist(), [0x1000, 0x1020, 0x1040, 0x1080])
+        self.assertEqual(table.select(max_reverse_level=10, with_dirty=False).tolist(), [])
+        table.update(fakes.FakeRecord(0x1000, 32, 50, 'P4P4z24', 'list_node'))
+        table.update(fakes.FakeRecord(0x1020, 32, 10, 'P4P4z24'))
+        table.update(fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer'))
+        # not an allocation
+        table.update(fakes.FakeRecord(0x1044, 8, 50, 'T8'))
+        self.assertEqual(table.get_dirty_count(), 1)
+        self.assertEqual(table.select(max_reverse_level=50).tolist(), [0x1020, 0x1080])
+        self.assertEqual(table.select(max_reverse_level=50, with_dirty=False).tolist(), [0x1020])
+        self.assertEqual(table.select(sizes=[32], with_dirty=False).tolist(), [0x1000, 0x1020])
+        self.assertEqual(table.type_names, ['list_node', 'buffer'])
+        self.assertEqual(table.select(type_id=1, with_dirty=False).tolist(), [0x1040])
+        self.assertEqual(table.select(type_id=recordtable.NO_ID, with_dirty=False).tolist(), [0x1020])
+        layouts, counts = table.count_per_layout()
+        self.assertEqual(layouts, ['P4P4z24', 'T64'])
+        self.assertEqual(counts.tolist(), [2, 1])
+        row = table.table[:, 0]
+        self.assertEqual(row[recordtable.SIGNATURE_HASH], recordtable.signature_hash('P4P4z24'))
+        table.set_dirty(0x1000)
+        self.assertEqual(table.get_dirty_count(), 2)
+
+    def test_update_unchanged(self):
+        table = recordtable.get_record_table(self.heap_context)
+        table.update(fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer'))
+        table.save(self.heap_context)
+        # the same values do not modify the table
+        table.update(fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer'))
+        self.assertFalse(table._modified)
+        table.update(fakes.FakeRecord(0x1040, 64, 60, 'T64', 'buffer'))
+        self.assertTrue(table._modified)
+        self.assertEqual(table.table[recordtable.REVERSE_LEVEL, 2], 60)
+
+    def test_update_loaded(self):
+        table = recordtable.get_record_table(self.heap_context)
+        table.update(fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer'))
+        table.update(fakes.FakeRecord(0x1000, 32, 50, 'P4P4z24'))
+        table.save(self.heap_context)
+        # a clean row of the same record does not compute its signature
+        for _record in [fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer'), fakes.FakeRecord(0x1000, 32, 50, 'P4P4z24')]:
+            table.update_loaded(_record)
+            self.assertFalse(hasattr(_record, 'nb_signatures'))
+        self.assertFalse(table._modified)
+        # a dirty row, or another type, is updated
+        _record = fakes.FakeRecord(0x1020, 32, 10, 'P4P4z24')
+        table.update_loaded(_record)
+        self.assertEqual(_record.nb_signatures, 1)
+        table.update_loaded(fakes.FakeRecord(0x1040, 64, 50, 'T64', 'other'))
+        self.assertEqual(table.type_names, ['buffer', 'other'])
+        self.assertEqual(table.get_dirty_count(), 1)
+
+    def test_save_load(self):
+        table = recordtable.get_record_table(self.heap_context)
+        table.update(fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer'))
+        table.save(self.heap_context)
+        table = recordtable.RecordTable.load(self.heap_context)
+        self.assertEqual(table.get_dirty_count(), 3)
+        self.assertEqual(table.type_names, ['buffer'])
+        self.assertEqual(table.layouts, ['T64'])
+        self.assertEqual(table.table[recordtable.REVERSE_LEVEL].tolist(), [0, 0, 50, 0])
+        # the allocations changed
+        self.heap_context._structures_addresses = [0x1000]
+        self.heap_context._structures_sizes = [32]
+        with self.assertRaises(IOError):
+            recordtable.RecordTable.load(self.heap_context)
+        self.assertEqual(recordtable.get_record_table(self.heap_context).get_dirty_count(), 1)
+
+    def test_update_dirty_rows(self):
+        # 0x1080 is not in the records cache
+        records = [fakes.FakeRecord(0x1000, 32, 50, 'P4P4z24', 'list_node'), fakes.FakeRecord(0x1020, 32, 10, 'P4P4z24'),
+                   fakes.FakeRecord(0x1040, 64, 50, 'T64', 'buffer')]
+        heap_context = fakes.FakeHeapContext(self.dumpname, [0x1000, 0x1020, 0x1040, 0x1080], [32, 32, 64, 16],
+                                             records=records)
+        heap_context.get_record_table().update(records[0])
+        recordtable.update_dirty_rows(heap_context)
+        # clean rows are not loaded
+        self.assertEqual(heap_context.loaded, [0x1020, 0x1040, 0x1080])
+        table = recordtable.RecordTable.load(heap_context)
+        self.assertEqual(table.select(with_dirty=False).tolist(), [0x1000, 0x1020, 0x1040])
+        self.assertEqual(table.table[recordtable.TYPE_ID].tolist()[:3], [0, recordtable.NO_ID, 1])
+        self.assertEqual(table.type_names, ['list_node', 'buffer'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
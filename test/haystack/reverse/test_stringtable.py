@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.stringtable ."""
+
+import logging
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from haystack.reverse import config
+from haystack.reverse import stringtable
+
+log = logging.getLogger('test_stringtable')
+
+
+class TestScanStrings(unittest.TestCase):
+
+    def test_ascii_utf16(self):
+        content = b'\x01\x02hello world\x00\x00' + 'bonjour'.encode('utf-16le') + b'\xff\xffabc\x00'
+        addresses, lengths, encodings = stringtable.scan_strings(content, 0x1000)
+        self.assertEqual(list(addresses), [0x1002, 0x100f])
+        self.assertEqual(list(lengths), [11, 14])
+        self.assertEqual(list(encodings), [stringtable.ENCODING_ASCII, stringtable.ENCODING_UTF16LE])
+
+    def test_utf16_after_ascii(self):
+        # the first UTF-16 character is not the last ASCII character
+        content = b'\x01abcdef' + 'ghijkl'.encode('utf-16le')
+        addresses, lengths, encodings = stringtable.scan_strings(content)
+        self.assertEqual(list(addresses), [1, 7])
+        self.assertEqual(list(lengths), [6, 12])
+
+    def test_owning_records(self):
+        allocations = [0x100, 0x200]
+        sizes = [0x10, 0x20]
+        res = stringtable.owning_records([0x50, 0x100, 0x10f, 0x110, 0x21f, 0x300], allocations, sizes)
+        self.assertEqual(list(res), [-1, 0x100, 0x100, -1, 0x200, -1])
+        res = stringtable.owning_records([0x50], [], [])
+        self.assertEqual(list(res), [-1])
+
+
+class TestStringTable(unittest.TestCase):
+
+    def setUp(self):
+        self.dumpname = tempfile.mkdtemp()
+        config.create_cache_folder(self.dumpname)
+
+    def tearDown(self):
+        shutil.rmtree(self.dumpname)
+
+    def test_build_save_load(self):
+        content = numpy.zeros(0x100, dtype=numpy.uint8)
+        for offset, value in [(0x10, b'duplicate'), (0x40, b'duplicate'), (0x80, 'wide'.encode('utf-16le')),
+                              (0xe0, b'unallocated')]:
+            content[offset:offset + len(value)] = numpy.frombuffer(value, dtype=numpy.uint8)
+        table = stringtable.StringTable.build(content, 0x1000, [0x1000, 0x1040, 0x1080], [0x20, 0x20, 0x20])
+        self.assertEqual(len(table), 4)
+        self.assertEqual(table.values, ['duplicate', 'wide', 'unallocated'])
+        self.assertEqual(list(table.table[stringtable.RECORD]), [0x1000, 0x1040, 0x1080, -1])
+        self.assertEqual(list(table.table[stringtable.STRING_ID]), [0, 0, 1, 2])
+        table.save(self.dumpname, 0x1000)
+        table = stringtable.StringTable.load(self.dumpname, 0x1000)
+        self.assertEqual(table.values, ['duplicate', 'wide', 'unallocated'])
+        self.assertEqual(table.get_strings_for_record(0x1080), [(0x1080, 'wide')])
+        self.assertEqual(table.get_addresses_for_value('duplicate'), [0x1010, 0x1040])
+        self.assertEqual(table.get_addresses_for_value('nothing'), [])
+
+    def test_records_strings(self):
+        content = numpy.zeros(0x100, dtype=numpy.uint8)
+        for offset, value in [(0x04, b'first'), (0x10, b'second'), (0x24, b'free'), (0x44, b'third'),
+                              (0x64, b'unallocated')]:
+            content[offset:offset + len(value)] = numpy.frombuffer(value, dtype=numpy.uint8)
+        table = stringtable.StringTable.build(content, 0x1000, [0x1000, 0x1030, 0x1040], [0x20, 0x10, 0x20])
+        self.assertEqual(table.get_strings_for_record(0x1000), [(0x1004, 'first'), (0x1010, 'second')])
+        self.assertEqual(table.get_strings_for_record(0x1030), [])
+        self.assertEqual(table.get_strings_for_record(0x1040), [(0x1044, 'third')])
+        self.assertEqual(table.get_strings_for_record(0x1020), [])
+        self.assertEqual(list(table.iter_records_strings()),
+                         [(0x1004, 5, 'first'), (0x1010, 6, 'second'), (0x1044, 5, 'third')])
+
+    def test_load_missing(self):
+        with self.assertRaises(IOError):
+            stringtable.StringTable.load(self.dumpname, 0x1000)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests haystack.reverse.typelibrary ."""
+
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from haystack.reverse import config
+from haystack.reverse import typelibrary
+
+log = logging.getLogger('test_typelibrary')
+
+
+class TestTypeLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = os.path.sep.join([tempfile.mkdtemp(), 'types'])
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.folder))
+
+    def test_signature_hash(self):
+        h1 = typelibrary.signature_hash(16, 'P4i4z8')
+        self.assertEqual(h1, typelibrary.signature_hash(16, 'P4i4z8'))
+        self.assertNotEqual(h1, typelibrary.signature_hash(24, 'P4i4z8'))
+
+    def test_empty(self):
+        library = typelibrary.TypeLibrary(self.folder)
+        self.assertEqual(len(library), 0)
+        self.assertIsNone(library.lookup(16, 'P4i4z8'))
+        self.assertIsNone(library.lookup(16, 'P4i4z8', fuzzy=True))
+
+    def test_add_save_load(self):
+        library = typelibrary.TypeLibrary(self.folder)
+        self.assertEqual(library.add('list_entry', 16, 'P4P4z8', [('P', 4), ('P', 4), ('z', 8)]), 'list_entry')
+        library.add('counter', 8, 'u4u4')
+        # known signature, the known name wins
+        self.assertEqual(library.add('other', 16, 'P4P4z8'), 'list_entry')
+        self.assertEqual(library.lookup(16, 'P4P4z8'), 'list_entry')
+        library.save()
+        self.assertTrue(os.access(os.path.sep.join([self.folder, config.TYPE_LIBRARY_ENTRIES]), os.F_OK))
+
+        library = typelibrary.TypeLibrary(self.folder)
+        self.assertEqual(len(library), 2)
+        self.assertEqual(library.lookup(16, 'P4P4z8'), 'list_entry')
+        self.assertEqual(library.lookup(8, 'u4u4'), 'counter')
+        self.assertIsNone(library.lookup(8, 'P4P4z8'))
+        self.assertEqual([e.name for e in library.get_entries_for_size(16)], ['list_entry'])
+        # similar signature of the same size
+        self.assertIsNone(library.lookup(16, 'P4P4z4u4'))
+        self.assertEqual(library.lookup(16, 'P4P4z4u4', fuzzy=True, threshold=0.5), 'list_entry')
+
+    def test_confirm(self):
+        library = typelibrary.TypeLibrary(self.folder)
+        # generated names are unconfirmed
+        self.assertEqual(library.add('generated', 16, 'P4P4z8'), 'generated')
+        self.assertFalse(library.get_entries()[0].confirmed)
+        self.assertTrue(library.has_name('generated'))
+        # a confirmed name replaces a generated name
+        self.assertEqual(library.add('list_entry', 16, 'P4P4z8', confirmed=True), 'list_entry')
+        self.assertEqual(library.add('other', 16, 'P4P4z8', confirmed=True), 'list_entry')
+        self.assertFalse(library.has_name('generated'))
+        library.add('generated2', 8, 'u4u4')
+        library.add('generated2', 12, 'u4u4u4')
+        self.assertEqual(library.rename('generated2', 'counter'), 2)
+        self.assertEqual(library.rename('nothing', 'counter'), 0)
+        self.assertEqual(library.lookup(12, 'u4u4u4'), 'counter')
+        library.add('generated3', 4, 'u4')
+        self.assertEqual(library.confirm('generated3'), 1)
+        library.save()
+        library = typelibrary.TypeLibrary(self.folder)
+        self.assertEqual([e.confirmed for e in library.get_entries()], [True, True, True, True])
+
+    def test_cmdline(self):
+        library = typelibrary.TypeLibrary(self.folder)
+        library.add('generated', 16, 'P4P4z8')
+        library.add('counter', 8, 'u4u4', confirmed=True)
+        library.save()
+        with mock.patch.object(sys, 'stdout', new_callable=io.StringIO) as stdout:
+            typelibrary.main(['--library', self.folder, 'list', '--unconfirmed'])
+        self.assertEqual(stdout.getvalue().split(), ['generated', '16', '1', 'P4P4z8'])
+        typelibrary.main(['--library', self.folder, 'rename', 'generated', 'list_entry'])
+        self.assertEqual(typelibrary.TypeLibrary(self.folder).lookup(16, 'P4P4z8'), 'list_entry')
+        with mock.patch.object(sys, 'stderr', new_callable=io.StringIO):
+            with self.assertRaises(SystemExit):
+                typelibrary.main(['--library', self.folder, 'confirm', 'nothing'])
+
+    def test_default_folder(self):
+        os.environ[config.TYPE_LIBRARY_ENV] = self.folder
+        try:
+            self.assertEqual(config.get_type_library_folder(), os.path.abspath(self.folder))
+        finally:
+            del os.environ[config.TYPE_LIBRARY_ENV]
+        self.assertEqual(config.get_type_library_folder('/tmp/x'), '/tmp/x')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    unittest.main(verbosity=2)